@@ -0,0 +1,88 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset-пагинация ленты рецептов.
+
+    Страница выбирается условием по паре (pub_date, id) вместо OFFSET,
+    общее количество рецептов не подсчитывается, а ссылки на соседние
+    страницы содержат непрозрачный курсор с позицией крайнего рецепта.
+    Пара (pub_date, id) уникальна, поэтому смещение в курсоре
+    не используется.
+    """
+
+    ordering = ("-pub_date", "-id")
+    position_separator = "|"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by("pub_date", "id")
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            pub_date, pk = self.parse_position(position)
+            lookup = "gt" if reverse else "lt"
+            queryset = queryset.filter(
+                Q(**{f"pub_date__{lookup}": pub_date})
+                | Q(pub_date=pub_date, **{f"id__{lookup}": pk})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = (
+            self._get_position_from_instance(self.page[-1], self.ordering)
+            if self.page
+            else None
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = (
+            self._get_position_from_instance(self.page[0], self.ordering)
+            if self.page
+            else self.cursor.position
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position)
+        )
+
+    def parse_position(self, position: str):
+        pub_date, _, pk = position.rpartition(self.position_separator)
+        try:
+            pub_date = parse_datetime(pub_date)
+        except ValueError:
+            pub_date = None
+        if pub_date is None or not pk.isdigit():
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, int(pk)
+
+    def _get_position_from_instance(self, instance, ordering):
+        return (
+            f"{instance.pub_date.isoformat()}"
+            f"{self.position_separator}{instance.id}"
+        )
@@ -0,0 +1,30 @@
+from rest_framework.renderers import BaseRenderer
+
+from django.utils.encoding import force_str
+
+
+class PlainTextRenderer(BaseRenderer):
+    """
+    Рендерер текстовых файлов.
+
+    Содержимое файлов отдаётся потоком в обход рендерера,
+    поэтому он отрисовывает только сообщения об ошибках.
+    """
+
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if isinstance(data, dict) and "detail" in data:
+            data = data["detail"]
+        return force_str(data).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    """Рендерер CSV-файлов."""
+
+    media_type = "text/csv"
+    format = "csv"
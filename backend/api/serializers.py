@@ -1,30 +1,57 @@
 import base64
 
 from rest_framework import serializers
-from rest_framework.serializers import ImageField, ModelSerializer
+from rest_framework.serializers import FileField, ImageField, ModelSerializer
 
+from django.conf import settings
 from django.core.files.base import ContentFile
-
-from core.utils import create_ingredients
+from django.core.validators import validate_image_file_extension
+from django.db import transaction
+from django.db.models import Manager, prefetch_related_objects
+
+from core.cache import get_recipe_fragment_keys, get_recipes_cache
+from core.images import delete_images_on_commit
+from core.shopping_list import recount_shopping_lists
+from core.utils import (apply_ingredients_changes, create_ingredients,
+                        find_unknown_ingredients, get_ingredients_changes,
+                        ingredients_recipes_prefetch,)
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag,)
 from users.models import Subscribe, User
 
 
 class Base64ToImageField(ImageField):
-    """Вспомогательный класс для работы с изображениями."""
+    """Вспомогательный класс для работы с изображениями.
+
+    Принимает картинку строкой base64 в JSON или файлом
+    в multipart/form-data. Картинка сохраняется как есть: проверка,
+    сжатие и перекодирование выполняются фоновым обработчиком
+    (команда `process_recipe_images`), чтобы не занимать ими запрос.
+    """
 
     def to_internal_value(self, data):
-        format, img = data.split(";base64,")
-        ext = format.split("/")[-1]
-        data = ContentFile(base64.b64decode(img), name="temp." + ext)
-        return super().to_internal_value(data)
+        if isinstance(data, str):
+            format, img = data.split(";base64,")
+            ext = format.split("/")[-1]
+            data = ContentFile(base64.b64decode(img), name="temp." + ext)
+        validate_image_file_extension(data)
+        return FileField.to_internal_value(self, data)
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """Сериализатор, использующийся для вывода информации о пользователе."""
+def get_image_url(name: str, request=None) -> str:
+    """
+    Вспомогательная функция, возвращающая ссылку на файл картинки
+    рецепта, как её выводит `ImageField`.
+    """
+    url = Recipe._meta.get_field("image").storage.url(name)
+    return request.build_absolute_uri(url) if request else url
 
-    is_subscribed = serializers.SerializerMethodField()
+
+class AuthorSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор, использующийся для вывода информации о пользователе,
+    не зависящей от того, кто её запрашивает.
+    """
 
     class Meta:
         model = User
@@ -34,10 +61,21 @@ class UserSerializer(serializers.ModelSerializer):
             "username",
             "first_name",
             "last_name",
-            "is_subscribed",
         )
 
+
+class UserSerializer(AuthorSerializer):
+    """Сериализатор, использующийся для вывода информации о пользователе."""
+
+    is_subscribed = serializers.SerializerMethodField()
+
+    class Meta(AuthorSerializer.Meta):
+        fields = AuthorSerializer.Meta.fields + ("is_subscribed",)
+
     def get_is_subscribed(self, obj):
+        subscribed_authors = self.context.get("subscribed_authors")
+        if subscribed_authors is not None:
+            return obj.id in subscribed_authors
         request = self.context.get("request")
         return (
             request.user.is_authenticated
@@ -101,27 +139,68 @@ class ShortRecipeSerializer(ModelSerializer):
     """
     Сериализатор, использующийся для вывода
     информации о рецепте в коротком виде.
+
+    В поле `thumbnail` выводится наименьшая уменьшенная копия
+    картинки для карточек, а пока копий нет — сама картинка.
+    Поля модели, которые читает сериализатор, перечислены
+    в `model_fields`, чтобы загружать только их.
     """
 
+    thumbnail = serializers.SerializerMethodField()
+    model_fields = ("id", "name", "image", "image_thumbnails", "cooking_time")
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "thumbnail", "cooking_time")
 
+    def get_thumbnail(self, obj):
+        if not obj.image:
+            return None
+        name = min(
+            obj.image_thumbnails.items(),
+            key=lambda thumbnail: int(thumbnail[0]),
+            default=(None, obj.image.name),
+        )[1]
+        return get_image_url(name, self.context.get("request"))
 
-class FullRecipeSerializer(ModelSerializer):
+
+class RecipeImageStatusSerializer(ModelSerializer):
     """
     Сериализатор, использующийся для вывода
-    информации о рецепте в полном виде.
+    статуса фоновой обработки картинки рецепта.
+    """
+
+    class Meta:
+        model = Recipe
+        fields = ("id", "image", "image_status")
+
+
+class BulkRecipesSerializer(serializers.Serializer):
+    """
+    Сериализатор, использующийся для массового добавления/удаления
+    рецептов в/из списка избранного или списка покупок.
+    """
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+class RecipeFragmentSerializer(ModelSerializer):
+    """
+    Сериализатор, использующийся для вывода информации о рецепте,
+    не зависящей от того, кто её запрашивает.
     """
 
     image = Base64ToImageField()
-    author = UserSerializer()
+    author = AuthorSerializer()
     tags = TagSerializer(many=True)
     ingredients = IngredientRecipeSerializer(
         many=True, source="ingredients_recipes"
     )
-    is_in_shopping_cart = serializers.SerializerMethodField()
-    is_favorited = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -132,13 +211,103 @@ class FullRecipeSerializer(ModelSerializer):
             "ingredients",
             "name",
             "image",
+            "image_srcset",
             "text",
             "cooking_time",
+        )
+
+    def get_image_srcset(self, obj):
+        """
+        Возвращает уменьшенные копии картинки в формате
+        атрибута `srcset` или None, если копий нет.
+        """
+        if not obj.image_thumbnails:
+            return None
+        request = self.context.get("request")
+        return ", ".join(
+            f"{get_image_url(name, request)} {size}w"
+            for size, name in sorted(
+                obj.image_thumbnails.items(),
+                key=lambda thumbnail: int(thumbnail[0]),
+            )
+        )
+
+
+class FullRecipeListSerializer(serializers.ListSerializer):
+    """
+    Сериализатор, использующийся для вывода списка рецептов в полном виде.
+
+    Закешированные части всех рецептов списка загружаются одним запросом.
+    """
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        fragments = self.child.get_fragments(recipes)
+        return [
+            self.child.add_viewer_fields(fragments[recipe.id], recipe)
+            for recipe in recipes
+        ]
+
+
+class FullRecipeSerializer(RecipeFragmentSerializer):
+    """
+    Сериализатор, использующийся для вывода
+    информации о рецепте в полном виде.
+
+    Общая для всех пользователей часть рецепта берётся из кеша,
+    а поля, зависящие от пользователя, добавляются при каждом выводе.
+    """
+
+    author = UserSerializer()
+    is_in_shopping_cart = serializers.SerializerMethodField()
+    is_favorited = serializers.SerializerMethodField()
+
+    class Meta(RecipeFragmentSerializer.Meta):
+        fields = RecipeFragmentSerializer.Meta.fields + (
             "is_in_shopping_cart",
             "is_favorited",
         )
+        list_serializer_class = FullRecipeListSerializer
+
+    def to_representation(self, instance):
+        fragment = self.get_fragments([instance])[instance.id]
+        return self.add_viewer_fields(fragment, instance)
+
+    def get_fragments(self, recipes):
+        keys = get_recipe_fragment_keys(
+            [recipe.id for recipe in recipes], self.context.get("request")
+        )
+        cache = get_recipes_cache()
+        cached_fragments = cache.get_many(keys.values())
+        fragment_serializer = RecipeFragmentSerializer(context=self.context)
+        fragments, missing_fragments = {}, {}
+        for recipe in recipes:
+            key = keys[recipe.id]
+            if key not in cached_fragments:
+                cached_fragments[key] = missing_fragments[key] = (
+                    fragment_serializer.to_representation(recipe)
+                )
+            fragments[recipe.id] = cached_fragments[key]
+        if missing_fragments:
+            cache.set_many(
+                missing_fragments, settings.RECIPES_CACHE_TIMEOUT
+            )
+        return fragments
+
+    def add_viewer_fields(self, fragment, instance):
+        fragment["author"]["is_subscribed"] = self.fields[
+            "author"
+        ].get_is_subscribed(instance.author)
+        fragment["is_in_shopping_cart"] = self.get_is_in_shopping_cart(
+            instance
+        )
+        fragment["is_favorited"] = self.get_is_favorited(instance)
+        return fragment
 
     def get_is_in_shopping_cart(self, obj):
+        annotated = getattr(obj, "is_in_shopping_cart", None)
+        if annotated is not None:
+            return annotated
         request = self.context.get("request")
         return (
             request.user.is_authenticated
@@ -148,6 +317,9 @@ class FullRecipeSerializer(ModelSerializer):
         )
 
     def get_is_favorited(self, obj):
+        annotated = getattr(obj, "is_favorited", None)
+        if annotated is not None:
+            return annotated
         request = self.context.get("request")
         return (
             request.user.is_authenticated
@@ -186,8 +358,33 @@ class CreateUpdateRecipeSerializer(ModelSerializer):
             raise serializers.ValidationError(
                 "Вы пытаетесь добавить в рецепт два одинаковых ингредиента."
             )
+        unknown = find_unknown_ingredients(ingredients_list)
+        if unknown:
+            raise serializers.ValidationError(
+                "Таких ингредиентов не существует: "
+                f"{', '.join(map(str, unknown))}."
+            )
         return value
 
+    def validate(self, attrs):
+        """
+        Отправляет новую картинку на обработку. Повторно загруженная
+        текущая картинка рецепта не заменяется, чтобы не сбрасывать
+        её обработку и уменьшенные копии.
+        """
+        image = attrs.get("image")
+        if (
+            image is not None
+            and self.instance is not None
+            and self.instance.image.storage.get_hashed_name(image.name, image)
+            == self.instance.image.name
+        ):
+            del attrs["image"]
+        if "image" in attrs:
+            attrs["image_status"] = Recipe.ImageStatus.PENDING
+            attrs["image_thumbnails"] = {}
+        return attrs
+
     def validate_tags(self, value):
         if not value:
             raise serializers.ValidationError("Вы не добавили ни одного тега.")
@@ -197,36 +394,56 @@ class CreateUpdateRecipeSerializer(ModelSerializer):
             )
         return value
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop("tags")
         ingredients = validated_data.pop("ingredients")
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
-        try:
-            create_ingredients(ingredients, recipe)
-        except Ingredient.DoesNotExist:
-            raise serializers.ValidationError(
-                {"ingredients": "Такой ингредиент не существует."}
-            )
+        create_ingredients(ingredients, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop("tags")
-        ingredients = validated_data.pop("ingredients")
-        instance.tags.remove()
-        instance.tags.set(tags)
-        IngredientRecipe.objects.filter(recipe=instance).delete()
+        """
+        Редактирует рецепт, изменяя только отличающиеся от текущих
+        связи с тегами и ингредиентами.
+
+        Если ингредиенты не изменились, списки покупок не пересчитываются.
+        Заменённая картинка удаляется после фиксации транзакции,
+        если на неё не ссылаются другие рецепты.
+        """
+        tags = validated_data.pop("tags", None)
+        ingredients = validated_data.pop("ingredients", None)
+        if tags is not None:
+            current_tags, tags = set(instance.tags.all()), set(tags)
+            if current_tags - tags:
+                instance.tags.remove(*(current_tags - tags))
+            if tags - current_tags:
+                instance.tags.add(*(tags - current_tags))
+        replaced_image = instance.image.name
+        replaced_thumbnails = instance.image_thumbnails.values()
         super().update(instance, validated_data)
-        try:
-            create_ingredients(ingredients, instance)
-        except Ingredient.DoesNotExist:
-            raise serializers.ValidationError(
-                {"ingredients": "Такой ингредиент не существует."}
+        if replaced_image != instance.image.name:
+            delete_images_on_commit(replaced_image, replaced_thumbnails)
+        changes = (
+            get_ingredients_changes(ingredients, instance)
+            if ingredients is not None
+            else ()
+        )
+        if any(changes):
+            with recount_shopping_lists([instance.id]):
+                apply_ingredients_changes(instance, *changes)
+            getattr(instance, "_prefetched_objects_cache", {}).pop(
+                "ingredients_recipes", None
             )
         return instance
 
     def to_representation(self, instance):
         request = self.context.get("request")
+        prefetch_related_objects(
+            [instance], "tags", ingredients_recipes_prefetch()
+        )
         return FullRecipeSerializer(
             instance, context={"request": request}
         ).data
@@ -259,15 +476,7 @@ class SubscribeSerializer(ModelSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get("request")
-        return (
-            request
-            and request.user
-            and Subscribe.objects.filter(
-                subscriber=obj.subscriber, author=obj.author
-            ).exists()
-        )
+        return bool(request and request.user and obj.pk is not None)
 
     def get_recipes(self, obj):
-        return ShortRecipeSerializer(
-            Recipe.objects.filter(author=obj.author), many=True
-        ).data
+        return ShortRecipeSerializer(obj.author.recipes.all(), many=True).data
@@ -0,0 +1,165 @@
+import re
+from unittest import skipUnless
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.shopping_list import rebuild_shopping_lists
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag, TagRecipe,)
+from users.models import Subscribe, User
+
+
+LARGE_TABLES = {
+    "recipes_recipe",
+    "recipes_tagrecipe",
+    "recipes_ingredientrecipe",
+    "recipes_favorite",
+    "recipes_shoppingcart",
+    "users_subscribe",
+    "users_user",
+}
+SEQ_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN-планы PostgreSQL")
+class QueryPlansTest(APITestCase):
+    """
+    Проверяем, что запросы эндпоинтов не читают большие таблицы
+    последовательным сканированием.
+
+    Запросы COUNT(*) постраничной пагинации не проверяются:
+    подсчёт всех строк выборки по определению читает её целиком.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            User(
+                username=f"user{number}",
+                email=f"user{number}@mail.ru",
+                first_name="Test",
+                last_name="Testov",
+            )
+            for number in range(2000)
+        )
+        cls.user = cls.users[0]
+        cls.token = Token.objects.create(user=cls.user)
+        cls.tags = Tag.objects.bulk_create(
+            Tag(
+                name=f"tag{number}",
+                color=f"#00000{number}",
+                slug=f"tag{number}",
+            )
+            for number in range(3)
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"ingredient{number}", measurement_unit="г")
+            for number in range(20)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.users[number % len(cls.users)],
+                name=f"recipe{number}",
+                image="recipe.png",
+                text="recipetext",
+                cooking_time=45,
+            )
+            for number in range(10000)
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=cls.tags[number % len(cls.tags)])
+            for number, recipe in enumerate(recipes)
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+            for recipe in recipes
+            for ingredient in cls.ingredients[:3]
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=user, recipe=recipe)
+                for user in cls.users
+                for recipe in recipes[user.id % 100::1000]
+            )
+        Subscribe.objects.bulk_create(
+            Subscribe(subscriber=user, author=author)
+            for user in cls.users
+            for author in cls.users[user.id % 100::400]
+            if user != author
+        )
+        rebuild_shopping_lists()
+        cls.recipe = recipes[0]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def assertNoSeqScans(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+            if response.streaming:
+                response.getvalue()
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                sql = query["sql"]
+                if not sql.startswith("SELECT") or sql.startswith(
+                    "SELECT COUNT(*)"
+                ):
+                    continue
+                cursor.execute("EXPLAIN " + sql)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                tables = set(SEQ_SCAN.findall(plan)) & LARGE_TABLES
+                self.assertFalse(
+                    tables,
+                    f"Запрос к {url} сканирует таблицы {tables} "
+                    f"последовательно:\n{sql}\n{plan}",
+                )
+
+    def test_recipes_list_plans(self):
+        """
+        Проверяем планы запросов ленты рецептов с фильтрами.
+        """
+        url = reverse("api:recipes-list")
+        for params in (
+            None,
+            {"cursor": ""},
+            {"author": self.users[1].id},
+            {"tags": [self.tags[0].slug, self.tags[1].slug]},
+            {"is_favorited": 1},
+            {"is_in_shopping_cart": 1},
+        ):
+            with self.subTest(params=params):
+                self.assertNoSeqScans(url, params)
+
+    def test_recipe_detail_plans(self):
+        """
+        Проверяем планы запросов страницы рецепта.
+        """
+        self.assertNoSeqScans(
+            reverse("api:recipes-detail", args=[self.recipe.id])
+        )
+
+    def test_users_plans(self):
+        """
+        Проверяем планы запросов эндпоинтов пользователей.
+        """
+        for url in (
+            reverse("api:users-list"),
+            reverse("api:users-subscriptions"),
+            reverse("api:users-me"),
+        ):
+            with self.subTest(url=url):
+                self.assertNoSeqScans(url)
+
+    def test_download_shopping_cart_plans(self):
+        """
+        Проверяем планы запросов скачивания списка покупок.
+        """
+        self.assertNoSeqScans(reverse("api:recipes-download_shopping_cart"))
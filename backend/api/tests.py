@@ -1,21 +1,60 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
 import shutil
 import tempfile
 from copy import deepcopy
+from functools import partial
+from pathlib import Path
+from unittest import mock
 
+from PIL import Image
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APIClient, APITestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import (APIClient, APIRequestFactory, APITestCase,
+                                 override_settings,)
 
+from django.contrib.auth.models import update_last_login
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 
+from api.serializers import RecipeFragmentSerializer
+from api.views import RecipeViewSet, UserViewSet
+from core.cache import (bump_version, get_recipes_cache,
+                        get_recipes_cache_stats, get_recipes_version,)
+from core.images import delete_unreferenced_images
+from core.middleware import QueryBudgetExceeded
+from core.shopping_list import (find_shopping_lists_discrepancies,
+                                rebuild_shopping_lists,)
+from core.signals import touch_recipes
+from core.storage import lock_file_names
 from core.utils import create_ingredients
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.models import (Favorite, Ingredient, IngredientRecipe,
+                            MeasurementUnit, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag,)
 from users.models import Subscribe, User
 
 
 MEDIA_ROOT = tempfile.mkdtemp()
 
 
+def get_hashed_image_name(image: str) -> str:
+    """Возвращает имя, под которым сохраняется картинка в base64."""
+    digest = hashlib.sha256(
+        base64.b64decode(image.split(";base64,")[1])
+    ).hexdigest()
+    return f"recipes/{digest[:2]}/{digest}.png"
+
+
 class CreateUserTest(APITestCase):
     def test_can_create_user(self):
         """
@@ -683,6 +722,7 @@ class ListRecipesTest(APITestCase):
                 "is_favorited": False,
                 "name": self.recipe_2.name,
                 "image": "http://testserver" + self.recipe_2.image.url,
+                "image_srcset": None,
                 "text": self.recipe_2.text,
                 "cooking_time": self.recipe_2.cooking_time,
             },
@@ -718,6 +758,7 @@ class ListRecipesTest(APITestCase):
                 "is_favorited": False,
                 "name": self.recipe_1.name,
                 "image": "http://testserver" + self.recipe_1.image.url,
+                "image_srcset": None,
                 "text": self.recipe_1.text,
                 "cooking_time": self.recipe_1.cooking_time,
             }
@@ -749,6 +790,7 @@ class RetrieveRecipeTest(APITestCase):
         ).__dict__
         self.ingredient["amount"] = 100
         self.ingredient.pop("_state")
+        self.ingredient.pop("unit_id")
         image = (
             "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAABA"
             "AAAAQCAIAAACQkWg2AAAAAXNSR0IArs4c6QAAAARnQU1BAACxj"
@@ -787,6 +829,7 @@ class RetrieveRecipeTest(APITestCase):
             "is_favorited": False,
             "name": self.recipe.name,
             "image": "http://testserver" + self.recipe.image.url,
+            "image_srcset": None,
             "text": self.recipe.text,
             "cooking_time": self.recipe.cooking_time,
         }
@@ -855,7 +898,9 @@ class CreateRecipeTest(APITestCase):
             name="ingredient2", measurement_unit="г"
         ).__dict__
         self.ingredient_1.pop("_state")
+        self.ingredient_1.pop("unit_id")
         self.ingredient_2.pop("_state")
+        self.ingredient_2.pop("unit_id")
         self.amount_1 = 100
         self.amount_2 = 200
         self.image = (
@@ -904,7 +949,9 @@ class CreateRecipeTest(APITestCase):
             "is_in_shopping_cart": False,
             "is_favorited": False,
             "name": self.request_data.get("name"),
-            "image": "http://testserver/media/temp.png",
+            "image": "http://testserver/media/"
+            + get_hashed_image_name(self.image),
+            "image_srcset": None,
             "text": self.request_data.get("text"),
             "cooking_time": self.request_data.get("cooking_time"),
         }
@@ -977,11 +1024,81 @@ class CreateRecipeTest(APITestCase):
             "Запрос возвращает не 404 код",
         )
         self.assertEqual(
-            {"ingredients": "Такой ингредиент не существует."},
+            {
+                "ingredients": [
+                    "Таких ингредиентов не существует: "
+                    f"{self.ingredient_1.get('id') + 123}."
+                ]
+            },
             response.data,
             "Тело ответа API не соответствует документации",
         )
 
+    def test_ingredients_are_resolved_in_one_query(self):
+        """
+        Проверяем, что ингредиенты рецепта проверяются одним запросом,
+        а все несуществующие ингредиенты перечисляются в ошибке
+        без создания рецепта.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"ingredient{number}", measurement_unit="г")
+            for number in range(3, 28)
+        )
+        new_request_data = deepcopy(self.request_data)
+        new_request_data["ingredients"] = [
+            {"id": ingredient.id, "amount": 10} for ingredient in ingredients
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse("api:recipes-list"), new_request_data
+            )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            "Запрос возвращает не 201 код",
+        )
+        ingredient_queries = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+            and 'FROM "recipes_ingredient"' in query["sql"]
+        ]
+        self.assertEqual(
+            len(ingredient_queries),
+            1,
+            "Ингредиенты рецепта загружаются отдельными запросами",
+        )
+        recipes_count = Recipe.objects.count()
+        unknown_ids = [ingredients[-1].id + 1, ingredients[-1].id + 2]
+        new_request_data["ingredients"] = [
+            {"id": ingredients[0].id, "amount": 10},
+            *({"id": unknown_id, "amount": 10} for unknown_id in unknown_ids),
+        ]
+        response = self.client.post(
+            reverse("api:recipes-list"), new_request_data
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST,
+            "Запрос возвращает не 400 код",
+        )
+        self.assertEqual(
+            response.data,
+            {
+                "ingredients": [
+                    "Таких ингредиентов не существует: "
+                    f"{unknown_ids[0]}, {unknown_ids[1]}."
+                ]
+            },
+            "Ошибка не перечисляет все несуществующие ингредиенты",
+        )
+        self.assertEqual(
+            Recipe.objects.count(),
+            recipes_count,
+            "Рецепт с несуществующими ингредиентами создаётся",
+        )
+
 
 @override_settings(MEDIA_ROOT=MEDIA_ROOT)
 class UpdateRecipeTest(APITestCase):
@@ -1010,6 +1127,7 @@ class UpdateRecipeTest(APITestCase):
         ).__dict__
         self.ingredient["amount"] = 100
         self.ingredient.pop("_state")
+        self.ingredient.pop("unit_id")
         self.other_ingredient = (
             Ingredient.objects.create(
                 name="other_ingredient", measurement_unit="г"
@@ -1017,6 +1135,7 @@ class UpdateRecipeTest(APITestCase):
         ).__dict__
         self.other_ingredient["amount"] = 200
         self.other_ingredient.pop("_state")
+        self.other_ingredient.pop("unit_id")
         self.image = (
             "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAABA"
             "AAAAQCAIAAACQkWg2AAAAAXNSR0IArs4c6QAAAARnQU1BAACxj"
@@ -1067,7 +1186,9 @@ class UpdateRecipeTest(APITestCase):
             "is_in_shopping_cart": False,
             "is_favorited": False,
             "name": self.request_data.get("name"),
-            "image": "http://testserver/media/temp.png",
+            "image": "http://testserver/media/"
+            + get_hashed_image_name(self.image),
+            "image_srcset": None,
             "text": self.request_data.get("text"),
             "cooking_time": self.request_data.get("cooking_time"),
         }
@@ -1170,7 +1291,12 @@ class UpdateRecipeTest(APITestCase):
             "Запрос возвращает не 404 код",
         )
         self.assertEqual(
-            {"ingredients": "Такой ингредиент не существует."},
+            {
+                "ingredients": [
+                    "Таких ингредиентов не существует: "
+                    f"{self.ingredient.get('id') + 123}."
+                ]
+            },
             response.data,
             "Тело ответа API не соответствует документации",
         )
@@ -1200,6 +1326,118 @@ class UpdateRecipeTest(APITestCase):
             "Тело ответа API не соответствует документации",
         )
 
+    def get_write_statements(self, request_data):
+        """
+        Отправляет запрос на редактирование рецепта и возвращает
+        выполненные им изменяющие данные SQL-запросы.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                reverse("api:recipes-detail", args=[self.recipe.id]),
+                request_data,
+            )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            "Запрос возвращает не 200 код",
+        )
+        return [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+            or "FOR UPDATE" in query["sql"]
+        ]
+
+    def test_name_only_update_keeps_relations(self):
+        """
+        Проверяем, что при изменении только названия рецепта
+        связи с тегами и ингредиентами не изменяются.
+        """
+        ingredient_link = IngredientRecipe.objects.get(recipe=self.recipe)
+        request_data = {
+            "ingredients": [
+                {
+                    "id": self.ingredient.get("id"),
+                    "amount": self.ingredient.get("amount"),
+                }
+            ],
+            "tags": [self.tag.id],
+            "name": "new_name",
+        }
+        for data in (request_data, {"name": "other_name"}):
+            with self.subTest(fields=sorted(data)):
+                statements = self.get_write_statements(data)
+                self.assertEqual(
+                    len(statements),
+                    1,
+                    f"Лишние запросы при изменении названия: {statements}",
+                )
+                self.assertTrue(
+                    statements[0].startswith('UPDATE "recipes_recipe"'),
+                    "Изменение названия не обновляет рецепт",
+                )
+        self.assertEqual(
+            list(IngredientRecipe.objects.filter(recipe=self.recipe)),
+            [ingredient_link],
+            "Связи рецепта с ингредиентами пересоздаются",
+        )
+
+    def test_changed_ingredients_are_updated_in_place(self):
+        """
+        Проверяем, что при редактировании добавляются только новые
+        ингредиенты, а у существующих обновляется количество.
+        """
+        ingredient_link = IngredientRecipe.objects.get(recipe=self.recipe)
+        request_data = {
+            "ingredients": [
+                {"id": self.ingredient.get("id"), "amount": 150},
+                {
+                    "id": self.other_ingredient.get("id"),
+                    "amount": self.other_ingredient.get("amount"),
+                },
+            ],
+            "tags": [self.tag.id, self.other_tag.get("id")],
+        }
+        statements = self.get_write_statements(request_data)
+        self.assertFalse(
+            [
+                sql
+                for sql in statements
+                if sql.startswith(
+                    (
+                        'DELETE FROM "recipes_ingredientrecipe"',
+                        'DELETE FROM "recipes_tagrecipe"',
+                    )
+                )
+            ],
+            "При добавлении ингредиентов и тегов удаляются связи",
+        )
+        self.assertEqual(
+            IngredientRecipe.objects.get(
+                id=ingredient_link.id, ingredient_id=self.ingredient.get("id")
+            ).amount,
+            150,
+            "Количество ингредиента не обновляется в существующей связи",
+        )
+        self.assertEqual(
+            set(
+                self.recipe.ingredients_recipes.values_list(
+                    "ingredient_id", "amount"
+                )
+            ),
+            {
+                (self.ingredient.get("id"), 150),
+                (self.other_ingredient.get("id"), 200),
+            },
+            "Ингредиенты рецепта обновляются неверно",
+        )
+        self.assertEqual(
+            set(self.recipe.tags.values_list("id", flat=True)),
+            {self.tag.id, self.other_tag.get("id")},
+            "Теги рецепта обновляются неверно",
+        )
+
 
 class DeleteRecipe(APITestCase):
     def setUp(self):
@@ -1344,6 +1582,7 @@ class AddFavorite(APITestCase):
             "id": self.recipe.id,
             "name": self.recipe.name,
             "image": None,
+            "thumbnail": None,
             "cooking_time": self.recipe.cooking_time,
         }
         self.assertEqual(
@@ -1411,6 +1650,88 @@ class AddFavorite(APITestCase):
             "Тело ответа API не соответствует документации",
         )
 
+    def test_favorite_is_added_in_one_query(self):
+        """
+        Проверяем, что рецепт добавляется в избранное одним запросом
+        без чтения текста рецепта, а повторное добавление
+        не ломает транзакцию.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        url = reverse("api:recipes-favorite", args=[self.recipe.id])
+        for expected_status in (
+            status.HTTP_201_CREATED,
+            status.HTTP_400_BAD_REQUEST,
+        ):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(url)
+            self.assertEqual(
+                response.status_code,
+                expected_status,
+                f"Запрос возвращает не {expected_status} код",
+            )
+            recipe_queries = [
+                query["sql"]
+                for query in context.captured_queries
+                if '"recipes_recipe"' in query["sql"]
+                or "recipes_recipe " in query["sql"]
+            ]
+            self.assertEqual(
+                len(recipe_queries),
+                1,
+                "Рецепт читается и добавляется не одним запросом",
+            )
+            self.assertNotIn(
+                '"text"',
+                recipe_queries[0],
+                "Для ответа читается текст рецепта",
+            )
+        self.assertEqual(
+            Favorite.objects.count(),
+            1,
+            "Повторное добавление создаёт запись в базе данных",
+        )
+
+    def test_auth_user_cant_add_nonexistent_recipe_to_favorites(self):
+        """
+        Проверяем, что добавление в избранное
+        несуществующего рецепта возвращает 404.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        for recipe_id in (self.recipe.id + 1, "abc"):
+            response = self.client.post(
+                reverse("api:recipes-favorite", args=[recipe_id])
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_404_NOT_FOUND,
+                "Запрос возвращает не 404 код",
+            )
+        self.assertFalse(
+            Favorite.objects.exists(),
+            "Запись создаётся для несуществующего рецепта",
+        )
+
+    def test_toggles_benchmark(self):
+        """
+        Проверяем, что команда замера параллельного добавления
+        и удаления рецепта работает и убирает за собой данные.
+        """
+        stdout = io.StringIO()
+        call_command(
+            "benchmark_recipe_toggles",
+            "--threads",
+            "1",
+            "--requests",
+            "20",
+            stdout=stdout,
+        )
+        self.assertIn("requests/s", stdout.getvalue())
+        self.assertEqual(
+            Recipe.objects.count(),
+            1,
+            "Команда оставляет созданные рецепты",
+        )
+
 
 class DeleteFavorite(APITestCase):
     def setUp(self):
@@ -1526,6 +1847,7 @@ class AddShoppingCart(APITestCase):
             "id": self.recipe.id,
             "name": self.recipe.name,
             "image": None,
+            "thumbnail": None,
             "cooking_time": self.recipe.cooking_time,
         }
         self.assertEqual(
@@ -1721,6 +2043,7 @@ class AddSubscribe(APITestCase):
                     "id": self.recipe.id,
                     "name": self.recipe.name,
                     "image": None,
+                    "thumbnail": None,
                     "cooking_time": self.recipe.cooking_time,
                 }
             ],
@@ -1972,6 +2295,7 @@ class ListSubscriptions(APITestCase):
                         "id": self.recipe_1.id,
                         "name": self.recipe_1.name,
                         "image": None,
+                        "thumbnail": None,
                         "cooking_time": self.recipe_1.cooking_time,
                     }
                 ],
@@ -1989,6 +2313,7 @@ class ListSubscriptions(APITestCase):
                         "id": self.recipe_2.id,
                         "name": self.recipe_2.name,
                         "image": None,
+                        "thumbnail": None,
                         "cooking_time": self.recipe_2.cooking_time,
                     }
                 ],
@@ -2041,6 +2366,7 @@ class DownloadShoppingCart(APITestCase):
             user=self.user, recipe=self.recipe
         )
         self.client = APIClient()
+        get_recipes_cache().clear()
 
     def test_auth_user_can_download_shopping_cart(self):
         """
@@ -2062,6 +2388,275 @@ class DownloadShoppingCart(APITestCase):
             "Запрос не инициализирует загрузку текстового файла",
         )
 
+    def test_shopping_cart_amounts_are_summed(self):
+        """
+        Проверяем, что количество одинаковых ингредиентов из разных
+        рецептов суммируется, а список формируется одним запросом.
+        """
+        salt = Ingredient.objects.create(name="соль", measurement_unit="г")
+        flour = Ingredient.objects.create(name="мука", measurement_unit="г")
+        flour_cups = Ingredient.objects.create(
+            name="мука", measurement_unit="стакан"
+        )
+        other_recipe = Recipe.objects.create(
+            author=self.user, name="other", text="recipetext", cooking_time=5
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=other_recipe)
+        not_in_cart = Recipe.objects.create(
+            author=self.user, name="not_in_cart", text="text", cooking_time=5
+        )
+        for recipe, ingredient, amount in (
+            (self.recipe, salt, 5),
+            (self.recipe, flour, 200),
+            (other_recipe, salt, 10),
+            (other_recipe, flour_cups, 2),
+            (not_in_cart, salt, 100),
+        ):
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+        rebuild_shopping_lists()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        with self.assertNumQueries(
+            RecipeViewSet.query_budgets["download_shopping_cart"]
+        ):
+            response = self.client.get(
+                reverse("api:recipes-download_shopping_cart")
+            )
+            content = response.getvalue().decode()
+        self.assertEqual(
+            content.split("\n")[3:6],
+            ["Мука (г) — 200", "Мука (стакан) — 2", "Соль (г) — 15"],
+            "Количество ингредиентов в списке покупок суммируется неверно",
+        )
+        expected_rows = [
+            {"name": "мука", "measurement_unit": "г", "amount": 200},
+            {"name": "мука", "measurement_unit": "стакан", "amount": 2},
+            {"name": "соль", "measurement_unit": "г", "amount": 15},
+        ]
+        response = self.client.get(
+            reverse("api:recipes-download_shopping_cart"), {"format": "json"}
+        )
+        self.assertEqual(
+            json.loads(response.getvalue()),
+            expected_rows,
+            "JSON-файл списка покупок сформирован неверно",
+        )
+        response = self.client.get(
+            reverse("api:recipes-download_shopping_cart"), {"format": "csv"}
+        )
+        self.assertEqual(
+            list(csv.DictReader(io.StringIO(response.getvalue().decode()))),
+            [
+                {key: str(value) for key, value in row.items()}
+                for row in expected_rows
+            ],
+            "CSV-файл списка покупок сформирован неверно",
+        )
+
+    def test_shopping_cart_units_are_normalized(self):
+        """
+        Проверяем, что количество одного ингредиента в разных единицах
+        суммируется в канонической единице справочника.
+        """
+        flour_kg = Ingredient.objects.create(
+            name="мука", measurement_unit="кг"
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as file:
+            json.dump(
+                [
+                    {"name": "соль", "measurement_unit": "щепотка"},
+                    {"name": "мука", "measurement_unit": "г"},
+                ],
+                file,
+            )
+            file.flush()
+            call_command(
+                "seed_measurement_units",
+                "--file",
+                file.name,
+                stdout=io.StringIO(),
+            )
+        flour = Ingredient.objects.create(name="мука", measurement_unit="г")
+        pinch = Ingredient.objects.create(
+            name="соль", measurement_unit="щепотка"
+        )
+        unknown = Ingredient.objects.create(
+            name="сахар", measurement_unit="пуд"
+        )
+        self.assertEqual(
+            Ingredient.objects.get(id=flour_kg.id).unit.factor,
+            1000,
+            "Команда не связывает существующие ингредиенты со справочником",
+        )
+        for ingredient, amount in (
+            (flour_kg, 2),
+            (flour, 300),
+            (pinch, 1),
+            (unknown, 1),
+        ):
+            IngredientRecipe.objects.create(
+                recipe=self.recipe, ingredient=ingredient, amount=amount
+            )
+        rebuild_shopping_lists()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        with self.assertNumQueries(
+            RecipeViewSet.query_budgets["download_shopping_cart"]
+        ):
+            response = self.client.get(
+                reverse("api:recipes-download_shopping_cart"),
+                {"format": "json"},
+            )
+            rows = json.loads(response.getvalue())
+        self.assertEqual(
+            rows,
+            [
+                {"name": "мука", "measurement_unit": "г", "amount": 2300},
+                {"name": "сахар", "measurement_unit": "пуд", "amount": 1},
+                {"name": "соль", "measurement_unit": "щепотка", "amount": 1},
+            ],
+            "Количество не переводится в канонические единицы",
+        )
+
+    def test_shopping_cart_formats(self):
+        """
+        Проверяем, что список покупок отдаётся потоком
+        в запрошенном формате с именем файла.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        for file_format, content_type in (
+            ("txt", "text/plain; charset=utf-8"),
+            ("csv", "text/csv; charset=utf-8"),
+            ("json", "application/json; charset=utf-8"),
+        ):
+            with self.subTest(format=file_format):
+                response = self.client.get(
+                    reverse("api:recipes-download_shopping_cart"),
+                    {"format": file_format},
+                )
+                self.assertTrue(
+                    response.streaming, "Список покупок отдаётся не потоком"
+                )
+                self.assertEqual(
+                    response.headers.get("Content-Type"),
+                    content_type,
+                    "Список покупок отдаётся в неверном формате",
+                )
+                self.assertEqual(
+                    response.headers.get("Content-Disposition"),
+                    f'attachment; filename="shopping_cart.{file_format}"',
+                    "Имя файла списка покупок задаётся неверно",
+                )
+        response = self.client.get(
+            reverse("api:recipes-download_shopping_cart"), {"format": "pdf"}
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND,
+            "Запрос неподдерживаемого формата не возвращает 404",
+        )
+
+    def test_shopping_cart_is_cached(self):
+        """
+        Проверяем, что повторное скачивание списка покупок отдаётся
+        из кеша с тем же ETag, а изменение списка его сбрасывает.
+        """
+        salt = Ingredient.objects.create(name="соль", measurement_unit="г")
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=salt, amount=5
+        )
+        other_recipe = Recipe.objects.create(
+            author=self.user, name="other", text="recipetext", cooking_time=5
+        )
+        IngredientRecipe.objects.create(
+            recipe=other_recipe, ingredient=salt, amount=10
+        )
+        rebuild_shopping_lists()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        url = reverse("api:recipes-download_shopping_cart")
+
+        def download(**headers):
+            response = self.client.get(url, **headers)
+            content = (
+                response.getvalue().decode()
+                if response.status_code == status.HTTP_200_OK
+                else None
+            )
+            return response, content
+
+        response, content = download()
+        etag = response.headers.get("ETag")
+        self.assertEqual(
+            response.headers.get("X-Cache"),
+            "MISS",
+            "Первое скачивание списка покупок отдаётся из кеша",
+        )
+        with self.assertNumQueries(1):
+            cached_response, cached_content = download()
+        self.assertEqual(
+            cached_response.headers.get("X-Cache"),
+            "HIT",
+            "Повторное скачивание списка покупок не отдаётся из кеша",
+        )
+        self.assertEqual(
+            (cached_response.headers.get("ETag"), cached_content),
+            (etag, content),
+            "Закешированный список покупок отличается от исходного",
+        )
+        with self.assertNumQueries(1):
+            response, _ = download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_304_NOT_MODIFIED,
+            "Запрос с актуальным If-None-Match не возвращает 304",
+        )
+        self.assertIn(
+            "Соль (г) — 5", content, "Список покупок сформирован неверно"
+        )
+
+        def rename_salt():
+            salt.name = "морская соль"
+            salt.save()
+
+        for change, expected in (
+            (
+                partial(
+                    self.client.post,
+                    reverse(
+                        "api:recipes-shopping_cart", args=[other_recipe.id]
+                    ),
+                ),
+                "Соль (г) — 15",
+            ),
+            (
+                partial(
+                    self.client.delete,
+                    reverse(
+                        "api:recipes-shopping_cart", args=[self.recipe.id]
+                    ),
+                ),
+                "Соль (г) — 10",
+            ),
+            (rename_salt, "Морская соль (г) — 10"),
+        ):
+            with self.subTest(expected=expected):
+                change()
+                response, content = download()
+                self.assertNotEqual(
+                    response.headers.get("ETag"),
+                    etag,
+                    "ETag списка покупок не меняется при его изменении",
+                )
+                self.assertEqual(
+                    response.headers.get("X-Cache"),
+                    "MISS",
+                    "Изменённый список покупок отдаётся из устаревшего кеша",
+                )
+                self.assertIn(
+                    expected, content, "Список покупок сформирован неверно"
+                )
+                etag = response.headers.get("ETag")
+
     def test_noauth_user_cant_download_shopping_cart(self):
         """
         Проверяем, что неаунтифицированнный пользователь
@@ -2080,3 +2675,2404 @@ class DownloadShoppingCart(APITestCase):
             response.data,
             "Тело ответа API не соответствует документации",
         )
+
+
+class RecipeFlagsQueriesTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.user,
+                name=f"recipe{number}",
+                text="recipetext",
+                cooking_time=45,
+            )
+            for number in range(6)
+        ]
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[1])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def count_flag_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("api:recipes-list"))
+        return response, len(
+            [
+                query
+                for query in context.captured_queries
+                if "recipes_favorite" in query["sql"]
+                or "recipes_shoppingcart" in query["sql"]
+            ]
+        )
+
+    def test_flags_are_annotated_in_one_query(self):
+        """
+        Проверяем, что флаги is_favorited и is_in_shopping_cart
+        вычисляются для всей страницы, а не для каждого рецепта.
+        """
+        response, full_page_queries = self.count_flag_queries()
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in self.recipes[2:]]
+        ).delete()
+        _, small_page_queries = self.count_flag_queries()
+        self.assertEqual(
+            small_page_queries,
+            full_page_queries,
+            "Количество запросов растёт вместе с размером страницы",
+        )
+        flags = {
+            recipe["id"]: (
+                recipe["is_favorited"],
+                recipe["is_in_shopping_cart"],
+            )
+            for recipe in response.data.get("results")
+        }
+        self.assertEqual(
+            flags[self.recipes[0].id],
+            (True, False),
+            "Флаг is_favorited вычисляется неверно",
+        )
+        self.assertEqual(
+            flags[self.recipes[1].id],
+            (False, True),
+            "Флаг is_in_shopping_cart вычисляется неверно",
+        )
+
+    def test_can_filter_by_flags(self):
+        """
+        Проверяем, что фильтры по избранному и списку покупок
+        используют аннотированные флаги.
+        """
+        response = self.client.get(
+            reverse("api:recipes-list"), {"is_favorited": 1}
+        )
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data.get("results")],
+            [self.recipes[0].id],
+            "Фильтр is_favorited работает неверно",
+        )
+        response = self.client.get(
+            reverse("api:recipes-list"), {"is_in_shopping_cart": 1}
+        )
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data.get("results")],
+            [self.recipes[1].id],
+            "Фильтр is_in_shopping_cart работает неверно",
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeIngredientsQueriesTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.tag = Tag.objects.create(name="tag", color="#111111", slug="tag")
+        self.ingredients = [
+            {
+                "id": Ingredient.objects.create(
+                    name=f"ingredient{number}", measurement_unit="г"
+                ).id,
+                "amount": 100 + number,
+            }
+            for number in range(5)
+        ]
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=self.user,
+                name=f"recipe{number}",
+                text="recipetext",
+                cooking_time=45,
+            )
+            recipe.tags.set([self.tag.id])
+            create_ingredients(self.ingredients, recipe)
+        self.client = APIClient()
+
+    def count_ingredient_queries(self, method, *args, table):
+        with CaptureQueriesContext(connection) as context:
+            response = method(*args)
+        return response, len(
+            [
+                query
+                for query in context.captured_queries
+                if query["sql"].startswith("SELECT")
+                and table in query["sql"]
+            ]
+        )
+
+    def test_list_renders_ingredients_in_one_query(self):
+        """
+        Проверяем, что ингредиенты всех рецептов страницы
+        загружаются одним запросом.
+        """
+        response, queries = self.count_ingredient_queries(
+            self.client.get,
+            reverse("api:recipes-list"),
+            table="recipes_ingredient",
+        )
+        self.assertEqual(
+            queries, 1, "Ингредиенты загружаются не одним запросом"
+        )
+        for recipe in response.data.get("results"):
+            self.assertEqual(
+                len(recipe["ingredients"]),
+                len(self.ingredients),
+                "Тело ответа API не соответствует документации",
+            )
+
+    def test_create_renders_ingredients_in_one_query(self):
+        """
+        Проверяем, что ответ на создание рецепта
+        загружает ингредиенты одним запросом.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        request_data = {
+            "ingredients": self.ingredients,
+            "tags": [self.tag.id],
+            "image": (
+                "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAABA"
+                "AAAAQCAIAAACQkWg2AAAAAXNSR0IArs4c6QAAAARnQU1BAACxj"
+                "wv8YQUAAAAJcEhZcwAADsMAAA7DAcdvqGQAAAAZSURBVDhPY/h"
+                "PIhjVQAwY1UAMGHQa/v8HAK+t/R8kTA7nAAAAAElFTkSuQmCC"
+            ),
+            "name": "recipe",
+            "text": "recipetext",
+            "cooking_time": 45,
+        }
+        response, queries = self.count_ingredient_queries(
+            self.client.post,
+            reverse("api:recipes-list"),
+            request_data,
+            table="recipes_ingredientrecipe",
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            "Запрос возвращает не 201 код",
+        )
+        self.assertEqual(
+            [
+                ingredient["amount"]
+                for ingredient in response.data["ingredients"]
+            ],
+            [ingredient["amount"] for ingredient in self.ingredients],
+            "Тело ответа API не соответствует документации",
+        )
+        self.assertEqual(
+            queries, 1, "Ингредиенты ответа загружаются не одним запросом"
+        )
+
+
+class SubscribedAuthorsQueriesTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.authors = [
+            User.objects.create(
+                username=f"author{number}",
+                email=f"author{number}@mail.ru",
+                first_name="Test",
+                last_name="Testov",
+            )
+            for number in range(4)
+        ]
+        for author in self.authors:
+            Recipe.objects.create(
+                author=author,
+                name="recipe",
+                text="recipetext",
+                cooking_time=45,
+            )
+        Subscribe.objects.create(subscriber=self.user, author=self.authors[0])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def get_with_subscribe_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, len(
+            [
+                query
+                for query in context.captured_queries
+                if "users_subscribe" in query["sql"]
+                and "UNION" not in query["sql"]
+            ]
+        )
+
+    def test_users_list_loads_subscriptions_once(self):
+        """
+        Проверяем, что подписки при выводе списка пользователей
+        загружаются одним запросом.
+        """
+        response, queries = self.get_with_subscribe_queries(
+            reverse("api:users-list")
+        )
+        self.assertEqual(
+            queries, 1, "Подписки загружаются не одним запросом"
+        )
+        subscribed = {
+            user["id"]: user["is_subscribed"]
+            for user in response.data.get("results")
+        }
+        self.assertTrue(
+            subscribed[self.authors[0].id],
+            "Поле is_subscribed вычисляется неверно",
+        )
+        self.assertFalse(
+            subscribed[self.authors[1].id],
+            "Поле is_subscribed вычисляется неверно",
+        )
+
+    def test_recipes_list_loads_subscriptions_once(self):
+        """
+        Проверяем, что подписки на авторов рецептов
+        загружаются одним запросом.
+        """
+        response, queries = self.get_with_subscribe_queries(
+            reverse("api:recipes-list")
+        )
+        self.assertEqual(
+            queries, 1, "Подписки загружаются не одним запросом"
+        )
+        subscribed = {
+            recipe["author"]["id"]: recipe["author"]["is_subscribed"]
+            for recipe in response.data.get("results")
+        }
+        self.assertEqual(
+            subscribed,
+            {
+                author.id: author == self.authors[0]
+                for author in self.authors
+            },
+            "Поле is_subscribed вычисляется неверно",
+        )
+
+
+class CursorPaginationRecipesTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.other_user = User.objects.create(
+            username="other_user",
+            email="other_user@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.user if number % 2 else self.other_user,
+                name=f"recipe{number}",
+                text="recipetext",
+                cooking_time=45,
+            )
+            for number in range(10)
+        ]
+        Recipe.objects.update(pub_date=self.recipes[0].pub_date)
+        self.expected_ids = sorted(
+            [recipe.id for recipe in self.recipes], reverse=True
+        )
+
+    def test_can_walk_recipes_with_cursor(self):
+        """
+        Проверяем, что лента рецептов проходится курсором
+        вперёд и назад без подсчёта общего количества.
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse("api:recipes-list"), {"cursor": ""}
+            )
+        self.assertFalse(
+            any(
+                "COUNT(*)" in query["sql"]
+                for query in context.captured_queries
+            ),
+            "Курсорная пагинация подсчитывает количество рецептов",
+        )
+        self.assertNotIn(
+            "count", response.data, "Ответ содержит количество рецептов"
+        )
+        self.assertIsNone(
+            response.data.get("previous"), "Первая страница содержит previous"
+        )
+        first_page = [recipe["id"] for recipe in response.data["results"]]
+        response = self.client.get(response.data.get("next"))
+        second_page = [recipe["id"] for recipe in response.data["results"]]
+        self.assertEqual(
+            first_page + second_page,
+            self.expected_ids,
+            "Курсорная пагинация пропускает или повторяет рецепты",
+        )
+        self.assertIsNone(
+            response.data.get("next"), "Последняя страница содержит next"
+        )
+        response = self.client.get(response.data.get("previous"))
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            first_page,
+            "Ссылка previous ведёт не на предыдущую страницу",
+        )
+
+    def test_cursor_combines_with_filters(self):
+        """
+        Проверяем, что курсорная пагинация учитывает фильтры.
+        """
+        response = self.client.get(
+            reverse("api:recipes-list"),
+            {"cursor": "", "author": self.user.id},
+        )
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [
+                recipe.id
+                for recipe in reversed(self.recipes)
+                if recipe.author == self.user
+            ],
+            "Курсорная пагинация не учитывает фильтр по автору",
+        )
+
+    def test_cant_use_invalid_cursor(self):
+        """
+        Проверяем, что некорректный курсор отклоняется.
+        """
+        response = self.client.get(
+            reverse("api:recipes-list"), {"cursor": "invalid"}
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND,
+            "Запрос возвращает не 404 код",
+        )
+
+
+class FilterRecipesByTagsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.tags = [
+            Tag.objects.create(
+                name=f"tag{number}",
+                color=f"#00000{number}",
+                slug=f"tag{number}",
+            )
+            for number in range(3)
+        ]
+        self.recipes = []
+        for number in range(4):
+            recipe = Recipe.objects.create(
+                author=self.user,
+                name=f"recipe{number}",
+                text="recipetext",
+                cooking_time=45,
+            )
+            recipe.tags.set([tag.id for tag in self.tags[:number]])
+            self.recipes.append(recipe)
+
+    def get_recipes_queryset(self, tags):
+        view = RecipeViewSet(action="list")
+        view.request = Request(
+            APIRequestFactory().get(
+                reverse("api:recipes-list"), {"tags": tags}
+            )
+        )
+        return view.get_queryset()
+
+    def test_can_filter_recipes_by_tags_without_distinct(self):
+        """
+        Проверяем, что фильтр по тегам возвращает каждый рецепт один раз
+        и не использует DISTINCT ни в запросе, ни в плане запроса.
+        """
+        for tags in (self.tags[:1], self.tags[:2], self.tags):
+            with self.subTest(tags=[tag.slug for tag in tags]):
+                slugs = [tag.slug for tag in tags]
+                queryset = self.get_recipes_queryset(slugs)
+                expected_ids = {
+                    recipe.id
+                    for recipe in self.recipes
+                    if recipe.tags.filter(slug__in=slugs).exists()
+                }
+                ids = list(queryset.values_list("id", flat=True))
+                self.assertEqual(
+                    len(ids), len(set(ids)), "Рецепты в выдаче повторяются"
+                )
+                self.assertEqual(
+                    set(ids),
+                    expected_ids,
+                    "Фильтр по тегам работает неверно",
+                )
+                self.assertNotIn(
+                    "DISTINCT",
+                    str(queryset.query).upper(),
+                    "Фильтр по тегам использует DISTINCT",
+                )
+                plan = queryset.explain()
+                for node in ("Unique", "DISTINCT"):
+                    self.assertNotIn(
+                        node, plan, "План запроса содержит устранение дублей"
+                    )
+
+
+class AnonymousRecipesCacheTest(APITestCase):
+    def setUp(self):
+        get_recipes_cache().clear()
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.tag = Tag.objects.create(name="tag", color="#111111", slug="tag")
+        self.recipe = Recipe.objects.create(
+            author=self.user, name="recipe", text="recipetext", cooking_time=45
+        )
+        self.client = APIClient()
+
+    def test_anonymous_list_is_cached(self):
+        """
+        Проверяем, что повторный анонимный запрос списка рецептов
+        отдаётся из кеша без обращения к базе данных.
+        """
+        response = self.client.get(reverse("api:recipes-list"))
+        self.assertEqual(
+            response.headers.get("X-Cache"), "MISS", "Первый запрос не промах"
+        )
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(reverse("api:recipes-list"))
+        self.assertEqual(
+            cached_response.headers.get("X-Cache"),
+            "HIT",
+            "Повторный запрос не попадает в кеш",
+        )
+        self.assertEqual(
+            cached_response.data,
+            response.data,
+            "Закешированный ответ отличается от исходного",
+        )
+        self.assertEqual(
+            get_recipes_cache_stats(),
+            {"hits": 1, "misses": 1},
+            "Счётчики кеша считаются неверно",
+        )
+
+    def test_query_params_are_normalized(self):
+        """
+        Проверяем, что порядок параметров запроса не влияет на ключ кеша.
+        """
+        self.client.get(
+            reverse("api:recipes-list") + "?tags=a&tags=b&author=1"
+        )
+        response = self.client.get(
+            reverse("api:recipes-list") + "?author=1&tags=b&tags=a"
+        )
+        self.assertEqual(
+            response.headers.get("X-Cache"),
+            "HIT",
+            "Порядок параметров влияет на ключ кеша",
+        )
+
+    def test_cache_is_invalidated_by_changes(self):
+        """
+        Проверяем, что изменение рецепта или его тегов сбрасывает кеш.
+        """
+        url = reverse("api:recipes-detail", args=[self.recipe.id])
+        self.client.get(url)
+        self.recipe.tags.set([self.tag.id])
+        response = self.client.get(url)
+        self.assertEqual(
+            response.headers.get("X-Cache"),
+            "MISS",
+            "Изменение тегов не сбрасывает кеш",
+        )
+        self.assertEqual(
+            len(response.data["tags"]), 1, "Ответ содержит устаревшие теги"
+        )
+        self.recipe.name = "new_name"
+        self.recipe.save()
+        response = self.client.get(url)
+        self.assertEqual(
+            response.data["name"],
+            "new_name",
+            "Изменение рецепта не сбрасывает кеш",
+        )
+
+    def test_cache_is_invalidated_by_author_changes(self):
+        """
+        Проверяем, что изменение данных автора сбрасывает кеш,
+        а обновление даты последнего входа — нет.
+        """
+        url = reverse("api:recipes-list")
+        self.client.get(url)
+        self.user.first_name = "New"
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(
+            response.data["results"][0]["author"]["first_name"],
+            "New",
+            "Изменение автора не сбрасывает кеш",
+        )
+        update_last_login(None, self.user)
+        response = self.client.get(url)
+        self.assertEqual(
+            response.headers.get("X-Cache"),
+            "HIT",
+            "Обновление даты последнего входа сбрасывает кеш",
+        )
+
+    def test_authenticated_requests_are_not_cached(self):
+        """
+        Проверяем, что ответы аутентифицированным пользователям
+        не кешируются.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.client.get(reverse("api:recipes-list"))
+        response = self.client.get(reverse("api:recipes-list"))
+        self.assertIsNone(
+            response.headers.get("X-Cache"),
+            "Ответ аутентифицированному пользователю закеширован",
+        )
+
+
+class RecipeFragmentCacheTest(APITestCase):
+    def setUp(self):
+        get_recipes_cache().clear()
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.other_user = User.objects.create(
+            username="other_user",
+            email="other_user@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.other_token = Token.objects.create(user=self.other_user)
+        self.recipe_1 = Recipe.objects.create(
+            author=self.other_user,
+            name="recipe1",
+            text="recipetext",
+            cooking_time=45,
+        )
+        self.recipe_2 = Recipe.objects.create(
+            author=self.other_user,
+            name="recipe2",
+            text="recipetext",
+            cooking_time=45,
+        )
+        Favorite.objects.create(user=self.user, recipe=self.recipe_1)
+        Subscribe.objects.create(subscriber=self.user, author=self.other_user)
+        self.client = APIClient()
+
+    def get_recipes(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        response = self.client.get(reverse("api:recipes-list"))
+        return {
+            recipe["id"]: recipe for recipe in response.data.get("results")
+        }
+
+    def test_fragments_are_shared_between_viewers(self):
+        """
+        Проверяем, что общая часть рецептов берётся из кеша,
+        а поля пользователя вычисляются для каждого зрителя.
+        """
+        self.get_recipes(self.other_token)
+        with mock.patch.object(
+            RecipeFragmentSerializer,
+            "to_representation",
+            side_effect=AssertionError("Рецепт сериализуется повторно"),
+        ):
+            recipes = self.get_recipes(self.token)
+        self.assertTrue(
+            recipes[self.recipe_1.id]["is_favorited"],
+            "Поле is_favorited взято из кеша другого пользователя",
+        )
+        self.assertFalse(
+            recipes[self.recipe_2.id]["is_favorited"],
+            "Поле is_favorited вычисляется неверно",
+        )
+        self.assertTrue(
+            recipes[self.recipe_1.id]["author"]["is_subscribed"],
+            "Поле is_subscribed взято из кеша другого пользователя",
+        )
+        recipes = self.get_recipes(self.other_token)
+        self.assertFalse(
+            recipes[self.recipe_1.id]["is_favorited"],
+            "Поле is_favorited взято из кеша другого пользователя",
+        )
+        self.assertFalse(
+            recipes[self.recipe_1.id]["author"]["is_subscribed"],
+            "Поле is_subscribed взято из кеша другого пользователя",
+        )
+
+    def test_changed_recipe_fragment_is_invalidated(self):
+        """
+        Проверяем, что изменение рецепта сбрасывает только его часть кеша.
+        """
+        self.get_recipes(self.token)
+        self.recipe_1.name = "new_name"
+        self.recipe_1.save()
+        with mock.patch.object(
+            RecipeFragmentSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=RecipeFragmentSerializer.to_representation,
+        ) as to_representation:
+            recipes = self.get_recipes(self.token)
+        self.assertEqual(
+            [call.args[1] for call in to_representation.call_args_list],
+            [self.recipe_1],
+            "Сбрасывается кеш не только изменённого рецепта",
+        )
+        self.assertEqual(
+            recipes[self.recipe_1.id]["name"],
+            "new_name",
+            "Ответ содержит устаревшие данные рецепта",
+        )
+
+    def test_author_change_invalidates_fragments(self):
+        """
+        Проверяем, что изменение данных автора сбрасывает кеш его рецептов.
+        """
+        self.get_recipes(self.token)
+        self.other_user.first_name = "New"
+        self.other_user.save()
+        recipes = self.get_recipes(self.token)
+        self.assertEqual(
+            recipes[self.recipe_1.id]["author"]["first_name"],
+            "New",
+            "Ответ содержит устаревшие данные автора",
+        )
+
+
+class ConditionalRecipesRequestsTest(APITestCase):
+    def setUp(self):
+        get_recipes_cache().clear()
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.tag = Tag.objects.create(name="tag", color="#111111", slug="tag")
+        self.ingredient = Ingredient.objects.create(
+            name="ingredient", measurement_unit="г"
+        )
+        self.author = User.objects.create(
+            username="author", email="author@mail.ru"
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name="recipe",
+            text="recipetext",
+            cooking_time=45,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.tags.add(self.tag)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def assertNotModified(self, url, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **headers)
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_304_NOT_MODIFIED,
+            "Условный запрос к неизменённым рецептам не возвращает 304",
+        )
+        self.assertFalse(
+            response.content, "Ответ 304 содержит тело ответа"
+        )
+        return context
+
+    def test_if_none_match_returns_not_modified(self):
+        """
+        Проверяем, что запрос с актуальным ETag возвращает 304
+        без сериализации рецептов.
+        """
+        for url in (
+            reverse("api:recipes-list"),
+            reverse("api:recipes-detail", args=[self.recipe.id]),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(
+                    response.has_header("ETag"), "Ответ не содержит ETag"
+                )
+                with mock.patch.object(
+                    RecipeFragmentSerializer,
+                    "to_representation",
+                    side_effect=AssertionError("Рецепт сериализуется"),
+                ):
+                    context = self.assertNotModified(
+                        url, HTTP_IF_NONE_MATCH=response["ETag"]
+                    )
+                self.assertLessEqual(
+                    len(context),
+                    4,
+                    "Условный запрос выполняет лишние запросы к базе",
+                )
+                self.assertFalse(
+                    any(
+                        "recipes_ingredientrecipe" in query["sql"]
+                        or "recipes_tagrecipe" in query["sql"]
+                        for query in context.captured_queries
+                    ),
+                    "Условный запрос загружает теги и ингредиенты рецептов",
+                )
+
+    def test_if_modified_since_for_anonymous(self):
+        """
+        Проверяем, что анонимный запрос рецепта с If-Modified-Since
+        возвращает 304, если рецепт не изменился.
+        """
+        self.client.credentials()
+        url = reverse("api:recipes-detail", args=[self.recipe.id])
+        response = self.client.get(url)
+        self.assertTrue(
+            response.has_header("Last-Modified"),
+            "Ответ не содержит Last-Modified",
+        )
+        with self.assertNumQueries(0):
+            self.assertNotModified(
+                url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+            )
+        get_recipes_cache().clear()
+        self.assertNotModified(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+
+    def test_list_is_revalidated_by_etag(self):
+        """
+        Проверяем, что лента не отдаёт Last-Modified,
+        а удаление самого нового рецепта меняет ответ
+        на условный запрос анонимного пользователя.
+        """
+        self.client.credentials()
+        newest = Recipe.objects.create(
+            author=self.author,
+            name="newest",
+            text="recipetext",
+            cooking_time=45,
+        )
+        url = reverse("api:recipes-list")
+        response = self.client.get(url)
+        self.assertFalse(
+            response.has_header("Last-Modified"),
+            "Лента отдаёт Last-Modified",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            newest.delete()
+        response = self.client.get(
+            url,
+            HTTP_IF_NONE_MATCH=response["ETag"],
+            HTTP_IF_MODIFIED_SINCE=http_date(),
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            "Удаление рецепта не меняет ответ ленты",
+        )
+        self.assertEqual(
+            response.data["count"], 1, "Лента содержит удалённый рецепт"
+        )
+
+    def test_rolled_back_touches_are_dropped(self):
+        """
+        Проверяем, что рецепты, изменённые в откатившейся транзакции,
+        не обновляются при фиксации следующей.
+        """
+        other = Recipe.objects.create(
+            author=self.author,
+            name="other",
+            text="recipetext",
+            cooking_time=45,
+        )
+        self.recipe.refresh_from_db()
+        updated_at = self.recipe.updated_at
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                touch_recipes([self.recipe.id])
+                raise ValueError
+        with self.captureOnCommitCallbacks(execute=True):
+            touch_recipes([other.id])
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            self.recipe.updated_at,
+            updated_at,
+            "Обновляется рецепт из откатившейся транзакции",
+        )
+
+    def test_unknown_recipe_returns_not_found(self):
+        """
+        Проверяем, что условный запрос к несуществующему рецепту
+        возвращает 404.
+        """
+        response = self.client.get(
+            reverse("api:recipes-detail", args=[self.recipe.id + 1]),
+            HTTP_IF_NONE_MATCH="*",
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND,
+            "Запрос к несуществующему рецепту не возвращает 404",
+        )
+
+    def test_invalid_recipe_id_returns_not_found(self):
+        """
+        Проверяем, что запрос рецепта с нечисловым id возвращает 404.
+        """
+        response = self.client.get(
+            reverse("api:recipes-detail", args=["abc"])
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND,
+            "Запрос рецепта с нечисловым id не возвращает 404",
+        )
+
+    def test_list_etag_does_not_count_recipes(self):
+        """
+        Проверяем, что ETag ленты вычисляется по странице
+        без агрегатов по всей выборке, а лента с курсором
+        не подсчитывает рецепты вовсе.
+        """
+        url = reverse("api:recipes-list")
+        for params, counts in ((None, 1), ({"cursor": ""}, 0)):
+            with self.subTest(params=params):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url, params)
+                self.assertTrue(
+                    response.has_header("ETag"), "Ответ не содержит ETag"
+                )
+                self.assertEqual(
+                    sum(
+                        "COUNT(" in query["sql"]
+                        for query in context.captured_queries
+                    ),
+                    counts,
+                    "Лента выполняет лишние подсчёты рецептов",
+                )
+
+    def test_changes_alter_etag(self):
+        """
+        Проверяем, что изменение рецепта, его тегов, ингредиентов
+        и состояния пользователя меняет ETag.
+        """
+        url = reverse("api:recipes-detail", args=[self.recipe.id])
+
+        def change_recipe():
+            self.recipe.name = "new_name"
+            self.recipe.save()
+
+        def change_tag():
+            self.tag.name = "new_tag"
+            self.tag.save()
+
+        def change_ingredients():
+            IngredientRecipe.objects.create(
+                recipe=self.recipe, ingredient=self.ingredient, amount=10
+            )
+
+        def change_favorites():
+            Favorite.objects.create(user=self.user, recipe=self.recipe)
+
+        def change_subscriptions():
+            Subscribe.objects.create(subscriber=self.user, author=self.author)
+
+        for change in (
+            change_recipe,
+            change_tag,
+            change_ingredients,
+            change_favorites,
+            change_subscriptions,
+        ):
+            with self.subTest(change=change.__name__):
+                etag = self.client.get(url)["ETag"]
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(
+                    response.status_code,
+                    status.HTTP_200_OK,
+                    "Изменение не сбрасывает ETag",
+                )
+                self.assertNotEqual(
+                    response["ETag"], etag, "Изменение не меняет ETag"
+                )
+
+
+class QueryBudgetsTest(APITestCase):
+    """
+    Проверяем, что количество SQL-запросов эндпоинтов не превышает
+    бюджетов `query_budgets` и не растёт вместе с объёмом данных.
+    """
+
+    sizes = (1, 5, 20)
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.tags = [
+            Tag.objects.create(
+                name=f"tag{number}",
+                color=f"#00000{number}",
+                slug=f"tag{number}",
+            )
+            for number in range(2)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f"ingredient{number}", measurement_unit="г"
+            )
+            for number in range(2)
+        ]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def seed(self, size):
+        """Добавляет авторов с рецептами, избранным, покупками и подписками."""
+        for _ in range(size):
+            number = User.objects.count()
+            author = User.objects.create(
+                username=f"author{number}",
+                email=f"author{number}@mail.ru",
+                first_name="Author",
+                last_name="Authorov",
+            )
+            Subscribe.objects.create(subscriber=self.user, author=author)
+            for _ in range(2):
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name="recipe",
+                    text="recipetext",
+                    cooking_time=45,
+                )
+                recipe.tags.set(self.tags)
+                for ingredient in self.ingredients:
+                    IngredientRecipe.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=10
+                    )
+                Favorite.objects.create(user=self.user, recipe=recipe)
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def assertWithinBudget(self, viewset, action, response):
+        if response.streaming:
+            response.getvalue()
+        metrics = response.wsgi_request.metrics
+        budget = viewset.query_budgets[action]
+        self.assertEqual(
+            metrics.budget,
+            budget,
+            f"Бюджет {viewset.__name__}.{action} определяется неверно",
+        )
+        self.assertLessEqual(
+            metrics.queries,
+            budget,
+            f"{viewset.__name__}.{action} превышает бюджет запросов",
+        )
+        return metrics.queries
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_recipes_within_budget(self):
+        """
+        Проверяем бюджеты запросов эндпоинтов рецептов.
+        """
+        counts = {}
+        for size in self.sizes:
+            self.seed(size)
+            get_recipes_cache().clear()
+            recipe = Recipe.objects.create(
+                author=User.objects.last(),
+                name="new_recipe",
+                text="recipetext",
+                cooking_time=45,
+            )
+            for action, method, url, params in (
+                ("list", "get", reverse("api:recipes-list"), None),
+                (
+                    "list",
+                    "get",
+                    reverse("api:recipes-list"),
+                    {"is_favorited": 1, "tags": "tag0"},
+                ),
+                (
+                    "retrieve",
+                    "get",
+                    reverse("api:recipes-detail", args=[recipe.id]),
+                    None,
+                ),
+                (
+                    "favorite",
+                    "post",
+                    reverse("api:recipes-favorite", args=[recipe.id]),
+                    None,
+                ),
+                (
+                    "shopping_cart",
+                    "post",
+                    reverse("api:recipes-shopping_cart", args=[recipe.id]),
+                    None,
+                ),
+                (
+                    "download_shopping_cart",
+                    "get",
+                    reverse("api:recipes-download_shopping_cart"),
+                    None,
+                ),
+                (
+                    "favorite",
+                    "delete",
+                    reverse("api:recipes-favorite", args=[recipe.id]),
+                    None,
+                ),
+                (
+                    "shopping_cart",
+                    "delete",
+                    reverse("api:recipes-shopping_cart", args=[recipe.id]),
+                    None,
+                ),
+                (
+                    "favorite_bulk",
+                    "post",
+                    reverse("api:recipes-favorite_bulk"),
+                    {"recipes": [recipe.id]},
+                ),
+                (
+                    "favorite_bulk",
+                    "delete",
+                    reverse("api:recipes-favorite_bulk"),
+                    {"recipes": [recipe.id]},
+                ),
+                (
+                    "shopping_cart_bulk",
+                    "post",
+                    reverse("api:recipes-shopping_cart_bulk"),
+                    {"recipes": [recipe.id]},
+                ),
+                (
+                    "shopping_cart_bulk",
+                    "delete",
+                    reverse("api:recipes-shopping_cart_bulk"),
+                    {"recipes": [recipe.id]},
+                ),
+                (
+                    "image_status",
+                    "get",
+                    reverse("api:recipes-image_status", args=[recipe.id]),
+                    None,
+                ),
+            ):
+                response = getattr(self.client, method)(url, params)
+                counts.setdefault(
+                    (action, method, url, str(params)), set()
+                ).add(
+                    self.assertWithinBudget(RecipeViewSet, action, response)
+                )
+        for key, queries in counts.items():
+            self.assertEqual(
+                len(queries), 1, f"Количество запросов {key} зависит от данных"
+            )
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_users_within_budget(self):
+        """
+        Проверяем бюджеты запросов эндпоинтов пользователей.
+        """
+        counts = {}
+        for size in self.sizes:
+            self.seed(size)
+            author = User.objects.create(
+                username=f"new_author{size}", email=f"new{size}@mail.ru"
+            )
+            for action, method, url in (
+                ("list", "get", reverse("api:users-list")),
+                (
+                    "retrieve",
+                    "get",
+                    reverse("api:users-detail", args=[author.id]),
+                ),
+                ("me", "get", reverse("api:users-me")),
+                ("subscriptions", "get", reverse("api:users-subscriptions")),
+                (
+                    "subscribe",
+                    "post",
+                    reverse("api:users-subscribe", args=[author.id]),
+                ),
+                (
+                    "subscribe",
+                    "delete",
+                    reverse("api:users-subscribe", args=[author.id]),
+                ),
+            ):
+                response = getattr(self.client, method)(url)
+                counts.setdefault((action, method, url), set()).add(
+                    self.assertWithinBudget(UserViewSet, action, response)
+                )
+        for key, queries in counts.items():
+            self.assertEqual(
+                len(queries), 1, f"Количество запросов {key} зависит от данных"
+            )
+
+    @override_settings(REQUEST_METRICS_HEADERS=True)
+    def test_metrics_headers(self):
+        """
+        Проверяем, что метрики запроса выводятся в заголовки ответа.
+        """
+        response = self.client.get(reverse("api:recipes-list"))
+        self.assertEqual(
+            response["X-Query-Count"],
+            str(response.wsgi_request.metrics.queries),
+            "Заголовок X-Query-Count содержит неверное значение",
+        )
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, '
+            r'render;dur=[\d.]+, total;dur=[\d.]+;desc="RecipeViewSet.list"$',
+            "Заголовок Server-Timing сформирован неверно",
+        )
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_budget_raises(self):
+        """
+        Проверяем, что в строгом режиме превышение бюджета
+        приводит к ошибке.
+        """
+        with mock.patch.dict(RecipeViewSet.query_budgets, {"list": 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("api:recipes-list"))
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_streaming_queries_are_counted(self):
+        """
+        Проверяем, что запросы, выполняемые при отдаче потокового
+        ответа, учитываются в бюджете.
+        """
+        self.seed(1)
+        get_recipes_cache().clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse("api:recipes-download_shopping_cart")
+            )
+            response.getvalue()
+        self.assertEqual(
+            response.wsgi_request.metrics.queries,
+            len(context),
+            "Запросы потокового ответа не учитываются",
+        )
+        get_recipes_cache().clear()
+        with mock.patch.dict(
+            RecipeViewSet.query_budgets, {"download_shopping_cart": 1}
+        ):
+            response = self.client.get(
+                reverse("api:recipes-download_shopping_cart")
+            )
+            with self.assertRaises(QueryBudgetExceeded):
+                response.getvalue()
+
+
+class ShoppingListItemsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.other_user = User.objects.create(
+            username="other_user",
+            email="other_user@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.other_token = Token.objects.create(user=self.other_user)
+        self.tag = Tag.objects.create(name="tag", color="#111111", slug="tag")
+        self.salt = Ingredient.objects.create(
+            name="соль", measurement_unit="г"
+        )
+        self.flour = Ingredient.objects.create(
+            name="мука", measurement_unit="г"
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.user,
+                name=f"recipe{number}",
+                text="recipetext",
+                cooking_time=45,
+            )
+            for number in range(2)
+        ]
+        for recipe, ingredient, amount in (
+            (self.recipes[0], self.salt, 5),
+            (self.recipes[0], self.flour, 200),
+            (self.recipes[1], self.salt, 10),
+        ):
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def get_shopping_list(self, user):
+        return {
+            item.ingredient.name: item.amount
+            for item in ShoppingListItem.objects.filter(user=user)
+        }
+
+    def add_to_shopping_cart(self, recipe, client=None):
+        (client or self.client).post(
+            reverse("api:recipes-shopping_cart", args=[recipe.id])
+        )
+
+    def assertConsistent(self):
+        self.assertEqual(
+            find_shopping_lists_discrepancies(),
+            [],
+            "Списки покупок расходятся с рецептами в корзинах",
+        )
+
+    def test_shopping_cart_changes_update_list(self):
+        """
+        Проверяем, что добавление и удаление рецептов из списка покупок
+        изменяют суммарное количество ингредиентов.
+        """
+        self.add_to_shopping_cart(self.recipes[0])
+        self.add_to_shopping_cart(self.recipes[1])
+        self.assertEqual(
+            self.get_shopping_list(self.user),
+            {"соль": 15, "мука": 200},
+            "Добавление рецептов неверно изменяет список покупок",
+        )
+        self.client.delete(
+            reverse("api:recipes-shopping_cart", args=[self.recipes[0].id])
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.user),
+            {"соль": 10},
+            "Удаление рецепта неверно изменяет список покупок",
+        )
+        self.add_to_shopping_cart(self.recipes[1])
+        self.assertEqual(
+            self.get_shopping_list(self.user),
+            {"соль": 10},
+            "Повторное добавление рецепта изменяет список покупок",
+        )
+        self.assertConsistent()
+
+    def test_recipe_changes_update_lists(self):
+        """
+        Проверяем, что изменение ингредиентов и удаление рецепта
+        изменяют списки покупок всех пользователей с этим рецептом.
+        """
+        other_client = APIClient()
+        other_client.credentials(
+            HTTP_AUTHORIZATION="Token " + self.other_token.key
+        )
+        self.add_to_shopping_cart(self.recipes[0])
+        self.add_to_shopping_cart(self.recipes[1])
+        self.add_to_shopping_cart(self.recipes[0], other_client)
+        response = self.client.patch(
+            reverse("api:recipes-detail", args=[self.recipes[0].id]),
+            {
+                "tags": [self.tag.id],
+                "ingredients": [{"id": self.salt.id, "amount": 1}],
+                "name": "recipe0",
+                "text": "recipetext",
+                "cooking_time": 45,
+            },
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            "Запрос возвращает не 200 код",
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {"соль": 1},
+            "Изменение ингредиентов рецепта не меняет список покупок",
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.user),
+            {"соль": 11},
+            "Изменение ингредиентов рецепта не меняет список покупок",
+        )
+        self.client.delete(
+            reverse("api:recipes-detail", args=[self.recipes[0].id])
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.user),
+            {"соль": 10},
+            "Удаление рецепта не меняет список покупок",
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {},
+            "Удаление рецепта не меняет список покупок",
+        )
+        self.assertConsistent()
+
+    def test_cascade_deletes_update_lists(self):
+        """
+        Проверяем, что удаление рецепта в обход API
+        и удаление его автора изменяют списки покупок.
+        """
+        for recipe in self.recipes:
+            ShoppingCart.objects.create(user=self.other_user, recipe=recipe)
+        rebuild_shopping_lists()
+        self.recipes[1].delete()
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {"соль": 5, "мука": 200},
+            "Удаление рецепта не меняет список покупок",
+        )
+        self.user.delete()
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {},
+            "Удаление автора рецептов не меняет список покупок",
+        )
+        self.assertConsistent()
+
+    def test_author_delete_is_batched(self):
+        """
+        Проверяем, что удаление автора выполняет одинаковое число
+        запросов к базе независимо от количества его рецептов,
+        а версии кеша повышаются один раз на рецепт.
+        """
+        costs = set()
+        for size in (2, 6):
+            with self.captureOnCommitCallbacks(execute=True):
+                author = User.objects.create(
+                    username=f"author{size}", email=f"author{size}@mail.ru"
+                )
+                for _ in range(size):
+                    recipe = Recipe.objects.create(
+                        author=author,
+                        name="recipe",
+                        text="recipetext",
+                        cooking_time=45,
+                    )
+                    recipe.tags.add(self.tag)
+                    IngredientRecipe.objects.create(
+                        recipe=recipe, ingredient=self.salt, amount=1
+                    )
+                    ShoppingCart.objects.create(
+                        user=self.other_user, recipe=recipe
+                    )
+            get_recipes_version()
+            with mock.patch(
+                "core.cache.bump_version", wraps=bump_version
+            ) as bump, CaptureQueriesContext(connection) as context:
+                with self.captureOnCommitCallbacks(execute=True):
+                    author.delete()
+            costs.add((len(context), bump.call_count - size))
+        self.assertEqual(
+            len(costs),
+            1,
+            "Стоимость удаления автора зависит от количества рецептов",
+        )
+        self.assertConsistent()
+
+    def test_admin_changes_update_lists(self):
+        """
+        Проверяем, что изменение и удаление ингредиентов рецепта
+        и удаление рецепта в админке изменяют списки покупок.
+        """
+        ShoppingCart.objects.create(
+            user=self.other_user, recipe=self.recipes[0]
+        )
+        rebuild_shopping_lists()
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@mail.ru", password="password"
+        )
+        client = Client()
+        client.force_login(admin)
+        link = IngredientRecipe.objects.get(
+            recipe=self.recipes[0], ingredient=self.salt
+        )
+        client.post(
+            reverse(
+                "admin:recipes_ingredientrecipe_change", args=[link.id]
+            ),
+            {
+                "recipe": self.recipes[0].id,
+                "ingredient": self.salt.id,
+                "amount": 7,
+            },
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {"соль": 7, "мука": 200},
+            "Изменение ингредиента в админке не меняет список покупок",
+        )
+        client.post(
+            reverse(
+                "admin:recipes_ingredientrecipe_delete", args=[link.id]
+            ),
+            {"post": "yes"},
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {"мука": 200},
+            "Удаление ингредиента в админке не меняет список покупок",
+        )
+        client.post(
+            reverse("admin:recipes_recipe_delete", args=[self.recipes[0].id]),
+            {"post": "yes"},
+        )
+        self.assertEqual(
+            self.get_shopping_list(self.other_user),
+            {},
+            "Удаление рецепта в админке не меняет список покупок",
+        )
+        self.assertConsistent()
+
+    def test_check_and_rebuild_commands(self):
+        """
+        Проверяем, что команда проверки находит расхождения,
+        а команда пересборки их исправляет.
+        """
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[0])
+        with self.assertRaises(CommandError):
+            call_command("check_shopping_lists", stdout=io.StringIO())
+        call_command("rebuild_shopping_lists", stdout=io.StringIO())
+        self.assertEqual(
+            self.get_shopping_list(self.user),
+            {"соль": 5, "мука": 200},
+            "Пересборка неверно вычисляет список покупок",
+        )
+        ShoppingListItem.objects.filter(ingredient=self.salt).update(amount=1)
+        call_command("check_shopping_lists", "--fix", stdout=io.StringIO())
+        self.assertConsistent()
+
+
+class BulkRecipesRelationsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.ingredient = Ingredient.objects.create(
+            name="соль", measurement_unit="г"
+        )
+        self.recipes = []
+        for number in range(10):
+            recipe = Recipe.objects.create(
+                author=self.user,
+                name=f"recipe{number}",
+                text="recipetext",
+                cooking_time=45,
+            )
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=number + 1
+            )
+            self.recipes.append(recipe)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_bulk_add_and_remove(self):
+        """
+        Проверяем, что рецепты массово добавляются и удаляются,
+        а результат возвращается для каждого id в порядке запроса.
+        """
+        missing_id = self.recipes[-1].id + 1
+        for url_name, model in (
+            ("api:recipes-favorite_bulk", Favorite),
+            ("api:recipes-shopping_cart_bulk", ShoppingCart),
+        ):
+            with self.subTest(url_name=url_name):
+                model.objects.create(user=self.user, recipe=self.recipes[0])
+                rebuild_shopping_lists()
+                response = self.client.post(
+                    reverse(url_name),
+                    {
+                        "recipes": [
+                            self.recipes[1].id,
+                            self.recipes[0].id,
+                            missing_id,
+                            self.recipes[1].id,
+                        ]
+                    },
+                )
+                self.assertEqual(
+                    response.status_code,
+                    status.HTTP_200_OK,
+                    "Запрос возвращает не 200 код",
+                )
+                self.assertEqual(
+                    response.data,
+                    {
+                        "recipes": [
+                            {"id": self.recipes[1].id, "status": "added"},
+                            {"id": self.recipes[0].id, "status": "exists"},
+                            {"id": missing_id, "status": "not_found"},
+                        ]
+                    },
+                    "Результаты добавления рецептов неверны",
+                )
+                self.assertEqual(
+                    set(
+                        model.objects.filter(user=self.user).values_list(
+                            "recipe", flat=True
+                        )
+                    ),
+                    {self.recipes[0].id, self.recipes[1].id},
+                    "Рецепты добавляются неверно",
+                )
+                response = self.client.delete(
+                    reverse(url_name),
+                    {"recipes": [self.recipes[0].id, self.recipes[2].id]},
+                )
+                self.assertEqual(
+                    response.data,
+                    {
+                        "recipes": [
+                            {"id": self.recipes[0].id, "status": "removed"},
+                            {"id": self.recipes[2].id, "status": "missing"},
+                        ]
+                    },
+                    "Результаты удаления рецептов неверны",
+                )
+                self.assertEqual(
+                    list(
+                        model.objects.filter(user=self.user).values_list(
+                            "recipe", flat=True
+                        )
+                    ),
+                    [self.recipes[1].id],
+                    "Рецепты удаляются неверно",
+                )
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list("amount", flat=True)),
+            [2],
+            "Массовые операции неверно изменяют список покупок",
+        )
+
+    def test_bulk_queries_do_not_depend_on_size(self):
+        """
+        Проверяем, что количество запросов
+        не зависит от количества рецептов.
+        """
+        for url_name in (
+            "api:recipes-favorite_bulk",
+            "api:recipes-shopping_cart_bulk",
+        ):
+            for method in ("post", "delete"):
+                counts = set()
+                for recipes in (self.recipes[:2], self.recipes):
+                    data = {"recipes": [recipe.id for recipe in recipes]}
+                    if method == "delete":
+                        self.client.post(reverse(url_name), data)
+                    with CaptureQueriesContext(connection) as context:
+                        getattr(self.client, method)(reverse(url_name), data)
+                    counts.add(len(context))
+                    self.client.delete(reverse(url_name), data)
+                self.assertEqual(
+                    len(counts),
+                    1,
+                    f"Количество запросов {method} {url_name} "
+                    "зависит от количества рецептов",
+                )
+                self.assertLessEqual(
+                    counts.pop(),
+                    RecipeViewSet.query_budgets[
+                        url_name.split("-", 1)[1]
+                    ],
+                    f"{method} {url_name} превышает бюджет запросов",
+                )
+
+    def test_bulk_validation(self):
+        """
+        Проверяем, что некорректный список рецептов отклоняется,
+        а неавторизованный пользователь не может изменять списки.
+        """
+        for data in ({}, {"recipes": []}, {"recipes": ["a"]}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    reverse("api:recipes-shopping_cart_bulk"), data
+                )
+                self.assertEqual(
+                    response.status_code,
+                    status.HTTP_400_BAD_REQUEST,
+                    "Запрос возвращает не 400 код",
+                )
+        self.client.credentials()
+        response = self.client.post(
+            reverse("api:recipes-shopping_cart_bulk"),
+            {"recipes": [self.recipes[0].id]},
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_401_UNAUTHORIZED,
+            "Запрос возвращает не 401 код",
+        )
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    RECIPE_IMAGE_MAX_SIZE=8,
+    RECIPE_IMAGE_THUMBNAIL_SIZES=[2, 4, 100],
+    MEDIA_DELETION_IN_BACKGROUND=False,
+)
+class RecipeImageProcessingTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username="test",
+            email="test@mail.ru",
+            first_name="Test",
+            last_name="Testov",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.tag = Tag.objects.create(name="tag", color="#111111", slug="tag")
+        self.ingredient = Ingredient.objects.create(
+            name="ingredient", measurement_unit="г"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def create_recipe(self, content):
+        response = self.client.post(
+            reverse("api:recipes-list"),
+            {
+                "ingredients": [{"id": self.ingredient.id, "amount": 10}],
+                "tags": [self.tag.id],
+                "image": "data:image/png;base64,"
+                + base64.b64encode(content).decode(),
+                "name": "recipe",
+                "text": "recipetext",
+                "cooking_time": 45,
+            },
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            "Запрос возвращает не 201 код",
+        )
+        return Recipe.objects.get(id=response.data["id"])
+
+    def get_image_status(self, recipe):
+        with self.assertNumQueries(
+            RecipeViewSet.query_budgets["image_status"]
+        ):
+            response = self.client.get(
+                reverse("api:recipes-image_status", args=[recipe.id])
+            )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            "Запрос возвращает не 200 код",
+        )
+        return response.data["image_status"]
+
+    def test_image_is_processed_in_background(self):
+        """
+        Проверяем, что рецепт сохраняется с картинкой в статусе
+        ожидания, а фоновый обработчик уменьшает и перекодирует её.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 16), "red").save(buffer, "PNG")
+        recipe = self.create_recipe(buffer.getvalue())
+        self.assertEqual(
+            self.get_image_status(recipe),
+            Recipe.ImageStatus.PENDING,
+            "Картинка нового рецепта не ожидает обработки",
+        )
+        call_command("process_recipe_images", "--once", stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(
+            self.get_image_status(recipe),
+            Recipe.ImageStatus.READY,
+            "Картинка рецепта не обработана",
+        )
+        self.assertTrue(
+            recipe.image.name.endswith(".jpg"),
+            "Картинка без прозрачности не перекодируется в JPEG",
+        )
+        with Image.open(recipe.image.path) as image:
+            self.assertEqual(
+                image.size, (8, 4), "Картинка рецепта не уменьшается"
+            )
+        self.assertEqual(
+            sorted(recipe.image_thumbnails),
+            ["2", "4"],
+            "Уменьшенные копии картинки создаются неверно",
+        )
+        with Image.open(
+            recipe.image.storage.path(recipe.image_thumbnails["2"])
+        ) as image:
+            self.assertEqual(
+                image.size, (2, 1), "Уменьшенная копия картинки неверна"
+            )
+        media_url = "http://testserver/media/"
+        response = self.client.get(
+            reverse("api:recipes-detail", args=[recipe.id])
+        )
+        self.assertEqual(
+            response.data["image_srcset"],
+            f"{media_url}{recipe.image_thumbnails['2']} 2w, "
+            f"{media_url}{recipe.image_thumbnails['4']} 4w",
+            "Полное представление рецепта не выводит srcset",
+        )
+        response = self.client.post(
+            reverse("api:recipes-favorite", args=[recipe.id])
+        )
+        self.assertEqual(
+            response.data["thumbnail"],
+            media_url + recipe.image_thumbnails["2"],
+            "Короткое представление рецепта не выводит уменьшенную копию",
+        )
+
+    def test_image_can_be_uploaded_as_multipart(self):
+        """
+        Проверяем, что рецепт можно создать и отредактировать,
+        передав картинку файлом в multipart/form-data.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        buffer.name = "photo.png"
+        buffer.seek(0)
+        response = self.client.post(
+            reverse("api:recipes-list"),
+            {
+                "ingredients[0]id": self.ingredient.id,
+                "ingredients[0]amount": 10,
+                "tags": [self.tag.id],
+                "image": buffer,
+                "name": "recipe",
+                "text": "recipetext",
+                "cooking_time": 45,
+            },
+            format="multipart",
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            "Запрос возвращает не 201 код",
+        )
+        self.assertEqual(
+            [
+                (ingredient["id"], ingredient["amount"])
+                for ingredient in response.data["ingredients"]
+            ],
+            [(self.ingredient.id, 10)],
+            "Ингредиенты из multipart/form-data сохраняются неверно",
+        )
+        recipe = Recipe.objects.get(id=response.data["id"])
+        self.assertEqual(
+            recipe.image_status,
+            Recipe.ImageStatus.PENDING,
+            "Картинка из multipart/form-data не ожидает обработки",
+        )
+        recipe.image_status = Recipe.ImageStatus.READY
+        recipe.save()
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "blue").save(buffer, "PNG")
+        buffer.name = "photo.png"
+        buffer.seek(0)
+        response = self.client.patch(
+            reverse("api:recipes-detail", args=[recipe.id]),
+            {"image": buffer},
+            format="multipart",
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            "Запрос возвращает не 200 код",
+        )
+        recipe.refresh_from_db()
+        self.assertEqual(
+            recipe.image_status,
+            Recipe.ImageStatus.PENDING,
+            "Новая картинка из multipart/form-data не ожидает обработки",
+        )
+        self.assertEqual(
+            recipe.image.read(),
+            buffer.getvalue(),
+            "Картинка из multipart/form-data сохраняется неверно",
+        )
+        buffer.name = "photo.txt"
+        buffer.seek(0)
+        response = self.client.patch(
+            reverse("api:recipes-detail", args=[recipe.id]),
+            {"image": buffer},
+            format="multipart",
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST,
+            "Файл с неподходящим расширением принимается как картинка",
+        )
+
+    def test_image_upload_benchmark(self):
+        """
+        Проверяем, что бенчмарк загрузки картинки
+        проходит по обоим способам передачи.
+        """
+        stdout = io.StringIO()
+        call_command(
+            "benchmark_image_upload",
+            "--size",
+            "0.05",
+            "--repeat",
+            "1",
+            stdout=stdout,
+        )
+        self.assertIn("json: median", stdout.getvalue())
+        self.assertIn("multipart: median", stdout.getvalue())
+
+    def test_identical_images_share_one_file(self):
+        """
+        Проверяем, что одинаковые картинки хранятся одним файлом,
+        который удаляется вместе с последним ссылающимся рецептом.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        first = self.create_recipe(buffer.getvalue())
+        second = self.create_recipe(buffer.getvalue())
+        digest = hashlib.sha256(buffer.getvalue()).hexdigest()
+        self.assertEqual(
+            (first.image.name, second.image.name),
+            (f"recipes/{digest[:2]}/{digest}.png",) * 2,
+            "Одинаковые картинки не сохраняются под хешем содержимого",
+        )
+        path = Path(first.image.path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(
+                reverse("api:recipes-detail", args=[first.id])
+            )
+        self.assertTrue(
+            path.exists(), "Удаляется картинка, используемая другим рецептом"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(
+                reverse("api:recipes-detail", args=[second.id])
+            )
+        self.assertFalse(
+            path.exists(), "Картинка удалённых рецептов не удаляется"
+        )
+
+    def test_existing_images_are_hashed(self):
+        """
+        Проверяем, что команда переносит картинки старых рецептов
+        под хеш содержимого и удаляет копии.
+        """
+        storage = Recipe._meta.get_field("image").storage
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        recipes = []
+        for name in ("temp.png", "temp_copy.png"):
+            Path(storage.path(name)).write_bytes(buffer.getvalue())
+            recipes.append(
+                Recipe.objects.create(
+                    author=self.user,
+                    name="recipe",
+                    image=name,
+                    image_thumbnails={"2": "temp_2.jpg"},
+                    text="recipetext",
+                    cooking_time=45,
+                )
+            )
+        Path(storage.path("temp_2.jpg")).write_bytes(buffer.getvalue())
+        call_command("hash_recipe_images", stdout=io.StringIO())
+        digest = hashlib.sha256(buffer.getvalue()).hexdigest()
+        for recipe in recipes:
+            updated_at = recipe.updated_at
+            recipe.refresh_from_db()
+            self.assertGreater(
+                recipe.updated_at,
+                updated_at,
+                "Дата изменения рецепта с перенесённой картинкой "
+                "не обновляется",
+            )
+            self.assertEqual(
+                recipe.image.name,
+                f"recipes/{digest[:2]}/{digest}.png",
+                "Картинка рецепта не переносится под хеш содержимого",
+            )
+            self.assertEqual(
+                recipe.image_thumbnails,
+                {"2": f"recipes/{digest[:2]}/{digest}_2.jpg"},
+                "Уменьшенные копии не переносятся вместе с картинкой",
+            )
+            self.assertTrue(
+                storage.exists(recipe.image_thumbnails["2"]),
+                "Файл перенесённой уменьшенной копии не создаётся",
+            )
+        self.assertFalse(
+            Path(storage.path("temp.png")).exists()
+            or Path(storage.path("temp_copy.png")).exists()
+            or Path(storage.path("temp_2.jpg")).exists(),
+            "Копии картинок не удаляются",
+        )
+
+    def test_similar_names_are_not_deleted(self):
+        """
+        Проверяем, что вместе с картинкой удаляются только
+        её уменьшенные копии, а не файлы с похожими именами.
+        """
+        storage = Recipe._meta.get_field("image").storage
+        recipes = {}
+        for name, thumbnails in (
+            ("similar.png", {"2": "similar_2.jpg"}),
+            ("similar_AbC1234.png", {}),
+        ):
+            for file in (name, *thumbnails.values()):
+                Path(storage.path(file)).write_bytes(b"image")
+            recipes[name] = Recipe.objects.create(
+                author=self.user,
+                name="recipe",
+                image=name,
+                image_thumbnails=thumbnails,
+                text="recipetext",
+                cooking_time=45,
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes["similar.png"].delete()
+        self.assertFalse(
+            storage.exists("similar.png") or storage.exists("similar_2.jpg"),
+            "Картинка удалённого рецепта и её копии не удаляются",
+        )
+        self.assertTrue(
+            storage.exists("similar_AbC1234.png"),
+            "Удаляется картинка другого рецепта с похожим именем",
+        )
+
+    def test_file_names_are_locked(self):
+        """
+        Проверяем, что сохранение существующего файла и удаление файла
+        без ссылок блокируют одно и то же имя до конца транзакции.
+        """
+        storage = Recipe._meta.get_field("image").storage
+        name = storage.save("locked.png", ContentFile(b"image"))
+        for operation in (
+            lambda: storage.save("copy.png", ContentFile(b"image")),
+            lambda: delete_unreferenced_images({name: []}),
+        ):
+            with CaptureQueriesContext(connection) as context:
+                operation()
+            self.assertTrue(
+                any(
+                    "pg_advisory_xact_lock" in query["sql"]
+                    and name in query["sql"]
+                    for query in context.captured_queries
+                ),
+                "Имя файла не блокируется",
+            )
+        self.assertFalse(
+            storage.exists(name), "Файл без ссылок не удаляется"
+        )
+
+    def test_thumbnails_are_backfilled(self):
+        """
+        Проверяем, что команда создаёт уменьшенные копии картинок
+        существующих рецептов, а они удаляются вместе с картинкой.
+        """
+        storage = Recipe._meta.get_field("image").storage
+        name = "recipes/00/existing.png"
+        Path(storage.path(name)).parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (8, 8), "red").save(storage.path(name))
+        recipe = Recipe.objects.create(
+            author=self.user,
+            name="recipe",
+            image=name,
+            text="recipetext",
+            cooking_time=45,
+        )
+        call_command("generate_recipe_thumbnails", stdout=io.StringIO())
+        updated_at = recipe.updated_at
+        recipe.refresh_from_db()
+        self.assertEqual(
+            recipe.image_thumbnails,
+            {
+                "2": "recipes/00/existing_2.jpg",
+                "4": "recipes/00/existing_4.jpg",
+            },
+            "Команда не создаёт уменьшенные копии картинок",
+        )
+        self.assertGreater(
+            recipe.updated_at,
+            updated_at,
+            "Дата изменения рецепта с новыми копиями не обновляется",
+        )
+        thumbnail = Path(storage.path(recipe.image_thumbnails["2"]))
+        thumbnail.write_bytes(b"broken")
+        call_command("generate_recipe_thumbnails", stdout=io.StringIO())
+        self.assertEqual(
+            thumbnail.read_bytes(),
+            b"broken",
+            "Команда без --force заменяет уменьшенные копии",
+        )
+        call_command(
+            "generate_recipe_thumbnails", "--force", stdout=io.StringIO()
+        )
+        with Image.open(thumbnail) as image:
+            self.assertEqual(
+                image.size, (2, 2), "--force не заменяет уменьшенные копии"
+            )
+        self.assertTrue(
+            all(
+                storage.exists(thumbnail)
+                for thumbnail in recipe.image_thumbnails.values()
+            ),
+            "Файлы уменьшенных копий не сохраняются",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(
+            storage.exists(name)
+            or any(
+                storage.exists(thumbnail)
+                for thumbnail in recipe.image_thumbnails.values()
+            ),
+            "Уменьшенные копии не удаляются вместе с картинкой",
+        )
+
+    def test_replaced_image_is_deleted_after_commit(self):
+        """
+        Проверяем, что заменённая картинка рецепта удаляется
+        только после фиксации транзакции.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        recipe = self.create_recipe(buffer.getvalue())
+        path = Path(recipe.image.path)
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "blue").save(buffer, "PNG")
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(
+                reverse("api:recipes-detail", args=[recipe.id]),
+                {
+                    "image": "data:image/png;base64,"
+                    + base64.b64encode(buffer.getvalue()).decode()
+                },
+            )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            "Запрос возвращает не 200 код",
+        )
+        self.assertTrue(
+            path.exists(), "Картинка удаляется до фиксации транзакции"
+        )
+        for callback in callbacks:
+            callback()
+        self.assertFalse(path.exists(), "Заменённая картинка не удаляется")
+
+    def test_same_image_keeps_thumbnails(self):
+        """
+        Проверяем, что повторная загрузка текущей картинки рецепта
+        не сбрасывает её обработку, а новая картинка сбрасывает.
+        """
+        thumbnails = {"2": "recipes/thumbnail_2.jpg"}
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        recipe = self.create_recipe(buffer.getvalue())
+        Recipe.objects.filter(id=recipe.id).update(
+            image_status=Recipe.ImageStatus.READY, image_thumbnails=thumbnails
+        )
+        for color, expected_status, expected_thumbnails in (
+            ("red", Recipe.ImageStatus.READY, thumbnails),
+            ("blue", Recipe.ImageStatus.PENDING, {}),
+        ):
+            buffer = io.BytesIO()
+            Image.new("RGB", (4, 4), color).save(buffer, "PNG")
+            response = self.client.patch(
+                reverse("api:recipes-detail", args=[recipe.id]),
+                {
+                    "image": "data:image/png;base64,"
+                    + base64.b64encode(buffer.getvalue()).decode()
+                },
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_200_OK,
+                "Запрос возвращает не 200 код",
+            )
+            recipe.refresh_from_db()
+            self.assertEqual(
+                (recipe.image_status, recipe.image_thumbnails),
+                (expected_status, expected_thumbnails),
+                "Обработка картинки сбрасывается неверно",
+            )
+
+    def test_media_garbage_is_collected(self):
+        """
+        Проверяем, что команда удаляет только старые файлы,
+        на которые не ссылается ни один рецепт.
+        """
+        storage = Recipe._meta.get_field("image").storage
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        recipe = self.create_recipe(buffer.getvalue())
+        orphan = Path(recipe.image.path).with_name("orphan.png")
+        fresh = Path(recipe.image.path).with_name("fresh.png")
+        legacy = Path(storage.path("legacy.png"))
+        for path in (orphan, fresh, legacy):
+            path.write_bytes(buffer.getvalue())
+        for path in (orphan, legacy, Path(recipe.image.path)):
+            os.utime(path, (0, 0))
+        stdout = io.StringIO()
+        call_command("collect_media_garbage", stdout=stdout)
+        self.assertIn("removed 2 orphans", stdout.getvalue())
+        self.assertFalse(
+            orphan.exists() or legacy.exists(),
+            "Старые файлы без ссылок не удаляются",
+        )
+        self.assertTrue(
+            fresh.exists(), "Удаляются файлы моложе периода ожидания"
+        )
+        self.assertTrue(
+            Path(recipe.image.path).exists(),
+            "Удаляется картинка, на которую ссылается рецепт",
+        )
+
+    def test_media_garbage_referenced_during_scan_is_kept(self):
+        """
+        Проверяем, что команда перепроверяет ссылки под блокировкой
+        имён и не удаляет файл, на который сослались после просмотра
+        каталога.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        recipe = self.create_recipe(buffer.getvalue())
+        orphan = Path(recipe.image.path).with_name("orphan.png")
+        thumbnail = Path(recipe.image.path).with_name("orphan_2.jpg")
+        for path in (orphan, thumbnail):
+            path.write_bytes(buffer.getvalue())
+            os.utime(path, (0, 0))
+        name = str(Path(recipe.image.name).with_name("orphan.png"))
+        thumbnail_name = str(Path(name).with_name("orphan_2.jpg"))
+        locked = []
+
+        def reference_and_lock(names):
+            Recipe.objects.filter(id=recipe.id).update(
+                image=name, image_thumbnails={"2": thumbnail_name}
+            )
+            locked.extend(names)
+            lock_file_names(names)
+
+        stdout = io.StringIO()
+        with mock.patch(
+            "core.management.commands.collect_media_garbage."
+            "lock_file_names",
+            side_effect=reference_and_lock,
+        ):
+            call_command("collect_media_garbage", stdout=stdout)
+        self.assertIn("removed 0 orphans", stdout.getvalue())
+        self.assertEqual(
+            sorted(locked),
+            [name, thumbnail_name],
+            "Команда не блокирует имена файлов перед удалением",
+        )
+        self.assertTrue(
+            orphan.exists() and thumbnail.exists(),
+            "Удаляется файл, на который сослались во время просмотра",
+        )
+
+    def test_media_garbage_collection_resumes(self):
+        """
+        Проверяем, что команда с ограничением числа каталогов
+        продолжает с места остановки в следующем процессе.
+        """
+        storage = Recipe._meta.get_field("image").storage
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(buffer, "PNG")
+        recipe = self.create_recipe(buffer.getvalue())
+        orphan = Path(recipe.image.path).with_name("orphan.png")
+        legacy = Path(storage.path("legacy.png"))
+        for path in (orphan, legacy, Path(recipe.image.path)):
+            path.write_bytes(buffer.getvalue())
+            os.utime(path, (0, 0))
+        for expected in (legacy, orphan):
+            get_recipes_cache().clear()
+            call_command(
+                "collect_media_garbage", "--limit", "1", stdout=io.StringIO()
+            )
+            self.assertFalse(
+                expected.exists(), "Команда не продолжает с места остановки"
+            )
+        self.assertTrue(
+            Path(recipe.image.path).exists(),
+            "Удаляется картинка, на которую ссылается рецепт",
+        )
+        stdout = io.StringIO()
+        call_command("collect_media_garbage", "--limit", "1", stdout=stdout)
+        self.assertIn(
+            "removed 0 orphans",
+            stdout.getvalue(),
+            "Курсор команды считается лишним файлом",
+        )
+
+    def test_broken_image_is_marked_failed(self):
+        """
+        Проверяем, что картинка, которую не удаётся открыть,
+        помечается ошибкой обработки.
+        """
+        recipe = self.create_recipe(b"not an image")
+        with self.assertLogs("core.images", "ERROR"):
+            call_command(
+                "process_recipe_images", "--once", stdout=io.StringIO()
+            )
+        self.assertEqual(
+            self.get_image_status(recipe),
+            Recipe.ImageStatus.FAILED,
+            "Битая картинка не помечается ошибкой обработки",
+        )
+
+
+class ImportJsonTest(APITestCase):
+    def setUp(self):
+        self.unit = MeasurementUnit.objects.create(
+            name="г", canonical_unit="г", factor=1
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, name, content):
+        path = Path(self.directory.name, name)
+        path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    def import_file(self, path, *args):
+        stdout = io.StringIO()
+        call_command(
+            "import_json",
+            "-f",
+            path,
+            "-a",
+            "recipes",
+            "-m",
+            "Ingredient",
+            *args,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def test_formats_are_imported(self):
+        """
+        Проверяем, что команда импортирует JSON-массив,
+        JSON Lines и CSV с заголовком и без него.
+        """
+        items = [
+            {"name": f"ingredient{number}", "measurement_unit": "г"}
+            for number in range(5)
+        ]
+        files = {
+            "ingredients.json": (json.dumps(items, indent=4), ()),
+            "ingredients.jsonl": (
+                "\n".join(json.dumps(item) for item in items),
+                (),
+            ),
+            "ingredients.csv": (
+                "name,measurement_unit\n"
+                + "".join(f"{item['name']},г\n" for item in items),
+                (),
+            ),
+            "headless.csv": (
+                "".join(f"{item['name']},г\n" for item in items),
+                ("--fields", "name,measurement_unit"),
+            ),
+        }
+        for name, (content, args) in files.items():
+            Ingredient.objects.all().delete()
+            path = self.write_file(name, content)
+            with mock.patch(
+                "core.management.commands.import_json.CHUNK_SIZE", 16
+            ):
+                self.import_file(path, *args)
+            self.assertEqual(
+                list(
+                    Ingredient.objects.order_by("name").values(
+                        "name", "measurement_unit"
+                    )
+                ),
+                items,
+                f"Ингредиенты из {name} импортируются неверно",
+            )
+
+    def test_import_is_batched_and_idempotent(self):
+        """
+        Проверяем, что объекты добавляются пакетами `bulk_create`,
+        повторный импорт пропускает существующие объекты,
+        а ингредиенты связываются со справочником единиц измерения.
+        """
+        path = self.write_file(
+            "ingredients.csv",
+            "".join(f"ingredient{number},г\n" for number in range(5)),
+        )
+        with CaptureQueriesContext(connection) as context:
+            output = self.import_file(
+                path, "--fields", "name,measurement_unit", "--batch-size", "2"
+            )
+        inserts = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith('INSERT INTO "recipes_ingredient"')
+        ]
+        self.assertEqual(
+            len(inserts), 3, "Объекты добавляются не пакетами"
+        )
+        self.assertIn("added 5", output)
+        output = self.import_file(path, "--fields", "name,measurement_unit")
+        self.assertIn("added 0, skipped 5 existing", output)
+        self.assertFalse(
+            Ingredient.objects.filter(unit=None).exists(),
+            "Ингредиенты не связываются с единицами измерения",
+        )
+
+    def test_invalid_file_is_rejected(self):
+        """
+        Проверяем, что незакрытый JSON-массив
+        и неизвестные поля приводят к ошибке команды.
+        """
+        for name, content in (
+            ("broken.json", '[{"name": "a", "measurement_unit": "г"}'),
+            ("unknown.jsonl", '{"title": "a"}\n'),
+        ):
+            with self.assertRaises(CommandError):
+                self.import_file(self.write_file(name, content))
@@ -1,4 +1,6 @@
-from typing import Optional, Type
+import hashlib
+from contextlib import nullcontext
+from typing import Callable, Optional, Type
 
 from djoser import utils
 from djoser.serializers import (SetPasswordSerializer, TokenCreateSerializer,
@@ -8,22 +10,44 @@ from rest_framework.decorators import action
 from rest_framework.exceptions import NotAuthenticated
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly,)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
                                      ReadOnlyModelViewSet, mixins,)
 
-from django.db.models import Count
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import (BooleanField, Count, Exists, Model, OuterRef,
+                              QuerySet, Value, prefetch_related_objects,)
 from django.db.utils import IntegrityError
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 
+from api.pagination import RecipeCursorPagination
 from api.permissions import IsAuthorOrReadOnly
-from api.serializers import (CreateUpdateRecipeSerializer,
+from api.renderers import CSVRenderer, PlainTextRenderer
+from api.serializers import (BulkRecipesSerializer,
+                             CreateUpdateRecipeSerializer,
                              FullRecipeSerializer, IngredientSerializer,
+                             RecipeImageStatusSerializer,
                              ShortRecipeSerializer, SubscribeSerializer,
                              TagSerializer, UserSerializer,)
-from core.utils import generate_text_of_shopping_cart
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from core.cache import (cache_chunks, count_recipes_cache_access,
+                        get_recipes_cache, get_recipes_cache_key,
+                        get_shopping_list_cache_key,)
+from core.shopping_list import (add_to_shopping_lists, get_shopping_list,
+                                remove_from_shopping_lists,)
+from core.utils import (add_recipe_link, add_recipe_links,
+                        generate_csv_of_shopping_cart,
+                        generate_json_of_shopping_cart,
+                        generate_text_of_shopping_cart,
+                        ingredients_recipes_prefetch,)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart, Tag,
+                            TagRecipe,)
 from users.models import Subscribe, User
 
 
@@ -39,7 +63,47 @@ class MultiSerializerViewSetMixin:
             return super().get_serializer_class()
 
 
+class SubscribedAuthorsContextMixin:
+    """Миксин, передающий в контекст сериализатора подписки пользователя.
+
+    При выводе списка один раз загружает id тех авторов со страницы,
+    на которых подписан пользователь, чтобы поле `is_subscribed`
+    вычислялось без отдельного запроса для каждого автора.
+    """
+
+    author_id_attribute: str = "id"
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if self.action == "list":
+            self.subscribed_authors = self.get_subscribed_authors(
+                queryset if page is None else page
+            )
+        return page
+
+    def get_subscribed_authors(self, objects) -> set[int]:
+        user = self.request.user
+        if not user.is_authenticated:
+            return set()
+        authors_ids = {
+            getattr(obj, self.author_id_attribute) for obj in objects
+        }
+        return set(
+            Subscribe.objects.filter(
+                subscriber=user, author__in=authors_ids
+            ).values_list("author_id", flat=True)
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        subscribed_authors = getattr(self, "subscribed_authors", None)
+        if subscribed_authors is not None:
+            context["subscribed_authors"] = subscribed_authors
+        return context
+
+
 class UserViewSet(
+    SubscribedAuthorsContextMixin,
     MultiSerializerViewSetMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
@@ -56,6 +120,13 @@ class UserViewSet(
 
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]
+    query_budgets = {
+        "list": 4,
+        "retrieve": 3,
+        "me": 2,
+        "subscriptions": 4,
+        "subscribe": 5,
+    }
 
     serializer_classes = {
         "create": UserCreateSerializer,
@@ -72,6 +143,7 @@ class UserViewSet(
             return (
                 Subscribe.objects.filter(subscriber=self.request.user)
                 .select_related("author", "subscriber")
+                .prefetch_related("author__recipes")
                 .annotate(recipes_count=Count("author__recipes"))
             )
         return super().get_queryset()
@@ -222,7 +294,192 @@ class IngredientViewSet(ReadOnlyModelViewSet):
         return queryset
 
 
-class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
+class ConditionalGetMixin:
+    """Миксин, поддерживающий условные GET-запросы к рецептам.
+
+    ETag вычисляется по уже загруженной странице (или рецепту)
+    до загрузки связанных объектов и сериализации: по id, дате
+    изменения и отметкам избранного и списка покупок рецептов,
+    подпискам на их авторов и, для постраничной пагинации,
+    общему количеству. В ETag также входят адрес запроса и формат
+    ответа, поэтому ответы разным пользователям не смешиваются.
+
+    Last-Modified отдаётся только для одного рецепта: дата изменения
+    страницы списка не меняется при удалении рецепта или его переходе
+    на другую страницу. If-Modified-Since учитывается только
+    для анонимных пользователей: у избранного и подписок
+    нет даты изменения.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = queryset._prefetch_related_lookups
+        queryset = queryset.prefetch_related(None)
+        page = self.paginate_queryset(queryset)
+        objects = list(queryset) if page is None else page
+        django_page = getattr(self.paginator, "page", None)
+        paginator = getattr(django_page, "paginator", None)
+        state = (
+            paginator and paginator.count,
+            self.get_objects_state(objects),
+        )
+
+        def handler():
+            prefetch_related_objects(objects, *lookups)
+            serializer = self.get_serializer(objects, many=True)
+            if page is None:
+                return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
+
+        return self.get_conditional_response(request, state, handler)
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = generics.get_object_or_404(
+            queryset.prefetch_related(None),
+            **{self.lookup_field: kwargs[lookup_url_kwarg]},
+        )
+        self.check_object_permissions(request, instance)
+        self.subscribed_authors = self.get_subscribed_authors([instance])
+        state = self.get_objects_state([instance])
+
+        def handler():
+            prefetch_related_objects(
+                [instance], *queryset._prefetch_related_lookups
+            )
+            return Response(self.get_serializer(instance).data)
+
+        return self.get_conditional_response(
+            request,
+            state,
+            handler,
+            last_modified=int(instance.updated_at.timestamp()),
+        )
+
+    def get_objects_state(self, objects) -> tuple:
+        """
+        Возвращает состояние рецептов, от которого зависит ответ:
+        id, дату изменения, отметки избранного и списка покупок
+        и id авторов, на которых подписан пользователь.
+        """
+        return (
+            [
+                (
+                    obj.id,
+                    obj.updated_at.isoformat(),
+                    getattr(obj, "is_favorited", None),
+                    getattr(obj, "is_in_shopping_cart", None),
+                )
+                for obj in objects
+            ],
+            sorted(getattr(self, "subscribed_authors", None) or ()),
+        )
+
+    def get_conditional_response(
+        self, request, state, handler, last_modified=None
+    ):
+        etag = self.get_etag(request, state)
+        response = get_conditional_response(
+            request._request,
+            etag=etag,
+            last_modified=(
+                None if request.user.is_authenticated else last_modified
+            ),
+        )
+        if response is None:
+            response = handler()
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(response, ["Accept", "Authorization"])
+        return response
+
+    def get_etag(self, request, state) -> str:
+        digest = hashlib.md5(
+            repr(
+                (
+                    request.get_full_path(),
+                    request.accepted_renderer.format,
+                    request.user.id,
+                    state,
+                )
+            ).encode()
+        ).hexdigest()
+        return quote_etag(digest)
+
+
+class AnonymousResponseCacheMixin:
+    """Миксин, кеширующий ответы на GET-запросы анонимных пользователей.
+
+    Ответы действий из `cached_actions` хранятся под ключом из адреса,
+    нормализованных параметров запроса, формата ответа и версии
+    содержимого рецептов, которая повышается сигналами при изменении
+    рецептов. Вместе с данными хранятся заголовки `cached_headers`,
+    поэтому условные запросы к закешированным ответам
+    обрабатываются без обращения к базе данных.
+    """
+
+    cached_actions: tuple[str, ...] = ("list", "retrieve")
+    cached_headers: tuple[str, ...] = ("ETag", "Last-Modified", "Vary")
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if (
+            self.action not in self.cached_actions
+            or request.user.is_authenticated
+        ):
+            return handler(request, *args, **kwargs)
+        cache = get_recipes_cache()
+        key = (
+            f"{get_recipes_cache_key(request)}:"
+            f"{request.accepted_renderer.format}"
+        )
+        cached = cache.get(key)
+        count_recipes_cache_access(hit=cached is not None)
+        if cached is not None:
+            data, headers = cached
+            response = get_conditional_response(
+                request._request,
+                etag=headers.get("ETag"),
+                last_modified=parse_http_date_safe(
+                    headers.get("Last-Modified")
+                ),
+            ) or Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            response["X-Cache"] = "HIT"
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            headers = {
+                header: response[header]
+                for header in self.cached_headers
+                if response.has_header(header)
+            }
+            cache.set(
+                key, (response.data, headers), settings.RECIPES_CACHE_TIMEOUT
+            )
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class RecipeViewSet(
+    AnonymousResponseCacheMixin,
+    ConditionalGetMixin,
+    SubscribedAuthorsContextMixin,
+    MultiSerializerViewSetMixin,
+    ModelViewSet,
+):
     """Вьюсет для работы с рецептами.
 
     Предоставляет пользователям возможность
@@ -233,10 +490,27 @@ class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
     """
 
     queryset = Recipe.objects.select_related("author").prefetch_related(
-        "tags", "ingredients"
+        "tags", ingredients_recipes_prefetch()
     )
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     ModelViewSet.http_method_names.remove("put")
+    author_id_attribute = "author_id"
+    query_budgets = {
+        "list": 8,
+        "retrieve": 7,
+        "favorite": 2,
+        "shopping_cart": 7,
+        "download_shopping_cart": 2,
+        "favorite_bulk": 5,
+        "shopping_cart_bulk": 8,
+        "image_status": 2,
+    }
+    shopping_cart_generators = {
+        "txt": generate_text_of_shopping_cart,
+        "csv": generate_csv_of_shopping_cart,
+        "json": generate_json_of_shopping_cart,
+    }
+    cursor_pagination_class = RecipeCursorPagination
 
     serializer_classes = {
         "create": CreateUpdateRecipeSerializer,
@@ -245,8 +519,39 @@ class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
         "retrieve": FullRecipeSerializer,
         "favorite": ShortRecipeSerializer,
         "shopping_cart": ShortRecipeSerializer,
+        "favorite_bulk": BulkRecipesSerializer,
+        "shopping_cart_bulk": BulkRecipesSerializer,
+        "image_status": RecipeImageStatusSerializer,
     }
 
+    def initialize_request(self, request, *args, **kwargs):
+        """
+        Картинки рецептов, загружаемые через multipart/form-data,
+        пишутся во временный файл по частям, а не собираются в памяти.
+        """
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    @property
+    def paginator(self):
+        """Пагинатор списка рецептов.
+
+        Если в запросе передан параметр `cursor`, лента отдаётся
+        keyset-пагинацией, иначе — постраничной пагинацией по умолчанию.
+        """
+        if not hasattr(self, "_paginator"):
+            cursor_query_param = (
+                self.cursor_pagination_class.cursor_query_param
+            )
+            if (
+                self.action == "list"
+                and cursor_query_param in self.request.query_params
+            ):
+                self._paginator = self.cursor_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
+
     def get_queryset(self):
         queryset = self.queryset
         user = self.request.user
@@ -256,12 +561,34 @@ class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
         is_favorited = self.request.query_params.get("is_favorited")
         tags = self.request.query_params.getlist("tags")
         author = self.request.query_params.get("author")
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(
+                    Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+                ),
+                is_in_shopping_cart=Exists(
+                    ShoppingCart.objects.filter(
+                        user=user, recipe=OuterRef("pk")
+                    )
+                ),
+            )
+        else:
+            queryset = queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
         if is_in_shopping_cart:
-            queryset = queryset.filter(shoppingcarts__user=user)
+            queryset = queryset.filter(is_in_shopping_cart=True)
         if is_favorited:
-            queryset = queryset.filter(favorites__user=user)
+            queryset = queryset.filter(is_favorited=True)
         if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
+            queryset = queryset.filter(
+                Exists(
+                    TagRecipe.objects.filter(
+                        recipe=OuterRef("pk"), tag__slug__in=tags
+                    )
+                )
+            )
         if author:
             queryset = queryset.filter(author=author)
         return queryset
@@ -269,6 +596,10 @@ class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
     @action(["POST", "DELETE"], detail=False, url_path=r"(?P<id>\w+)/favorite")
     def favorite(self, request, id):
         """Функция-обработчик для эндпоинта "/recipes/<id>/favorite".
@@ -276,30 +607,13 @@ class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
         Позволяет пользователям добавлять или
         удалять рецепты из списка избранного.
         """
-        user = request.user
-        recipe = Recipe.objects.get(id=id)
-        if request.method == "POST":
-            try:
-                Favorite.objects.create(user=user, recipe=recipe)
-            except IntegrityError:
-                return Response(
-                    {"errors": "Рецепт уже в избранном"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            else:
-                serializer = self.get_serializer(recipe)
-                return Response(
-                    data=serializer.data, status=status.HTTP_201_CREATED
-                )
-        elif request.method == "DELETE":
-            favorite = Favorite.objects.filter(user=user, recipe=recipe)
-            delete = favorite.delete()
-            if delete[0]:
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(
-                {"errors": "Такого рецепта нет в избранном"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+        return self.update_relation(
+            request,
+            id,
+            Favorite,
+            exists_error="Рецепт уже в избранном",
+            missing_error="Такого рецепта нет в избранном",
+        )
 
     @action(
         ["POST", "DELETE"],
@@ -313,45 +627,246 @@ class RecipeViewSet(MultiSerializerViewSetMixin, ModelViewSet):
         Позволяет пользователям добавлять или
         удалять рецепты из списка покупок.
         """
+        return self.update_relation(
+            request,
+            id,
+            ShoppingCart,
+            exists_error="Рецепт уже в списке покупок",
+            missing_error="Такого рецепта нет в списке покупок",
+            on_add=add_to_shopping_lists,
+            on_remove=remove_from_shopping_lists,
+        )
+
+    def update_relation(
+        self,
+        request,
+        id: str,
+        model: Type[Model],
+        exists_error: str,
+        missing_error: str,
+        on_add: Optional[Callable[[QuerySet], None]] = None,
+        on_remove: Optional[Callable[[QuerySet], None]] = None,
+    ) -> Response:
+        """
+        Добавляет или удаляет связь пользователя с рецептом.
+
+        Добавление выполняется одним `INSERT ... ON CONFLICT DO NOTHING`,
+        который заодно читает поля рецепта для ответа, удаление —
+        одним `DELETE` по фильтру. Повторный запрос не вызывает
+        `IntegrityError` и не ломает транзакцию.
+        """
+        if not id.isdecimal():
+            raise Http404
         user = request.user
-        recipe = Recipe.objects.get(id=id)
+        links = model.objects.filter(user=user, recipe_id=id)
         if request.method == "POST":
-            try:
-                ShoppingCart.objects.create(user=user, recipe=recipe)
-            except IntegrityError:
-                return Response(
-                    {"errors": "Рецепт уже в списке покупок"},
-                    status=status.HTTP_400_BAD_REQUEST,
+            with transaction.atomic() if on_add else nullcontext():
+                recipe = add_recipe_link(
+                    model, user, id, ShortRecipeSerializer.model_fields
                 )
-            else:
-                serializer = self.get_serializer(recipe)
+                if recipe is None:
+                    raise Http404
+                if recipe.added and on_add is not None:
+                    on_add(links)
+            if not recipe.added:
                 return Response(
-                    data=serializer.data, status=status.HTTP_201_CREATED
+                    {"errors": exists_error},
+                    status=status.HTTP_400_BAD_REQUEST,
                 )
-        elif request.method == "DELETE":
-            shopping_cart = ShoppingCart.objects.filter(
-                user=user, recipe=recipe
-            )
-            delete = shopping_cart.delete()
-            if delete[0]:
-                return Response(status=status.HTTP_204_NO_CONTENT)
+            serializer = self.get_serializer(recipe)
             return Response(
-                {"errors": "Такого рецепта нет в списке покупок"},
-                status=status.HTTP_400_BAD_REQUEST,
+                data=serializer.data, status=status.HTTP_201_CREATED
             )
+        with transaction.atomic() if on_remove else nullcontext():
+            if on_remove is not None:
+                links = self.lock_links(links)
+                on_remove(links)
+            deleted, _ = links.delete()
+        if deleted:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(
+            {"errors": missing_error}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(
+        ["POST", "DELETE"],
+        detail=False,
+        url_path="favorite",
+        url_name="favorite_bulk",
+    )
+    def favorite_bulk(self, request):
+        """Функция-обработчик для эндпоинта "/recipes/favorite/".
+
+        Позволяет пользователям добавлять или удалять
+        несколько рецептов в/из списка избранного за один запрос.
+        """
+        return self.bulk_update_relation(request, Favorite)
+
+    @action(
+        ["POST", "DELETE"],
+        detail=False,
+        url_path="shopping_cart",
+        url_name="shopping_cart_bulk",
+    )
+    def shopping_cart_bulk(self, request):
+        """Функция-обработчик для эндпоинта "/recipes/shopping_cart/".
+
+        Позволяет пользователям добавлять или удалять
+        несколько рецептов в/из списка покупок за один запрос.
+        """
+        return self.bulk_update_relation(
+            request,
+            ShoppingCart,
+            on_add=add_to_shopping_lists,
+            on_remove=remove_from_shopping_lists,
+        )
+
+    @staticmethod
+    def lock_links(links: QuerySet) -> QuerySet:
+        """
+        Блокирует связи `SELECT ... FOR UPDATE` и возвращает queryset
+        только заблокированных строк. Повторное выполнение исходного
+        фильтра при READ COMMITTED задело бы и связи, добавленные
+        параллельно после блокировки, и привело бы к взаимоблокировке.
+        """
+        return links.model.objects.filter(
+            pk__in=list(links.select_for_update().values_list("pk", flat=True))
+        )
+
+    def bulk_update_relation(
+        self,
+        request,
+        model: Type[Model],
+        on_add: Optional[Callable[[QuerySet], None]] = None,
+        on_remove: Optional[Callable[[QuerySet], None]] = None,
+    ) -> Response:
+        """
+        Добавляет или удаляет связи пользователя с рецептами из запроса
+        в одной транзакции и возвращает результат для каждого id.
+
+        Добавление выполняется одним `INSERT ... ON CONFLICT`,
+        и в `on_add` попадают только действительно добавленные связи.
+        При удалении рецепты и их наличие в списке определяются
+        одним запросом, удаление — одним `delete` по фильтру.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+        user = request.user
+        with transaction.atomic():
+            if request.method == "POST":
+                statuses = {True: "added", False: "exists"}
+                linked = add_recipe_links(model, user, recipes_ids)
+                new_ids = [
+                    recipe_id
+                    for recipe_id, is_added in linked.items()
+                    if is_added
+                ]
+                if on_add is not None and new_ids:
+                    on_add(model.objects.filter(user=user, recipe__in=new_ids))
+            else:
+                statuses = {True: "removed", False: "missing"}
+                linked = dict(
+                    Recipe.objects.filter(id__in=recipes_ids)
+                    .annotate(
+                        linked=Exists(
+                            model.objects.filter(
+                                user=user, recipe=OuterRef("pk")
+                            )
+                        )
+                    )
+                    .order_by()
+                    .values_list("id", "linked")
+                )
+                links = model.objects.filter(
+                    user=user,
+                    recipe__in=[
+                        recipe_id
+                        for recipe_id, is_linked in linked.items()
+                        if is_linked
+                    ],
+                )
+                if on_remove is not None:
+                    links = self.lock_links(links)
+                    on_remove(links)
+                links.delete()
+        return Response(
+            {
+                "recipes": [
+                    {
+                        "id": recipe_id,
+                        "status": (
+                            statuses[linked[recipe_id]]
+                            if recipe_id in linked
+                            else "not_found"
+                        ),
+                    }
+                    for recipe_id in recipes_ids
+                ]
+            }
+        )
+
+    @action(
+        ["GET"],
+        detail=False,
+        url_path=r"(?P<id>\w+)/image_status",
+        url_name="image_status",
+    )
+    def image_status(self, request, id):
+        """Функция-обработчик для эндпоинта "/recipes/<id>/image_status".
+
+        Позволяет опрашивать статус фоновой обработки картинки рецепта:
+        пока он `pending`, по ссылке `image` лежит исходный файл.
+        """
+        recipe = get_object_or_404(
+            Recipe.objects.only("id", "image", "image_status"), id=id
+        )
+        return Response(self.get_serializer(recipe).data)
 
-    @action(["GET"], detail=False, url_name="download_shopping_cart")
+    @action(
+        ["GET"],
+        detail=False,
+        url_name="download_shopping_cart",
+        renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer],
+    )
     def download_shopping_cart(self, request):
         """Функция-обработчик для эндпоинта
         "/recipes/<id>/download_shopping_cart".
 
-        Позволяет пользователям получать список покупок в виде TXT файла,
-        где все ингредиенты будут суммированы.
+        Позволяет пользователям получать список покупок в виде TXT, CSV
+        или JSON файла (параметр `format`), где все ингредиенты
+        будут суммированы. Файл формируется и отдаётся по частям
+        при чтении строк из серверного курсора базы данных.
+
+        Готовый файл кешируется по версии списка покупок пользователя,
+        поэтому повторное скачивание не обращается к базе данных,
+        а при совпадении `If-None-Match` возвращается ответ 304.
         """
         user = request.user
         if not user.is_authenticated:
             raise NotAuthenticated
-        queryset = ShoppingCart.objects.filter(user=user)
-
-        content = generate_text_of_shopping_cart(user, queryset)
-        return HttpResponse(content, content_type="text/plain; charset=utf-8")
+        file_format = request.accepted_renderer.format
+        key = get_shopping_list_cache_key(user, file_format)
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        content_type = f"{request.accepted_renderer.media_type}; charset=utf-8"
+        response = get_conditional_response(request._request, etag=etag)
+        cached = None if response else get_recipes_cache().get(key)
+        if cached is not None:
+            response = HttpResponse(cached, content_type=content_type)
+            response["X-Cache"] = "HIT"
+        elif response is None:
+            generate = self.shopping_cart_generators[file_format]
+            response = StreamingHttpResponse(
+                cache_chunks(
+                    key,
+                    generate(user, get_shopping_list(user).iterator()),
+                    settings.SHOPPING_LISTS_CACHE_MAX_SIZE,
+                ),
+                content_type=content_type,
+            )
+            response["X-Cache"] = "MISS"
+        response["ETag"] = etag
+        response["Content-Disposition"] = (
+            f'attachment; filename="shopping_cart.{file_format}"'
+        )
+        return response
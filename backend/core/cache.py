@@ -0,0 +1,255 @@
+import hashlib
+import threading
+import time
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.transactions import on_commit_batched
+
+
+RECIPES_VERSION_KEY = "recipes:version"
+RECIPES_HITS_KEY = "recipes:hits"
+RECIPES_MISSES_KEY = "recipes:misses"
+RECIPE_FRAGMENTS_VERSION_KEY = "recipes:fragments:version"
+SHOPPING_LISTS_VERSION_KEY = "shopping_lists:version"
+
+versions_reads = threading.local()
+bumped_now = threading.local()
+
+
+def get_recipes_cache():
+    """Вспомогательная функция, возвращающая кеш для ответов о рецептах."""
+    return caches[settings.RECIPES_CACHE_ALIAS]
+
+
+def get_versions(keys: Iterable[str]) -> dict[str, int]:
+    """
+    Вспомогательная функция, возвращающая значения счётчиков версий.
+
+    Если счётчик ещё не создан или был вытеснен из кеша,
+    он начинается с текущего времени, чтобы не совпасть с прежними.
+    """
+    versions_reads.count = getattr(versions_reads, "count", 0) + 1
+    cache = get_recipes_cache()
+    keys = list(keys)
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        cache.add(key, time.time_ns(), timeout=None)
+    if missing:
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+def bump_version(key: str) -> None:
+    """Вспомогательная функция, повышающая счётчик версии."""
+    cache = get_recipes_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_now_and_on_commit(bump, *args) -> None:
+    """Вспомогательная функция, повышающая версию кеша.
+
+    Версия повышается сразу, чтобы устарели данные, закешированные
+    этим же потоком внутри транзакции, и ещё раз после фиксации,
+    чтобы устарели данные, закешированные до фиксации.
+
+    Повышения одной версии (или версий одних и тех же id, если `bump`
+    принимает id) объединяются: после фиксации каждая версия
+    повышается один раз за транзакцию, а сразу — только если версии
+    читались после прошлого повышения. Поэтому каскадное удаление
+    повышает каждую версию не больше двух раз.
+    """
+    items = set(*args) if args else {None}
+    if args:
+        on_commit_batched(bump, items)
+    else:
+        on_commit_batched(lambda _: bump(), items, key=bump)
+    reads = getattr(versions_reads, "count", 0)
+    if getattr(bumped_now, "reads", None) != reads:
+        bumped_now.reads, bumped_now.items = reads, set()
+    fresh = {item for item in items if (bump, item) not in bumped_now.items}
+    if not fresh:
+        return
+    bumped_now.items.update((bump, item) for item in fresh)
+    if args:
+        bump(fresh)
+    else:
+        bump()
+
+
+def get_recipes_version() -> int:
+    """
+    Вспомогательная функция, возвращающая текущую версию
+    содержимого рецептов.
+    """
+    return get_versions([RECIPES_VERSION_KEY])[RECIPES_VERSION_KEY]
+
+
+def bump_recipes_version() -> None:
+    """
+    Вспомогательная функция, делающая устаревшими
+    все закешированные ответы о рецептах.
+    """
+    bump_version(RECIPES_VERSION_KEY)
+
+
+def get_recipes_cache_key(request) -> str:
+    """
+    Вспомогательная функция, формирующая ключ кеша ответа
+    по адресу запроса, нормализованным параметрам и версии рецептов.
+    """
+    query = sorted(
+        (key, sorted(values)) for key, values in request.GET.lists()
+    )
+    digest = hashlib.md5(
+        f"{request.build_absolute_uri(request.path)}?{query}".encode()
+    ).hexdigest()
+    return f"recipes:response:{get_recipes_version()}:{digest}"
+
+
+def get_recipe_fragment_version_key(recipe_id: int) -> str:
+    """Вспомогательная функция, формирующая ключ версии рецепта."""
+    return f"recipes:fragment_version:{recipe_id}"
+
+
+def get_recipe_fragment_keys(
+    recipes_ids: Iterable[int], request=None
+) -> dict[int, str]:
+    """
+    Вспомогательная функция, формирующая ключи кеша общих для всех
+    пользователей частей рецептов.
+
+    Ключ состоит из id рецепта, версии рецепта, общей версии тегов,
+    ингредиентов и авторов, а также адреса сайта,
+    от которого зависят ссылки на изображения.
+    """
+    version_keys = {
+        recipe_id: get_recipe_fragment_version_key(recipe_id)
+        for recipe_id in recipes_ids
+    }
+    versions = get_versions(
+        [RECIPE_FRAGMENTS_VERSION_KEY, *version_keys.values()]
+    )
+    origin = hashlib.md5(
+        (request.build_absolute_uri("/") if request else "").encode()
+    ).hexdigest()
+    shared_version = versions[RECIPE_FRAGMENTS_VERSION_KEY]
+    return {
+        recipe_id: (
+            f"recipes:fragment:{origin}:{shared_version}:"
+            f"{recipe_id}:{versions[version_key]}"
+        )
+        for recipe_id, version_key in version_keys.items()
+    }
+
+
+def bump_recipe_fragment_versions(recipes_ids: Iterable[int]) -> None:
+    """
+    Вспомогательная функция, делающая устаревшими
+    закешированные части указанных рецептов.
+    """
+    for recipe_id in recipes_ids:
+        bump_version(get_recipe_fragment_version_key(recipe_id))
+
+
+def bump_recipe_fragments_version() -> None:
+    """
+    Вспомогательная функция, делающая устаревшими
+    закешированные части всех рецептов.
+    """
+    bump_version(RECIPE_FRAGMENTS_VERSION_KEY)
+
+
+def count_recipes_cache_access(hit: bool) -> None:
+    """Вспомогательная функция, считающая попадания и промахи кеша."""
+    cache = get_recipes_cache()
+    key = RECIPES_HITS_KEY if hit else RECIPES_MISSES_KEY
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_recipes_cache_stats() -> dict[str, int]:
+    """Вспомогательная функция, возвращающая счётчики кеша."""
+    cache = get_recipes_cache()
+    return {
+        "hits": cache.get(RECIPES_HITS_KEY, 0),
+        "misses": cache.get(RECIPES_MISSES_KEY, 0),
+    }
+
+
+def get_shopping_list_version_key(user_id: int) -> str:
+    """
+    Вспомогательная функция, формирующая ключ версии
+    списка покупок пользователя.
+    """
+    return f"shopping_lists:version:{user_id}"
+
+
+def get_shopping_list_cache_key(user, file_format: str) -> str:
+    """
+    Вспомогательная функция, формирующая ключ кеша готового файла
+    списка покупок пользователя.
+
+    Ключ состоит из id пользователя, формата файла, версии списка
+    покупок пользователя, общей версии ингредиентов и единиц измерения,
+    а также хеша имени пользователя, которое выводится в файле.
+    """
+    version_key = get_shopping_list_version_key(user.id)
+    versions = get_versions([SHOPPING_LISTS_VERSION_KEY, version_key])
+    name = hashlib.md5(user.get_full_name().encode()).hexdigest()
+    return (
+        f"shopping_lists:file:{user.id}:{file_format}:"
+        f"{versions[SHOPPING_LISTS_VERSION_KEY]}:{versions[version_key]}:"
+        f"{name}"
+    )
+
+
+def bump_shopping_list_versions(users_ids: Iterable[int]) -> None:
+    """
+    Вспомогательная функция, делающая устаревшими
+    закешированные списки покупок указанных пользователей.
+    """
+    for user_id in users_ids:
+        bump_version(get_shopping_list_version_key(user_id))
+
+
+def bump_shopping_lists_version() -> None:
+    """
+    Вспомогательная функция, делающая устаревшими
+    закешированные списки покупок всех пользователей.
+    """
+    bump_version(SHOPPING_LISTS_VERSION_KEY)
+
+
+def cache_chunks(
+    key: str, chunks: Iterable[str], max_size: int
+) -> Iterator[str]:
+    """
+    Вспомогательная функция, отдающая части файла и сохраняющая
+    файл в кеш после того, как он отдан целиком.
+
+    Файлы длиннее `max_size` символов не кешируются,
+    чтобы не держать их целиком в памяти.
+    """
+    parts, size = [], 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size <= max_size:
+                parts.append(chunk)
+            else:
+                parts = None
+        yield chunk
+    if parts is not None:
+        get_recipes_cache().set(
+            key, "".join(parts), settings.SHOPPING_LISTS_CACHE_TIMEOUT
+        )
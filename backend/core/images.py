@@ -0,0 +1,217 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePath
+from typing import Iterable, Optional
+
+from PIL import Image, ImageOps
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from core.storage import lock_file_names
+from recipes.models import Recipe
+
+
+logger = logging.getLogger(__name__)
+pending_images = threading.local()
+deletion_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="media-deletion"
+)
+
+
+def save_image(image: Image.Image) -> tuple[bytes, str]:
+    """
+    Вспомогательная функция, кодирующая картинку в JPEG,
+    а картинки с прозрачностью — в PNG.
+
+    Возвращает содержимое и расширение итогового файла.
+    """
+    buffer = BytesIO()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image.save(buffer, "PNG", optimize=True)
+        return buffer.getvalue(), "png"
+    image.convert("RGB").save(
+        buffer, "JPEG", quality=settings.RECIPE_IMAGE_QUALITY, optimize=True
+    )
+    return buffer.getvalue(), "jpg"
+
+
+def encode_recipe_image(content: bytes) -> tuple[bytes, str]:
+    """
+    Вспомогательная функция, проверяющая картинку, уменьшающая её
+    до `RECIPE_IMAGE_MAX_SIZE` по большей стороне и перекодирующая.
+
+    Возвращает содержимое и расширение итогового файла.
+    """
+    with Image.open(BytesIO(content)) as image:
+        image.verify()
+    with Image.open(BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(
+            (settings.RECIPE_IMAGE_MAX_SIZE, settings.RECIPE_IMAGE_MAX_SIZE)
+        )
+        return save_image(image)
+
+
+def save_thumbnails(
+    name: str, content: bytes, overwrite: bool = False
+) -> dict[str, str]:
+    """
+    Вспомогательная функция, сохраняющая уменьшенные копии картинки
+    размеров из `RECIPE_IMAGE_THUMBNAIL_SIZES`.
+
+    Копии крупнее самой картинки не создаются, существующие файлы
+    копий заменяются только при `overwrite`. Возвращает
+    имена файлов копий по их размеру для `Recipe.image_thumbnails`.
+    """
+    storage = Recipe._meta.get_field("image").storage
+    thumbnails = {}
+    with Image.open(BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        for size in sorted(settings.RECIPE_IMAGE_THUMBNAIL_SIZES):
+            if size >= max(image.size):
+                break
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            thumbnail_content, extension = save_image(thumbnail)
+            thumbnails[str(size)] = storage.save_variant(
+                name,
+                size,
+                extension,
+                ContentFile(thumbnail_content),
+                overwrite=overwrite,
+            )
+    return thumbnails
+
+
+def process_recipe_image(recipe: Recipe) -> None:
+    """
+    Вспомогательная функция, заменяющая загруженную картинку рецепта
+    обработанной и отмечающая результат в `image_status`.
+
+    Если картинку не удаётся обработать, рецепт помечается
+    как `FAILED`, а загруженный файл остаётся для разбора.
+    """
+    source, source_thumbnails = recipe.image.name, recipe.image_thumbnails
+    try:
+        with recipe.image.open("rb") as file:
+            content, extension = encode_recipe_image(file.read())
+    except Exception:
+        logger.exception(
+            "Не удалось обработать картинку рецепта %s", recipe.id
+        )
+        recipe.image_status = Recipe.ImageStatus.FAILED
+        recipe.save(update_fields=["image_status", "updated_at"])
+        return
+    recipe.image.save(
+        f"{PurePath(source).stem}.{extension}",
+        ContentFile(content),
+        save=False,
+    )
+    recipe.image_thumbnails = save_thumbnails(recipe.image.name, content)
+    recipe.image_status = Recipe.ImageStatus.READY
+    recipe.save(
+        update_fields=[
+            "image",
+            "image_thumbnails",
+            "image_status",
+            "updated_at",
+        ]
+    )
+    delete_images_on_commit(source, source_thumbnails.values())
+
+
+def delete_unreferenced_images(images: dict[str, Iterable[str]]) -> None:
+    """
+    Вспомогательная функция, удаляющая файлы картинок,
+    на которые больше не ссылается ни один рецепт.
+
+    Принимает имена картинок с именами их уменьшенных копий
+    из `Recipe.image_thumbnails`. Картинки хранятся под хешем
+    содержимого, поэтому один файл может принадлежать нескольким
+    рецептам. Вместе с картинкой удаляются только перечисленные копии.
+
+    Имена пакета блокируются до проверки ссылок и удаления файлов,
+    поэтому файл, который параллельно сохраняется для нового рецепта,
+    удаляется только если транзакция с новой ссылкой откатилась.
+    """
+    names = sorted(filter(None, images))
+    storage = Recipe._meta.get_field("image").storage
+    batch_size = settings.MEDIA_DELETION_BATCH_SIZE
+    for start in range(0, len(names), batch_size):
+        batch = set(names[start:start + batch_size])
+        with transaction.atomic():
+            lock_file_names(batch)
+            referenced = Recipe.objects.filter(image__in=batch).values_list(
+                "image", flat=True
+            )
+            for name in batch.difference(referenced):
+                storage.delete(name)
+                for thumbnail in images[name]:
+                    storage.delete(thumbnail)
+
+
+def delete_images_on_commit(name: str, thumbnails: Iterable[str] = ()):
+    """
+    Вспомогательная функция, откладывающая удаление картинки
+    и её уменьшенных копий.
+
+    Имена копятся до фиксации транзакции и удаляются пакетами
+    в фоновом потоке, поэтому каскадное удаление рецептов
+    не обращается к файловой системе в запросе. Если транзакция
+    откатилась, имена уйдут со следующей: файлы, на которые
+    ссылаются рецепты, всё равно не удаляются.
+    """
+    if not name:
+        return
+    if not hasattr(pending_images, "images"):
+        pending_images.images = {}
+    pending_images.images.setdefault(name, set()).update(thumbnails)
+    transaction.on_commit(flush_pending_images)
+
+
+def flush_pending_images() -> None:
+    """Вспомогательная функция, удаляющая накопленные картинки."""
+    images = pending_images.__dict__.pop("images", None)
+    if not images:
+        return
+    if settings.MEDIA_DELETION_IN_BACKGROUND:
+        deletion_executor.submit(delete_unreferenced_images_in_thread, images)
+    else:
+        delete_unreferenced_images(images)
+
+
+def delete_unreferenced_images_in_thread(
+    images: dict[str, Iterable[str]]
+) -> None:
+    """Удаляет картинки в фоновом потоке со своим соединением."""
+    try:
+        delete_unreferenced_images(images)
+    except Exception:
+        logger.exception("Не удалось удалить картинки %s", sorted(images))
+    finally:
+        connection.close()
+
+
+def process_next_recipe_image() -> Optional[Recipe]:
+    """
+    Вспомогательная функция, обрабатывающая картинку одного рецепта
+    из очереди ожидающих обработки.
+
+    Рецепт блокируется до конца обработки с `SKIP LOCKED`, поэтому
+    несколько обработчиков разбирают очередь, не мешая друг другу.
+    Возвращает обработанный рецепт или None, если очередь пуста.
+    """
+    with transaction.atomic():
+        recipe = (
+            Recipe.objects.filter(image_status=Recipe.ImageStatus.PENDING)
+            .select_for_update(skip_locked=True)
+            .order_by("updated_at")
+            .first()
+        )
+        if recipe is not None:
+            process_recipe_image(recipe)
+    return recipe
@@ -0,0 +1,156 @@
+import base64
+import gc
+import math
+import os
+import statistics
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from api.views import RecipeViewSet
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+
+PROC_STATUS = Path("/proc/self/status")
+PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+
+def read_memory_kb(field: str) -> Optional[int]:
+    """Возвращает поле VmRSS/VmHWM процесса в килобайтах (только Linux)."""
+    try:
+        for line in PROC_STATUS.read_text().splitlines():
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Сбрасывает пиковый RSS процесса до текущего (только Linux)."""
+    try:
+        PROC_CLEAR_REFS.write_text("5")
+    except OSError:
+        return False
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares peak RSS and latency of creating a recipe with a large "
+        "photo sent as base64 JSON and as multipart/form-data"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=float,
+            default=5,
+            help="Approximate photo size in megabytes",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of requests per upload path",
+        )
+
+    def handle(self, *args, **options):
+        photo = self.make_photo(options["size"])
+        self.stdout.write(f"Photo: {len(photo) / 2 ** 20:.1f} MB PNG")
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                for path in ("json", "multipart"):
+                    latencies, peaks = [], []
+                    for _ in range(options["repeat"]):
+                        latency, peak = self.measure(path, photo)
+                        latencies.append(latency)
+                        peaks.append(peak)
+                    self.stdout.write(
+                        f"{path}: median {statistics.median(latencies):.1f} "
+                        f"ms, max {max(latencies):.1f} ms, peak RSS growth "
+                        + (
+                            f"{max(peaks) / 1024:.1f} MB"
+                            if None not in peaks
+                            else "n/a"
+                        )
+                    )
+        self.stdout.write(self.style.SUCCESS("Success!"))
+
+    def make_photo(self, size: float) -> bytes:
+        """Создаёт несжимаемую PNG-картинку заданного размера."""
+        side = int(math.sqrt(size * 2 ** 20 / 3))
+        image = Image.frombytes("RGB", (side, side), os.urandom(side**2 * 3))
+        buffer = BytesIO()
+        image.save(buffer, "PNG", compress_level=1)
+        return buffer.getvalue()
+
+    def measure(
+        self, path: str, photo: bytes
+    ) -> tuple[float, Optional[int]]:
+        """
+        Создаёт рецепт с картинкой и возвращает время ответа в мс
+        и прирост пикового RSS в КБ. Все изменения откатываются.
+        """
+        with transaction.atomic():
+            user = User.objects.create(
+                username="benchmark", email="benchmark@mail.ru"
+            )
+            tag = Tag.objects.create(
+                name="benchmark", color="#000000", slug="benchmark"
+            )
+            ingredient = Ingredient.objects.create(
+                name="benchmark", measurement_unit="г"
+            )
+            data = {
+                "tags": [tag.id],
+                "name": "benchmark",
+                "text": "benchmark",
+                "cooking_time": 1,
+            }
+            factory = APIRequestFactory()
+            host = {"HTTP_HOST": settings.ALLOWED_HOSTS[0]}
+            if path == "json":
+                data["ingredients"] = [{"id": ingredient.id, "amount": 1}]
+                data["image"] = "data:image/png;base64," + (
+                    base64.b64encode(photo).decode()
+                )
+                request = factory.post(
+                    "/api/recipes/", data, format="json", **host
+                )
+            else:
+                data["ingredients[0]id"] = ingredient.id
+                data["ingredients[0]amount"] = 1
+                data["image"] = BytesIO(photo)
+                data["image"].name = "photo.png"
+                request = factory.post(
+                    "/api/recipes/", data, format="multipart", **host
+                )
+            del data
+            force_authenticate(request, user)
+            view = RecipeViewSet.as_view({"post": "create"})
+            gc.collect()
+            rss = read_memory_kb("VmRSS") if reset_peak_rss() else None
+            started = time.perf_counter()
+            response = view(request)
+            latency = (time.perf_counter() - started) * 1000
+            peak = read_memory_kb("VmHWM")
+            request.close()
+            if response.status_code != 201:
+                raise RuntimeError(f"{path}: {response.data}")
+            Recipe.objects.get(id=response.data["id"]).image.delete(
+                save=False
+            )
+            transaction.set_rollback(True)
+        return latency, None if rss is None or peak is None else peak - rss
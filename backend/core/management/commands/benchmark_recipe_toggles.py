@@ -0,0 +1,166 @@
+import random
+import statistics
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+
+from api.views import RecipeViewSet
+from core.shopping_list import find_shopping_lists_discrepancies
+from core.utils import create_ingredients
+from recipes.models import Ingredient, Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures latency and throughput of many threads adding and "
+        "removing the same recipe to/from favorites and shopping carts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=16,
+            help="Number of threads sending requests concurrently",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Number of requests per thread",
+        )
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=1,
+            help="Number of users the threads toggle the recipe for",
+        )
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create(
+                username=f"benchmark_{suffix}_{number}",
+                email=f"benchmark_{suffix}_{number}@mail.ru",
+            )
+            for number in range(options["users"])
+        ]
+        ingredient = Ingredient.objects.create(
+            name=f"benchmark_{suffix}", measurement_unit="г"
+        )
+        recipe = Recipe.objects.create(
+            author=users[0],
+            name=f"benchmark_{suffix}",
+            text="benchmark",
+            cooking_time=1,
+        )
+        create_ingredients([{"id": ingredient.id, "amount": 1}], recipe)
+        try:
+            results, elapsed = self.run(recipe, users, options)
+            discrepancies = find_shopping_lists_discrepancies(
+                User.objects.filter(id__in=[user.id for user in users])
+            )
+        finally:
+            recipe.delete()
+            ingredient.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+        self.report(results, elapsed)
+        statuses = Counter(status for _, _, status, _ in results)
+        if any(status >= 500 for status in statuses):
+            raise CommandError("Some requests failed with a server error")
+        if discrepancies:
+            raise CommandError(
+                f"Shopping lists diverged: {len(discrepancies)} rows"
+            )
+        self.stdout.write(self.style.SUCCESS("Success!"))
+
+    def run(
+        self, recipe: Recipe, users: list[User], options
+    ) -> tuple[list[tuple[str, str, int, float]], float]:
+        """
+        Отправляет запросы из нескольких потоков и возвращает
+        для каждого действие, метод, код ответа и время ответа в мс,
+        а также общее время в секундах.
+        """
+        threads = options["threads"]
+        started = time.perf_counter()
+        if threads == 1:
+            results = self.work(recipe, users[0], options["requests"])
+        else:
+            with ThreadPoolExecutor(threads) as executor:
+                results = sum(
+                    executor.map(
+                        lambda number: self.work_in_thread(
+                            recipe,
+                            users[number % len(users)],
+                            options["requests"],
+                        ),
+                        range(threads),
+                    ),
+                    [],
+                )
+        return results, time.perf_counter() - started
+
+    def work(
+        self, recipe: Recipe, user: User, requests: int
+    ) -> list[tuple[str, str, int, float]]:
+        """Случайно добавляет и удаляет рецепт в/из списков пользователя."""
+        factory = APIRequestFactory()
+        host = {"HTTP_HOST": settings.ALLOWED_HOSTS[0]}
+        results = []
+        for _ in range(requests):
+            action = random.choice(("favorite", "shopping_cart"))
+            method = random.choice(("post", "delete"))
+            request = getattr(factory, method)(
+                reverse(f"api:recipes-{action}", args=[recipe.id]), **host
+            )
+            force_authenticate(request, user)
+            view = RecipeViewSet.as_view({method: action})
+            started = time.perf_counter()
+            response = view(request, id=str(recipe.id))
+            latency = (time.perf_counter() - started) * 1000
+            results.append((action, method, response.status_code, latency))
+        return results
+
+    def work_in_thread(
+        self, recipe: Recipe, user: User, requests: int
+    ) -> list[tuple[str, str, int, float]]:
+        """Отправляет запросы в отдельном потоке со своим соединением."""
+        try:
+            return self.work(recipe, user, requests)
+        finally:
+            connection.close()
+
+    def report(
+        self, results: list[tuple[str, str, int, float]], elapsed: float
+    ) -> None:
+        """Выводит время ответа и коды ответов по действиям."""
+        self.stdout.write(
+            f"{len(results)} requests in {elapsed:.2f} s, "
+            f"{len(results) / elapsed:.0f} requests/s"
+        )
+        groups = {}
+        for action, method, status, latency in results:
+            groups.setdefault((action, method), []).append((status, latency))
+        for (action, method), group in sorted(groups.items()):
+            latencies = sorted(latency for _, latency in group)
+            statuses = Counter(status for status, _ in group)
+            self.stdout.write(
+                f"{action} {method.upper()}: "
+                f"median {statistics.median(latencies):.1f} ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms, "
+                "statuses "
+                + ", ".join(
+                    f"{status}: {count}"
+                    for status, count in sorted(statuses.items())
+                )
+            )
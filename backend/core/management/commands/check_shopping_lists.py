@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.shopping_list import (find_shopping_lists_discrepancies,
+                                rebuild_shopping_lists,)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Checks aggregated shopping lists against users' shopping carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-u",
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="Check only the shopping list of the user with this id",
+        )
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Rebuild shopping lists of users with discrepancies",
+        )
+
+    def handle(self, *args, **options):
+        users = options.get("users")
+        discrepancies = find_shopping_lists_discrepancies(
+            User.objects.filter(id__in=users) if users else None
+        )
+        for user_id, ingredient_id, expected, actual in discrepancies:
+            self.stdout.write(
+                f"User {user_id}, ingredient {ingredient_id}: "
+                f"expected {expected}, stored {actual}"
+            )
+        if not discrepancies:
+            self.stdout.write(
+                self.style.SUCCESS("Shopping lists are consistent")
+            )
+            return
+        if not options.get("fix"):
+            raise CommandError(
+                f"Found {len(discrepancies)} shopping list discrepancies"
+            )
+        users_ids = {user_id for user_id, *_ in discrepancies}
+        rebuild_shopping_lists(User.objects.filter(id__in=users_ids))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt shopping lists of {len(users_ids)} users"
+            )
+        )
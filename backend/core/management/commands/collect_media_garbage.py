@@ -0,0 +1,161 @@
+from datetime import timedelta
+from pathlib import Path, PurePath
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.storage import lock_file_names
+from recipes.models import Recipe
+
+
+CURSOR_FILE = ".collect_media_garbage_cursor"
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes recipe image files that no recipe references and that are "
+        "older than the grace period, a few directories per run; the "
+        "resume position is kept in MEDIA_ROOT"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=settings.MEDIA_GC_GRACE_HOURS,
+            help="Keep unreferenced files younger than this many hours",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Scan at most this many directories, continuing next run",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the files that would be removed",
+        )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field("image").storage
+        directories = self.get_directories(storage)
+        cursor = Path(storage.path(CURSOR_FILE))
+        start = (
+            cursor.read_text().strip()
+            if options["limit"] and cursor.exists()
+            else ""
+        )
+        pending = [directory for directory in directories if directory > start]
+        if options["limit"]:
+            pending = pending[: options["limit"]]
+        deadline = timezone.now() - timedelta(hours=options["grace_hours"])
+        removed = 0
+        for directory in pending:
+            names = self.list_names(storage, directory)
+            orphans = self.find_orphans(storage, directory, names, deadline)
+            if orphans and not options["dry_run"]:
+                orphans = self.delete_orphans(
+                    storage, directory, names, orphans
+                )
+            for name in orphans:
+                self.stdout.write(f"Orphan: {name}")
+            removed += len(orphans)
+        if options["limit"]:
+            finished = not pending or pending[-1] == directories[-1]
+            cursor.parent.mkdir(parents=True, exist_ok=True)
+            cursor.write_text("" if finished else pending[-1])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Success! Scanned {len(pending)} directories, "
+                f"{'found' if options['dry_run'] else 'removed'} "
+                f"{removed} orphans."
+            )
+        )
+
+    def get_directories(self, storage) -> list[str]:
+        """
+        Возвращает отсортированные каталоги с картинками:
+        корень хранилища со старыми картинками и каталоги хешей.
+        Корень обозначается точкой, чтобы отличаться от пустого курсора.
+        """
+        directories = ["."]
+        if storage.exists(storage.prefix):
+            directories += [
+                str(PurePath(storage.prefix, directory))
+                for directory in storage.listdir(storage.prefix)[0]
+            ]
+        return sorted(directories)
+
+    def list_names(self, storage, directory: str) -> list[str]:
+        """
+        Возвращает имена файлов каталога. Скрытые файлы,
+        в том числе курсор команды, не учитываются.
+        """
+        return [
+            str(PurePath(directory, file))
+            if directory != "."
+            else file
+            for file in storage.listdir(directory)[1]
+            if not file.startswith(".")
+        ]
+
+    def get_referenced(self, directory: str, names: list[str]) -> set[str]:
+        """
+        Возвращает имена файлов, на которые ссылаются картинки
+        или уменьшенные копии рецептов из каталога.
+        """
+        recipes = (
+            Recipe.objects.filter(image__startswith=f"{directory}/")
+            if directory != "."
+            else Recipe.objects.filter(image__in=names)
+        )
+        referenced = set()
+        for image, thumbnails in recipes.values_list(
+            "image", "image_thumbnails"
+        ):
+            referenced.add(image)
+            referenced.update(thumbnails.values())
+        return referenced
+
+    def find_orphans(
+        self, storage, directory: str, names: list[str], deadline
+    ) -> list[str]:
+        """
+        Возвращает файлы каталога старше `deadline`, на которые
+        не ссылается ни одна картинка или уменьшенная копия рецепта.
+        """
+        referenced = self.get_referenced(directory, names)
+        return [
+            name
+            for name in names
+            if name not in referenced
+            and storage.get_modified_time(name) < deadline
+        ]
+
+    def delete_orphans(
+        self, storage, directory: str, names: list[str], orphans: list[str]
+    ) -> list[str]:
+        """
+        Удаляет файлы без ссылок и возвращает удалённые.
+
+        Уменьшенные копии сохраняются под блокировкой имени картинки,
+        поэтому вместе с файлами блокируются картинки с тем же хешем.
+        Ссылки проверяются заново под блокировками: файл, на который
+        параллельно сохранили ссылку, не удаляется.
+        """
+        stems = {PurePath(name).stem.split("_")[0] for name in orphans}
+        locked = [
+            name
+            for name in names
+            if PurePath(name).stem.split("_")[0] in stems
+        ]
+        with transaction.atomic():
+            lock_file_names(locked)
+            referenced = self.get_referenced(directory, locked)
+            orphans = [name for name in orphans if name not in referenced]
+            for name in orphans:
+                storage.delete(name)
+        return orphans
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.cache import (bump_now_and_on_commit, bump_recipe_fragments_version,
+                        bump_recipes_version,)
+from core.images import save_thumbnails
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Generates thumbnail variants for existing recipe images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help=(
+                "Also regenerate images that already have thumbnails, "
+                "replacing the existing thumbnail files"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field("image").storage
+        recipes = Recipe.objects.filter(
+            image_status=Recipe.ImageStatus.READY
+        ).exclude(image="")
+        if not options["force"]:
+            recipes = recipes.filter(image_thumbnails={})
+        names = recipes.values_list("image", flat=True).distinct()
+        generated = 0
+        for name in list(names):
+            try:
+                with transaction.atomic():
+                    with storage.open(name) as file:
+                        thumbnails = save_thumbnails(
+                            name, file.read(), overwrite=options["force"]
+                        )
+                    Recipe.objects.filter(image=name).update(
+                        image_thumbnails=thumbnails, updated_at=timezone.now()
+                    )
+            except Exception as error:
+                self.stderr.write(f"Failed {name}: {error}")
+                continue
+            generated += 1
+        if generated:
+            bump_now_and_on_commit(bump_recipes_version)
+            bump_now_and_on_commit(bump_recipe_fragments_version)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Success! Generated thumbnails for {generated} images."
+            )
+        )
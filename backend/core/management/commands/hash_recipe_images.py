@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.cache import (bump_now_and_on_commit, bump_recipe_fragments_version,
+                        bump_recipes_version,)
+from core.images import delete_unreferenced_images, save_thumbnails
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves recipe images saved before content-hash storage to hashed "
+        "names, so identical images are stored once, moves their thumbnails "
+        "and removes the copies"
+    )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field("image").storage
+        names = (
+            Recipe.objects.exclude(image="")
+            .exclude(image__startswith=f"{storage.prefix}/")
+            .values_list("image", flat=True)
+            .distinct()
+        )
+        renamed = {}
+        for name in list(names):
+            if not storage.exists(name):
+                self.stderr.write(f"Missing file: {name}")
+                continue
+            recipes = Recipe.objects.filter(image=name)
+            thumbnails = {
+                thumbnail
+                for recipe_thumbnails in recipes.values_list(
+                    "image_thumbnails", flat=True
+                )
+                for thumbnail in recipe_thumbnails.values()
+            }
+            with transaction.atomic(), storage.open(name) as file:
+                hashed_name = storage.save(name, file)
+                file.seek(0)
+                content = file.read() if thumbnails else None
+                recipes.update(
+                    updated_at=timezone.now(),
+                    image=hashed_name,
+                    image_thumbnails=(
+                        save_thumbnails(hashed_name, content)
+                        if thumbnails
+                        else {}
+                    ),
+                )
+                bump_now_and_on_commit(bump_recipes_version)
+                bump_now_and_on_commit(bump_recipe_fragments_version)
+            renamed[name] = thumbnails
+        delete_unreferenced_images(renamed)
+        self.stdout.write(
+            self.style.SUCCESS(f"Success! Renamed {len(renamed)} images.")
+        )
@@ -1,36 +1,161 @@
+import csv
 import json
+import os
+import re
+import time
+from itertools import islice
+from pathlib import PurePath
+from typing import Iterator, Optional, TextIO
 
 from progress.bar import PixelBar
 
 from django.apps import apps
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.utils import link_ingredients_units
+from recipes.models import Ingredient
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_OBJECT_SIZE = 1024 * 1024
+SEPARATORS = re.compile(r"[\s,]*")
+FORMATS = {".json": "json", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def read_json_array(file: TextIO) -> Iterator[dict]:
+    """
+    Читает объекты из JSON-массива по частям файла,
+    не загружая весь файл в память. В памяти держится
+    не больше одного объекта размером до `MAX_OBJECT_SIZE`.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, opened = "", 0, False
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position < len(buffer):
+            if not opened:
+                if buffer[position] != "[":
+                    raise CommandError("JSON must be an array of objects.")
+                opened, position = True, position + 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                chunk = (
+                    file.read(CHUNK_SIZE)
+                    if len(buffer) - position < MAX_OBJECT_SIZE
+                    else None
+                )
+                if not chunk:
+                    raise CommandError(f"JSON is not valid: {error}")
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+            continue
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            raise CommandError("JSON array is not closed.")
+        buffer, position = chunk, 0
+
+
+def read_jsonl(file: TextIO) -> Iterator[dict]:
+    """Читает объекты из файла с одним JSON-объектом на строку."""
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise CommandError(
+                    f"Line {number}: JSON is not valid: {error}"
+                )
+
+
+def read_csv(file: TextIO, fields: Optional[list[str]]) -> Iterator[dict]:
+    """
+    Читает строки CSV. Если поля не указаны,
+    они берутся из первой строки файла.
+    """
+    yield from csv.DictReader(file, fieldnames=fields)
 
 
 class Command(BaseCommand):
-    help = "Closes the specified poll for voting"
+    help = (
+        "Imports model objects from a JSON array, JSON Lines or CSV file "
+        "in batches, skipping objects that already exist"
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("-f", "--file")
         parser.add_argument("-a", "--app")
         parser.add_argument("-m", "--model")
+        parser.add_argument(
+            "--format",
+            choices=("json", "jsonl", "csv"),
+            help="File format, detected by the file extension by default",
+        )
+        parser.add_argument(
+            "--fields",
+            type=lambda value: value.split(","),
+            help="Comma-separated CSV columns for files without a header",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of objects inserted and committed at once",
+        )
 
     def handle(self, *args, **options):
         app_label = options.get("app")
         model_name = options.get("model")
         model = apps.get_model(app_label=app_label, model_name=model_name)
-        with open(options.get("file"), "r", encoding="utf-8") as file:
-            try:
-                text = json.load(file)
-            except TypeError:
-                try:
-                    text = json.loads(file.readlines()[0])
-                except TypeError:
-                    raise CommandError("JSON is not a valid.")
+        path = options.get("file")
+        file_format = options.get("format") or FORMATS.get(
+            PurePath(path).suffix.lower(), "csv"
+        )
+        batch_size = options.get("batch_size")
+        if batch_size < 1:
+            raise CommandError("Batch size must be positive.")
+        existing = model.objects.count()
+        started = time.perf_counter()
+        read = 0
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            if file_format == "json":
+                items = read_json_array(file)
+            elif file_format == "jsonl":
+                items = read_jsonl(file)
+            else:
+                items = read_csv(file, options.get("fields"))
             bar = PixelBar(
-                f"Adding data in model {model.__name__}", max=len(text)
+                f"Adding data in model {model.__name__}",
+                max=max(os.fstat(file.fileno()).st_size, 1),
+                suffix="%(percent)d%%",
             )
-            for item in text:
-                model.objects.create(**item)
-                bar.next()
+            while True:
+                batch = list(islice(items, batch_size))
+                if not batch:
+                    break
+                try:
+                    objects = [model(**item) for item in batch]
+                except (TypeError, ValueError) as error:
+                    raise CommandError(
+                        f"Object {read + 1}-{read + len(batch)}: {error}"
+                    )
+                with transaction.atomic():
+                    model.objects.bulk_create(objects, ignore_conflicts=True)
+                read += len(batch)
+                bar.goto(file.buffer.tell())
         bar.finish()
+        if model is Ingredient:
+            link_ingredients_units(Ingredient.objects.filter(unit=None))
+        elapsed = time.perf_counter() - started
+        added = model.objects.count() - existing
+        self.stdout.write(
+            f"Read {read} objects in {elapsed:.2f} s "
+            f"({read / elapsed:.0f} objects/s), added {added}, "
+            f"skipped {read - added} existing"
+        )
         self.stdout.write(self.style.SUCCESS("Success!"))
@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.images import process_next_recipe_image
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies, downscales and re-encodes uploaded recipe images "
+        "waiting in the pending queue"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker threads processing the queue",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling an empty queue again",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of polling it",
+        )
+
+    def handle(self, *args, **options):
+        workers, interval, once = (
+            options["workers"],
+            options["interval"],
+            options["once"],
+        )
+        if workers == 1:
+            processed = self.work(interval, once)
+        else:
+            with ThreadPoolExecutor(workers) as executor:
+                processed = sum(
+                    executor.map(
+                        lambda _: self.work_in_thread(interval, once),
+                        range(workers),
+                    )
+                )
+        self.stdout.write(
+            self.style.SUCCESS(f"Success! Processed {processed} images.")
+        )
+
+    def work(self, interval: float, once: bool) -> int:
+        """Разбирает очередь и возвращает число обработанных картинок."""
+        processed = 0
+        while True:
+            if process_next_recipe_image() is not None:
+                processed += 1
+            elif once:
+                return processed
+            else:
+                time.sleep(interval)
+
+    def work_in_thread(self, interval: float, once: bool) -> int:
+        """Разбирает очередь в отдельном потоке со своим соединением."""
+        try:
+            return self.work(interval, once)
+        finally:
+            connection.close()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.shopping_list import rebuild_shopping_lists
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Rebuilds aggregated shopping lists from users' shopping carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-u",
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="Rebuild only the shopping list of the user with this id",
+        )
+
+    def handle(self, *args, **options):
+        users = options.get("users")
+        rebuild_shopping_lists(
+            User.objects.filter(id__in=users) if users else None
+        )
+        self.stdout.write(self.style.SUCCESS("Success!"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import get_recipes_cache_stats, get_recipes_version
+
+
+class Command(BaseCommand):
+    help = "Shows hit/miss counters of the anonymous recipes response cache"
+
+    def handle(self, *args, **options):
+        stats = get_recipes_cache_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0
+        self.stdout.write(
+            f"Version: {get_recipes_version()}\n"
+            f"Hits: {stats['hits']}\n"
+            f"Misses: {stats['misses']}\n"
+            f"Hit ratio: {ratio:.1%}"
+        )
@@ -0,0 +1,49 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.utils import link_ingredients_units
+from recipes.models import Ingredient, MeasurementUnit
+
+
+UNIT_CONVERSIONS = {
+    "кг": ("г", 1000),
+    "л": ("мл", 1000),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds the measurement units catalog from the ingredients file "
+        "and links ingredients to it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-f",
+            "--file",
+            default=settings.BASE_DIR / "data" / "ingredients.json",
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        with open(options.get("file"), "r", encoding="utf-8") as file:
+            units = {item["measurement_unit"] for item in json.load(file)}
+        units.update(
+            Ingredient.objects.values_list("measurement_unit", flat=True)
+        )
+        units.update(canonical for canonical, _ in UNIT_CONVERSIONS.values())
+        for name in sorted(units):
+            canonical_unit, factor = UNIT_CONVERSIONS.get(name, (name, 1))
+            MeasurementUnit.objects.update_or_create(
+                name=name,
+                defaults={"canonical_unit": canonical_unit, "factor": factor},
+            )
+        linked = link_ingredients_units(Ingredient.objects.all())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(units)} units, linked {linked} ingredients"
+            )
+        )
@@ -0,0 +1,188 @@
+import logging
+from time import perf_counter
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Исключение, сообщающее о превышении бюджета SQL-запросов."""
+
+
+class RequestMetrics:
+    """
+    Метрики запроса: количество и время SQL-запросов,
+    время работы представления и отрисовки ответа.
+
+    Экземпляр подключается к соединению с базой данных
+    через `connection.execute_wrapper`.
+    """
+
+    def __init__(self):
+        self.view: Optional[str] = None
+        self.budget: Optional[int] = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self._started = perf_counter()
+        self._view_started: Optional[float] = None
+        self._view_db_time = 0.0
+        self._render_started: Optional[float] = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - started
+
+    def start_view(self) -> None:
+        self._view_started = perf_counter()
+        self._view_db_time = self.db_time
+
+    def finish_view(self) -> None:
+        if self._view_started is None:
+            return
+        view_time = perf_counter() - self._view_started
+        view_db_time = self.db_time - self._view_db_time
+        self.serialize_time = max(view_time - view_db_time, 0.0)
+        self._render_started = perf_counter()
+
+    def finish_render(self, response) -> None:
+        if self._render_started is not None:
+            self.render_time = perf_counter() - self._render_started
+
+    def finish(self) -> None:
+        if self._render_started is None:
+            self.finish_view()
+        self.total_time = perf_counter() - self._started
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.queries > self.budget
+
+    def server_timing(self) -> str:
+        """Возвращает значение заголовка Server-Timing в миллисекундах."""
+        return ", ".join(
+            f"{name};dur={duration * 1000:.1f}"
+            + (f';desc="{description}"' if description else "")
+            for name, duration, description in (
+                ("db", self.db_time, f"{self.queries} queries"),
+                ("serialize", self.serialize_time, None),
+                ("render", self.render_time, None),
+                ("total", self.total_time, self.view),
+            )
+        )
+
+
+def get_view_name(view_func, request) -> tuple[str, Optional[str]]:
+    """
+    Вспомогательная функция, возвращающая имя представления
+    и действия DRF, которое обработает запрос.
+    """
+    view_class = getattr(view_func, "cls", None)
+    if view_class is None:
+        return f"{view_func.__module__}.{view_func.__name__}", None
+    method = request.method.lower()
+    actions = getattr(view_func, "actions", None)
+    action = actions.get(method) if actions else method
+    if action is None and method == "head" and actions:
+        action = actions.get("get")
+    return f"{view_class.__name__}.{action}", action
+
+
+class RequestMetricsMiddleware:
+    """
+    Middleware, собирающее метрики запроса по представлению и действию DRF.
+
+    Количество и время SQL-запросов, время работы представления
+    без учёта SQL (для API это в основном сериализация) и время
+    отрисовки ответа пишутся в лог, а при `REQUEST_METRICS_HEADERS`
+    добавляются в заголовки `Server-Timing` и `X-Query-Count`.
+    Бюджет запросов берётся из атрибута `query_budgets` класса
+    представления. При его превышении пишется предупреждение,
+    а при `QUERY_BUDGET_STRICT` выбрасывается `QueryBudgetExceeded`.
+
+    Запросы потокового ответа, выполняемые при чтении его содержимого,
+    тоже учитываются, а бюджет проверяется после отдачи ответа.
+    Заголовки такого ответа содержат метрики до начала отдачи.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            response = self.get_response(request)
+        metrics.finish()
+        if settings.REQUEST_METRICS_HEADERS:
+            response["Server-Timing"] = metrics.server_timing()
+            response["X-Query-Count"] = str(metrics.queries)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, metrics
+            )
+        else:
+            self.report(metrics)
+        return response
+
+    def stream(self, content, metrics: RequestMetrics):
+        """
+        Отдаёт содержимое потокового ответа, учитывая запросы,
+        выполняемые при получении каждой части, и проверяет бюджет
+        после последней части.
+        """
+        content = iter(content)
+        finished = object()
+        while True:
+            with connection.execute_wrapper(metrics):
+                chunk = next(content, finished)
+            if chunk is finished:
+                break
+            yield chunk
+        metrics.finish()
+        self.report(metrics)
+
+    def report(self, metrics: RequestMetrics) -> None:
+        """Пишет метрики запроса в лог и проверяет бюджет запросов."""
+        if metrics.view is not None:
+            logger.debug(
+                "%s: %d queries, db %.1f ms, serialize %.1f ms, "
+                "render %.1f ms, total %.1f ms",
+                metrics.view,
+                metrics.queries,
+                metrics.db_time * 1000,
+                metrics.serialize_time * 1000,
+                metrics.render_time * 1000,
+                metrics.total_time * 1000,
+            )
+        if metrics.over_budget:
+            message = (
+                f"{metrics.view} выполнил {metrics.queries} SQL-запросов "
+                f"при бюджете {metrics.budget}"
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = request.metrics
+        metrics.view, action = get_view_name(view_func, request)
+        budgets = getattr(
+            getattr(view_func, "cls", None), "query_budgets", {}
+        )
+        metrics.budget = budgets.get(action)
+        metrics.start_view()
+
+    def process_template_response(self, request, response):
+        request.metrics.finish_view()
+        response.add_post_render_callback(request.metrics.finish_render)
+        return response
@@ -0,0 +1,204 @@
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models import F, QuerySet, Sum
+from django.db.models.functions import Coalesce
+
+from core.cache import (bump_now_and_on_commit, bump_shopping_list_versions,
+                        bump_shopping_lists_version,)
+from recipes.models import (IngredientRecipe, Recipe, ShoppingCart,
+                            ShoppingListItem,)
+from users.models import User
+
+
+ITEMS_TABLE = ShoppingListItem._meta.db_table
+
+
+def get_shopping_list(user: User) -> QuerySet:
+    """
+    Вспомогательная функция, возвращающая ингредиенты из списка покупок
+    пользователя с суммарным количеством, отсортированные по названию.
+
+    Количество берётся из поддерживаемой инкрементально таблицы
+    `ShoppingListItem` и в том же запросе переводится в канонические
+    единицы справочника `MeasurementUnit`, поэтому, например,
+    граммы и килограммы одного ингредиента суммируются в одну строку.
+    Ингредиенты без единицы из справочника выводятся как есть.
+    """
+    return (
+        ShoppingListItem.objects.filter(user=user)
+        .values(
+            name=F("ingredient__name"),
+            measurement_unit=Coalesce(
+                "ingredient__unit__canonical_unit",
+                "ingredient__measurement_unit",
+            ),
+        )
+        .annotate(
+            total=Sum(F("amount") * Coalesce("ingredient__unit__factor", 1))
+        )
+        .order_by("name", "measurement_unit")
+    )
+
+
+def get_amounts_sql(carts: QuerySet) -> tuple[str, tuple]:
+    """
+    Вспомогательная функция, возвращающая SQL-запрос суммарного
+    количества ингредиентов рецептов из указанных строк списков покупок
+    с группировкой по пользователю и ингредиенту.
+    """
+    carts_sql, params = (
+        carts.order_by().values("user_id", "recipe_id").query.sql_with_params()
+    )
+    return (
+        "SELECT cart.user_id, link.ingredient_id, "
+        "SUM(link.amount) AS amount "
+        f"FROM ({carts_sql}) AS cart "
+        f"JOIN {IngredientRecipe._meta.db_table} AS link "
+        "ON link.recipe_id = cart.recipe_id "
+        "GROUP BY cart.user_id, link.ingredient_id",
+        params,
+    )
+
+
+def add_to_shopping_lists(carts: QuerySet) -> None:
+    """
+    Вспомогательная функция, добавляющая в списки покупок ингредиенты
+    рецептов из указанных строк `ShoppingCart`.
+
+    Вызывается после добавления строк списков покупок
+    или ингредиентов рецептов. Закешированные списки покупок
+    изменённых пользователей становятся устаревшими.
+    """
+    try:
+        amounts_sql, params = get_amounts_sql(carts)
+    except EmptyResultSet:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {ITEMS_TABLE} (user_id, ingredient_id, amount) "
+            f"{amounts_sql} "
+            "ON CONFLICT (user_id, ingredient_id) DO UPDATE "
+            f"SET amount = {ITEMS_TABLE}.amount + EXCLUDED.amount "
+            "RETURNING user_id",
+            params,
+        )
+        users_ids = {user_id for user_id, in cursor.fetchall()}
+    bump_now_and_on_commit(bump_shopping_list_versions, users_ids)
+
+
+def remove_from_shopping_lists(carts: QuerySet) -> None:
+    """
+    Вспомогательная функция, вычитающая из списков покупок ингредиенты
+    рецептов из указанных строк `ShoppingCart`.
+
+    Вызывается до удаления строк списков покупок
+    или ингредиентов рецептов. Закешированные списки покупок
+    изменённых пользователей становятся устаревшими.
+    """
+    try:
+        amounts_sql, params = get_amounts_sql(carts)
+    except EmptyResultSet:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {ITEMS_TABLE} AS item "
+            "SET amount = GREATEST(item.amount - delta.amount, 0) "
+            f"FROM ({amounts_sql}) AS delta "
+            "WHERE item.user_id = delta.user_id "
+            "AND item.ingredient_id = delta.ingredient_id "
+            "RETURNING item.user_id",
+            params,
+        )
+        users_ids = {user_id for user_id, in cursor.fetchall()}
+    bump_now_and_on_commit(bump_shopping_list_versions, users_ids)
+    ShoppingListItem.objects.filter(
+        user__in=carts.values("user_id"), amount=0
+    ).delete()
+
+
+def lock_recipes_carts(recipes: QuerySet) -> QuerySet:
+    """
+    Вспомогательная функция, блокирующая рецепты `SELECT ... FOR UPDATE`
+    одним запросом и возвращающая строки `ShoppingCart` с ними.
+
+    Добавление рецепта в список покупок блокирует рецепт
+    `FOR KEY SHARE`, поэтому до конца транзакции набор строк
+    не меняется и их можно вычесть и добавить заново.
+    """
+    recipes_ids = list(
+        recipes.order_by("id")
+        .select_for_update(of=("self",))
+        .values_list("id", flat=True)
+    )
+    return ShoppingCart.objects.filter(recipe__in=recipes_ids)
+
+
+@contextmanager
+def recount_shopping_lists(recipes_ids: Iterable[int]) -> Iterator[None]:
+    """
+    Контекстный менеджер для изменения ингредиентов рецептов:
+    ингредиенты вычитаются из списков покупок до изменения
+    и добавляются заново после него в одной транзакции.
+    """
+    with transaction.atomic():
+        carts = lock_recipes_carts(Recipe.objects.filter(id__in=recipes_ids))
+        remove_from_shopping_lists(carts)
+        yield
+        add_to_shopping_lists(carts)
+
+
+@transaction.atomic
+def rebuild_shopping_lists(users: Optional[QuerySet] = None) -> None:
+    """
+    Вспомогательная функция, пересчитывающая списки покупок
+    указанных пользователей (или всех) по их `ShoppingCart`.
+    """
+    carts = ShoppingCart.objects.all()
+    items = ShoppingListItem.objects.all()
+    if users is not None:
+        carts = carts.filter(user__in=users)
+        items = items.filter(user__in=users)
+    items.delete()
+    add_to_shopping_lists(carts)
+    bump_now_and_on_commit(bump_shopping_lists_version)
+
+
+def find_shopping_lists_discrepancies(
+    users: Optional[QuerySet] = None,
+) -> list[tuple[int, int, Optional[int], Optional[int]]]:
+    """
+    Вспомогательная функция, сравнивающая списки покупок с количеством,
+    вычисленным заново по `ShoppingCart`.
+
+    Возвращает расхождения в виде кортежей
+    (id пользователя, id ингредиента, ожидаемое количество,
+    сохранённое количество).
+    """
+    carts = ShoppingCart.objects.all()
+    items = ShoppingListItem.objects.all()
+    if users is not None:
+        carts = carts.filter(user__in=users)
+        items = items.filter(user__in=users)
+    amounts_sql, amounts_params = get_amounts_sql(carts)
+    items_sql, items_params = (
+        items.order_by()
+        .values("user_id", "ingredient_id", "amount")
+        .query.sql_with_params()
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(expected.user_id, actual.user_id), "
+            "COALESCE(expected.ingredient_id, actual.ingredient_id), "
+            "expected.amount, actual.amount "
+            f"FROM ({amounts_sql}) AS expected "
+            f"FULL OUTER JOIN ({items_sql}) AS actual "
+            "ON expected.user_id = actual.user_id "
+            "AND expected.ingredient_id = actual.ingredient_id "
+            "WHERE expected.amount IS DISTINCT FROM actual.amount "
+            "ORDER BY 1, 2",
+            amounts_params + items_params,
+        )
+        return cursor.fetchall()
@@ -1,14 +1,267 @@
-from pathlib import Path
-
-from django.db.models.signals import post_delete
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save,)
 from django.dispatch import receiver
+from django.utils import timezone
+
+from api.serializers import AuthorSerializer
+from core.cache import (bump_now_and_on_commit, bump_recipe_fragment_versions,
+                        bump_recipe_fragments_version, bump_recipes_version,
+                        bump_shopping_lists_version,)
+from core.images import delete_images_on_commit
+from core.shopping_list import lock_recipes_carts, remove_from_shopping_lists
+from core.transactions import on_commit_batched
+from recipes.models import (Ingredient, IngredientRecipe, MeasurementUnit,
+                            Recipe, Tag, TagRecipe,)
+from users.models import User
+
+
+def touch_recipes(recipes_ids) -> None:
+    """Вспомогательная функция, обновляющая дату изменения рецептов.
+
+    Рецепты копятся до фиксации транзакции и обновляются одним запросом,
+    поэтому каскадное удаление связей не порождает запрос на каждую связь.
+    """
+    on_commit_batched(flush_touched_recipes, recipes_ids)
+
 
-from recipes.models import Recipe
+def flush_touched_recipes(recipes_ids: set[int]) -> None:
+    """Вспомогательная функция, обновляющая накопленные рецепты."""
+    if recipes_ids:
+        Recipe.objects.filter(id__in=recipes_ids).update(
+            updated_at=timezone.now()
+        )
 
 
 @receiver(post_delete, sender=Recipe)
 def delete_image(sender: Recipe, instance: Recipe, *args, **kwargs) -> None:
-    """Сигнал, удаляющий изображение, в случае удаления рецепта."""
-    image = Path(instance.image.path)
-    if image.exists():
-        image.unlink()
+    """
+    Сигнал, удаляющий изображение в случае удаления рецепта,
+    если оно не используется другими рецептами.
+
+    Удаление откладывается до фиксации транзакции
+    и выполняется пакетом вне запроса.
+    """
+    delete_images_on_commit(
+        instance.image.name, instance.image_thumbnails.values()
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists_on_delete(
+    sender: Recipe, instance: Recipe, *args, **kwargs
+) -> None:
+    """
+    Сигнал, вычитающий ингредиенты удаляемого рецепта из списков покупок
+    перед каскадным удалением строк `ShoppingCart` с ним.
+
+    Срабатывает при удалении рецепта через API, в админке и ORM.
+    Рецепт блокируется, поэтому его нельзя добавить в список покупок
+    между вычитанием и удалением. Рецепты, удаляемые вместе с автором,
+    уже вычтены сигналом удаления автора.
+    """
+    if getattr(instance, "deleted_with_author", False):
+        return
+    remove_from_shopping_lists(
+        lock_recipes_carts(Recipe.objects.filter(id=instance.id))
+    )
+
+
+@receiver(pre_delete, sender=User)
+def remove_author_recipes_from_shopping_lists(
+    sender: User, instance: User, *args, **kwargs
+) -> None:
+    """
+    Сигнал, вычитающий из списков покупок все рецепты удаляемого
+    автора одним запросом, а не запросом на каждый рецепт.
+    """
+    remove_from_shopping_lists(
+        lock_recipes_carts(Recipe.objects.filter(author=instance))
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipes_cache(sender, *args, **kwargs) -> None:
+    """Сигнал, сбрасывающий кеш ответов при изменении рецептов."""
+    bump_now_and_on_commit(bump_recipes_version)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_fragment(
+    sender: Recipe, instance: Recipe, *args, **kwargs
+) -> None:
+    """Сигнал, сбрасывающий закешированную часть изменённого рецепта."""
+    bump_now_and_on_commit(bump_recipe_fragment_versions, [instance.id])
+
+
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def invalidate_recipe_relation_fragment(sender, instance, *args, **kwargs):
+    """
+    Сигнал, сбрасывающий закешированную часть рецепта
+    при изменении его тегов или ингредиентов.
+    """
+    bump_now_and_on_commit(
+        bump_recipe_fragment_versions, [instance.recipe_id]
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipe_m2m_fragment(
+    sender, instance, action, reverse, pk_set, *args, **kwargs
+) -> None:
+    """
+    Сигнал, сбрасывающий закешированные части рецептов
+    при изменении связей через менеджеры `tags` и `ingredients`.
+    """
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        bump_now_and_on_commit(bump_recipe_fragment_versions, [instance.id])
+    elif pk_set:
+        bump_now_and_on_commit(bump_recipe_fragment_versions, pk_set)
+    else:
+        bump_now_and_on_commit(bump_recipe_fragments_version)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_shared_fragments(sender, *args, **kwargs) -> None:
+    """
+    Сигнал, сбрасывающий закешированные части всех рецептов
+    при изменении тегов или ингредиентов.
+    """
+    bump_now_and_on_commit(bump_recipe_fragments_version)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_fragments(
+    sender: User, instance: User, created, update_fields, *args, **kwargs
+) -> None:
+    """
+    Сигнал, сбрасывающий закешированные части всех рецептов
+    и закешированные ответы со списками рецептов при изменении
+    выводимых в рецептах данных автора.
+
+    Сохранения, не затрагивающие эти данные (например, обновление
+    `last_login` при входе), кеш не сбрасывают.
+    """
+    if created or (
+        update_fields
+        and not set(update_fields) & set(AuthorSerializer.Meta.fields)
+    ):
+        return
+    bump_now_and_on_commit(bump_recipe_fragments_version)
+    bump_now_and_on_commit(bump_recipes_version)
+
+
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def touch_relation_recipe(sender, instance, *args, **kwargs) -> None:
+    """
+    Сигнал, обновляющий дату изменения рецепта
+    при изменении его тегов или ингредиентов.
+    """
+    touch_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def touch_m2m_recipes(
+    sender, instance, action, reverse, pk_set, *args, **kwargs
+) -> None:
+    """
+    Сигнал, обновляющий дату изменения рецептов
+    при изменении связей через менеджеры `tags` и `ingredients`.
+    """
+    if reverse and action == "pre_clear":
+        field = "tags" if sender is Recipe.tags.through else "ingredients"
+        touch_recipes(
+            Recipe.objects.filter(**{field: instance}).values_list(
+                "id", flat=True
+            )
+        )
+    elif action.startswith("post_"):
+        touch_recipes((pk_set or []) if reverse else [instance.id])
+
+
+@receiver(post_save, sender=Tag)
+def touch_tag_recipes(sender: Tag, instance: Tag, *args, **kwargs) -> None:
+    """Сигнал, обновляющий дату изменения рецептов с изменённым тегом."""
+    Recipe.objects.filter(tags=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(
+    sender: Ingredient, instance: Ingredient, *args, **kwargs
+) -> None:
+    """
+    Сигнал, обновляющий дату изменения рецептов
+    с изменённым ингредиентом.
+    """
+    Recipe.objects.filter(ingredients=instance).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(
+    sender: User, instance: User, created, update_fields, *args, **kwargs
+) -> None:
+    """
+    Сигнал, обновляющий дату изменения рецептов
+    при изменении выводимых в рецептах данных автора.
+    """
+    if created or (
+        update_fields
+        and not set(update_fields) & set(AuthorSerializer.Meta.fields)
+    ):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
+
+
+@receiver(pre_save, sender=Ingredient)
+def link_ingredient_unit(sender, instance, raw=False, **kwargs):
+    """
+    Связывает ингредиент с единицей измерения из справочника
+    по её названию.
+    """
+    if raw:
+        return
+    if (
+        instance.unit_id is None
+        or instance.unit.name != instance.measurement_unit
+    ):
+        instance.unit = MeasurementUnit.objects.filter(
+            name=instance.measurement_unit
+        ).first()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=MeasurementUnit)
+@receiver(post_delete, sender=MeasurementUnit)
+def invalidate_shopping_lists(sender, *args, **kwargs) -> None:
+    """
+    Сигнал, сбрасывающий закешированные списки покупок всех
+    пользователей при изменении ингредиентов или единиц измерения.
+    """
+    bump_now_and_on_commit(bump_shopping_lists_version)
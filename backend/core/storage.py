@@ -0,0 +1,90 @@
+import hashlib
+from pathlib import PurePath
+from typing import Iterable
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.utils.deconstruct import deconstructible
+
+
+def lock_file_names(names: Iterable[str]) -> None:
+    """
+    Вспомогательная функция, блокирующая имена файлов
+    advisory-блокировками Postgres до конца текущей транзакции.
+
+    Сохранение файла и удаление файла без ссылок берут блокировку
+    одного и того же имени, поэтому удаление дожидается фиксации
+    транзакции, сохраняющей ссылку на уже существующий файл.
+    Имена блокируются по порядку, чтобы не было взаимоблокировок.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(name)) "
+            "FROM unnest(%s::text[]) AS name",
+            [sorted(set(names))],
+        )
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """
+    Хранилище, сохраняющее файлы под хешем их содержимого.
+
+    Файл сохраняется как `<prefix>/<2 символа хеша>/<хеш>.<расширение>`,
+    поэтому одинаковые загрузки занимают один файл, а имя файла
+    можно кешировать сколько угодно: по нему всегда лежит одно и то же.
+    Удалять такой файл можно только когда на него не осталось ссылок.
+
+    Уменьшенные копии файла хранятся рядом с ним
+    как `<хеш>_<размер>.<расширение>`.
+
+    Имя сохраняемого файла блокируется до конца транзакции,
+    поэтому сохранять файл нужно в транзакции, записывающей ссылку
+    на него: иначе удаление без ссылок может убрать уже
+    существующий файл между проверкой и записью ссылки.
+    """
+
+    def __init__(self, prefix: str = "", **kwargs):
+        self.prefix = prefix
+        super().__init__(**kwargs)
+
+    def get_hashed_name(self, name: str, content) -> str:
+        """Возвращает имя файла по хешу его содержимого."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = PurePath(name).suffix.lower()
+        return str(PurePath(self.prefix, digest[:2], digest + extension))
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.get_hashed_name(name, content)
+        lock_file_names([name])
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def save_variant(
+        self,
+        name: str,
+        size: int,
+        extension: str,
+        content,
+        overwrite: bool = False,
+    ):
+        """
+        Сохраняет уменьшенную копию файла, если её ещё нет,
+        или заменяет существующую при `overwrite`.
+        """
+        lock_file_names([name])
+        path = PurePath(name)
+        variant = str(path.with_name(f"{path.stem}_{size}.{extension}"))
+        if self.exists(variant):
+            if not overwrite:
+                return variant
+            self.delete(variant)
+        return super().save(variant, content)
@@ -0,0 +1,56 @@
+from typing import Callable, Hashable, Iterable, Optional
+
+from django.db import transaction
+
+
+class BatchedCallback:
+    """
+    Отложенный до фиксации транзакции вызов функции
+    со всеми накопленными за транзакцию значениями.
+    """
+
+    def __init__(self, func: Callable[[set], None], key: Hashable):
+        self.func = func
+        self.key = key
+        self.items = set()
+        self.called = False
+
+    def __call__(self) -> None:
+        self.called = True
+        self.func(self.items)
+
+
+def on_commit_batched(
+    func: Callable[[set], None],
+    items: Iterable[Hashable] = (),
+    key: Optional[Hashable] = None,
+) -> set:
+    """
+    Вспомогательная функция, копящая значения до фиксации текущей
+    транзакции и вызывающая `func` один раз со всеми значениями.
+
+    Вызовы с одинаковым ключом `key` (по умолчанию сама `func`)
+    объединяются. Накопленные значения хранятся в самом отложенном
+    вызове, поэтому при откате транзакции они отбрасываются вместе
+    с ним и не попадают в следующую транзакцию потока.
+    Вне транзакции `func` вызывается сразу.
+
+    Возвращает значения, которых ещё не было среди накопленных.
+    """
+    key = func if key is None else key
+    items = set(items)
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for _, callback in connection.run_on_commit:
+            if (
+                isinstance(callback, BatchedCallback)
+                and callback.key == key
+                and not callback.called
+            ):
+                items -= callback.items
+                callback.items |= items
+                return items
+    callback = BatchedCallback(func, key)
+    callback.items |= items
+    transaction.on_commit(callback)
+    return items
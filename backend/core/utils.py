@@ -1,63 +1,248 @@
-from django.db.models import QuerySet
+import csv
+import json
+from typing import Iterable, Iterator, Optional, Type
 
-from recipes.models import Ingredient, IngredientRecipe, Recipe
+from django.db import connection
+from django.db.models import Model, OuterRef, Prefetch, QuerySet, Subquery
+
+from recipes.models import (Ingredient, IngredientRecipe, MeasurementUnit,
+                            Recipe,)
 from users.models import User
 
 
+def ingredients_recipes_prefetch() -> Prefetch:
+    """
+    Вспомогательная функция, возвращающая Prefetch связей рецепта
+    с ингредиентами вместе с самими ингредиентами.
+    """
+    return Prefetch(
+        "ingredients_recipes",
+        queryset=IngredientRecipe.objects.select_related("ingredient"),
+    )
+
+
 def create_ingredients(ingredients: list[dict[int]], recipe: Recipe) -> None:
     """
     Вспомогательная функция для добавления ингредиентов, которая
     используется при создании/редактировании рецепта.
+
+    Строки создаются по id ингредиентов без их загрузки, поэтому
+    id должны быть заранее проверены `find_unknown_ingredients`.
     """
-    ingredients_list = []
-    for ingredient in ingredients:
-        current_ingredient = Ingredient.objects.get(id=ingredient.get("id"))
-        amount = ingredient.get("amount")
-        ingredients_list.append(
-            IngredientRecipe(
-                recipe=recipe, ingredient=current_ingredient, amount=amount
-            )
+    IngredientRecipe.objects.bulk_create(
+        IngredientRecipe(
+            recipe=recipe,
+            ingredient_id=ingredient.get("id"),
+            amount=ingredient.get("amount"),
         )
-    IngredientRecipe.objects.bulk_create(ingredients_list)
+        for ingredient in ingredients
+    )
 
 
-def generate_text_of_shopping_cart(
-    user: User, shopping_cart_queryset: QuerySet
-) -> str:
-    """Вспомогательная функция для генерации TXT файла."""
-    shopping_cart = dict()
-    for row_of_shopping_cart in shopping_cart_queryset:
-        rows_of_recipe_ingredients = IngredientRecipe.objects.filter(
-            recipe=row_of_shopping_cart.recipe
+def get_ingredients_changes(
+    ingredients: list[dict[int]], recipe: Recipe
+) -> tuple[list[dict[int]], list[IngredientRecipe], list[int]]:
+    """
+    Вспомогательная функция, сравнивающая переданные ингредиенты
+    с текущими строками `IngredientRecipe` рецепта.
+
+    Возвращает ингредиенты, которых нет в рецепте, строки
+    с изменённым количеством и id строк убранных ингредиентов.
+    Загруженные заранее через `prefetch_related` строки
+    повторно не запрашиваются.
+    """
+    amounts = {
+        ingredient.get("id"): ingredient.get("amount")
+        for ingredient in ingredients
+    }
+    current = {
+        link.ingredient_id: link for link in recipe.ingredients_recipes.all()
+    }
+    added = [
+        {"id": ingredient_id, "amount": amount}
+        for ingredient_id, amount in amounts.items()
+        if ingredient_id not in current
+    ]
+    changed, removed = [], []
+    for ingredient_id, link in current.items():
+        if ingredient_id not in amounts:
+            removed.append(link.id)
+        elif link.amount != amounts[ingredient_id]:
+            link.amount = amounts[ingredient_id]
+            changed.append(link)
+    return added, changed, removed
+
+
+def apply_ingredients_changes(
+    recipe: Recipe,
+    added: list[dict[int]],
+    changed: list[IngredientRecipe],
+    removed: list[int],
+) -> None:
+    """
+    Вспомогательная функция, применяющая изменения ингредиентов,
+    найденные `get_ingredients_changes`: удаляет только убранные строки,
+    обновляет только изменённое количество и добавляет только новые.
+    """
+    if removed:
+        IngredientRecipe.objects.filter(id__in=removed).delete()
+    if changed:
+        IngredientRecipe.objects.bulk_update(changed, ["amount"])
+    if added:
+        create_ingredients(added, recipe)
+
+
+def find_unknown_ingredients(ingredients_ids: Iterable[int]) -> list[int]:
+    """
+    Вспомогательная функция, возвращающая отсортированный список
+    несуществующих id ингредиентов. Выполняет один запрос.
+    """
+    ingredients_ids = set(ingredients_ids)
+    existing = Ingredient.objects.filter(id__in=ingredients_ids).values_list(
+        "id", flat=True
+    )
+    return sorted(ingredients_ids.difference(existing))
+
+
+def link_ingredients_units(ingredients: QuerySet) -> int:
+    """
+    Вспомогательная функция, связывающая ингредиенты с единицами
+    измерения из справочника по названию одним запросом.
+
+    Нужна там, где ингредиенты создаются без `save()`,
+    а значит и без сигнала `link_ingredient_unit`.
+    Возвращает число обновлённых ингредиентов.
+    """
+    return ingredients.update(
+        unit=Subquery(
+            MeasurementUnit.objects.filter(
+                name=OuterRef("measurement_unit")
+            ).values("id")[:1]
         )
-        for row_of_recipe_ingredient in rows_of_recipe_ingredients:
-            ingredient = Ingredient.objects.get(
-                id=row_of_recipe_ingredient.ingredient.id
-            )
-            name = (
-                ingredient.name.capitalize()
-                + f" ({ingredient.measurement_unit})"
+    )
+
+
+def add_recipe_link(
+    model: Type[Model], user: User, recipe_id: int, fields: Iterable[str]
+) -> Optional[Recipe]:
+    """
+    Вспомогательная функция, добавляющая связь пользователя с рецептом
+    (`Favorite`, `ShoppingCart`) одним запросом
+    `INSERT ... ON CONFLICT DO NOTHING RETURNING`.
+
+    Возвращает рецепт только с полями `fields` и атрибутом `added`,
+    который ложен, если связь уже была, или None, если рецепта нет.
+    Рецепт блокируется `FOR KEY SHARE`, поэтому его параллельное
+    удаление не приводит к ошибке внешнего ключа.
+    """
+    columns = ", ".join(
+        connection.ops.quote_name(Recipe._meta.get_field(field).column)
+        for field in fields
+    )
+    return next(
+        iter(
+            Recipe.objects.raw(
+                "WITH recipe AS ("
+                f"SELECT {columns} FROM {Recipe._meta.db_table} "
+                "WHERE id = %s FOR KEY SHARE"
+                "), link AS ("
+                f"INSERT INTO {model._meta.db_table} (user_id, recipe_id) "
+                "SELECT %s, id FROM recipe "
+                "ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING id"
+                ") SELECT recipe.*, EXISTS (SELECT 1 FROM link) AS added "
+                "FROM recipe",
+                [recipe_id, user.id],
             )
-            value = row_of_recipe_ingredient.amount
-            if ingredient.name in shopping_cart:
-                shopping_cart[name] += value
-            else:
-                shopping_cart[name] = value
-    header = (
+        ),
+        None,
+    )
+
+
+def add_recipe_links(
+    model: Type[Model], user: User, recipes_ids: list[int]
+) -> dict[int, bool]:
+    """
+    Вспомогательная функция, добавляющая связи пользователя с рецептами
+    (`Favorite`, `ShoppingCart`) одним запросом
+    `INSERT ... ON CONFLICT DO NOTHING RETURNING`.
+
+    Возвращает для каждого найденного рецепта, была ли связь
+    добавлена этим запросом; отсутствующих рецептов в результате нет.
+    Связь, добавленная параллельно, считается уже существующей.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "WITH recipe AS ("
+            f"SELECT id FROM {Recipe._meta.db_table} "
+            "WHERE id = ANY(%s) ORDER BY id FOR KEY SHARE"
+            "), link AS ("
+            f"INSERT INTO {model._meta.db_table} (user_id, recipe_id) "
+            "SELECT %s, id FROM recipe ORDER BY id "
+            "ON CONFLICT (user_id, recipe_id) DO NOTHING "
+            "RETURNING recipe_id"
+            ") SELECT recipe.id, link.recipe_id IS NOT NULL "
+            "FROM recipe LEFT JOIN link ON link.recipe_id = recipe.id",
+            [recipes_ids, user.id],
+        )
+        return dict(cursor.fetchall())
+
+
+class Echo:
+    """Псевдобуфер, возвращающий записанную в него строку."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def generate_text_of_shopping_cart(
+    user: User, shopping_list: Iterable[dict]
+) -> Iterator[str]:
+    """Вспомогательная функция для генерации TXT файла по частям."""
+    yield (
         f"{user.get_full_name()}, спасибо, что пользуетесь нашим сервисом.\n"
         "Специально для вас мы подготовили список ингредиентов"
         "для вашего списка покупок:\n\n"
     )
-    footer = "\n\nВаш персональный помощник — Foodgram!"
-    content = (
-        header
-        + "\n".join(
-            [
-                f"{igredient_name} — {amount_measurement_unit}"
-                for igredient_name, amount_measurement_unit
-                in shopping_cart.items()
-            ]
+    separator = ""
+    for row in shopping_list:
+        yield (
+            f"{separator}{row['name'].capitalize()} "
+            f"({row['measurement_unit']}) — {row['total']}"
         )
-        + footer
-    )
-    return content
+        separator = "\n"
+    yield "\n\nВаш персональный помощник — Foodgram!"
+
+
+def generate_csv_of_shopping_cart(
+    user: User, shopping_list: Iterable[dict]
+) -> Iterator[str]:
+    """Вспомогательная функция для генерации CSV файла по частям."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(("name", "measurement_unit", "amount"))
+    for row in shopping_list:
+        yield writer.writerow(
+            (
+                row["name"],
+                row["measurement_unit"],
+                row["total"],
+            )
+        )
+
+
+def generate_json_of_shopping_cart(
+    user: User, shopping_list: Iterable[dict]
+) -> Iterator[str]:
+    """Вспомогательная функция для генерации JSON файла по частям."""
+    yield "["
+    separator = ""
+    for row in shopping_list:
+        yield separator + json.dumps(
+            {
+                "name": row["name"],
+                "measurement_unit": row["measurement_unit"],
+                "amount": row["total"],
+            },
+            ensure_ascii=False,
+        )
+        separator = ","
+    yield "]"
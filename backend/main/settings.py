@@ -3,6 +3,8 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 
+from django.core.exceptions import ImproperlyConfigured
+
 
 load_dotenv()
 
@@ -43,6 +45,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware.RequestMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "main.urls"
@@ -77,6 +80,52 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "DJANGO_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("DJANGO_CACHE_LOCATION", ""),
+    }
+}
+
+RECIPES_CACHE_ALIAS = os.getenv("RECIPES_CACHE_ALIAS", "default")
+if not DEBUG and CACHES[RECIPES_CACHE_ALIAS]["BACKEND"].endswith(
+    "LocMemCache"
+):
+    raise ImproperlyConfigured(
+        "Recipes cache must be shared by all processes: set "
+        "DJANGO_CACHE_BACKEND to memcached or another shared backend."
+    )
+RECIPES_CACHE_TIMEOUT = int(os.getenv("RECIPES_CACHE_TIMEOUT", "300"))
+SHOPPING_LISTS_CACHE_TIMEOUT = int(
+    os.getenv("SHOPPING_LISTS_CACHE_TIMEOUT", "86400")
+)
+SHOPPING_LISTS_CACHE_MAX_SIZE = int(
+    os.getenv("SHOPPING_LISTS_CACHE_MAX_SIZE", "1048576")
+)
+
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv("RECIPE_IMAGE_MAX_SIZE", "1280"))
+RECIPE_IMAGE_QUALITY = int(os.getenv("RECIPE_IMAGE_QUALITY", "85"))
+RECIPE_IMAGE_THUMBNAIL_SIZES = [
+    int(size)
+    for size in os.getenv(
+        "RECIPE_IMAGE_THUMBNAIL_SIZES", "100,300,600"
+    ).split(",")
+]
+
+MEDIA_DELETION_IN_BACKGROUND = (
+    os.getenv("MEDIA_DELETION_IN_BACKGROUND", "True") == "True"
+)
+MEDIA_DELETION_BATCH_SIZE = int(os.getenv("MEDIA_DELETION_BATCH_SIZE", "500"))
+MEDIA_GC_GRACE_HOURS = int(os.getenv("MEDIA_GC_GRACE_HOURS", "24"))
+
+REQUEST_METRICS_HEADERS = (
+    os.getenv("REQUEST_METRICS_HEADERS", str(DEBUG)) == "True"
+)
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False") == "True"
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
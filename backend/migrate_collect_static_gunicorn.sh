@@ -2,6 +2,6 @@
 python manage.py migrate
 python manage.py collectstatic
 python manage.py import_json -f data/tags.json -a recipes -m Tag
-python manage.py import_json -f data/ingredients.json -a recipes -m Ingredient
+python manage.py import_json -f data/ingredients.csv -a recipes -m Ingredient --fields name,measurement_unit
 cp -r /app/collected_static/. /backend_static/static/
 gunicorn --bind 0.0.0.0:8000 main.wsgi
\ No newline at end of file
@@ -1,8 +1,9 @@
 from django.contrib import admin
 
 from core.filters import AuthorFilter, IngredientsFilter, TagsFilter
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            Tag, TagRecipe,)
+from core.shopping_list import recount_shopping_lists
+from recipes.models import (Favorite, Ingredient, IngredientRecipe,
+                            MeasurementUnit, Recipe, Tag, TagRecipe,)
 
 
 admin.site.site_header = "Администрирование Foodgram"
@@ -17,9 +18,17 @@ class TagConfig(admin.ModelAdmin):
     empty_value_display = EMPTY_VALUE_DISPLAY
 
 
+@admin.register(MeasurementUnit)
+class MeasurementUnitConfig(admin.ModelAdmin):
+    list_display = ["id", "name", "canonical_unit", "factor"]
+    list_display_links = ["id", "name"]
+    search_fields = ["name"]
+    empty_value_display = EMPTY_VALUE_DISPLAY
+
+
 @admin.register(Ingredient)
 class IngredientConfig(admin.ModelAdmin):
-    list_display = ["id", "name", "measurement_unit"]
+    list_display = ["id", "name", "measurement_unit", "unit"]
     list_display_links = ["id", "name"]
     search_fields = ["name"]
     empty_value_display = EMPTY_VALUE_DISPLAY
@@ -37,9 +46,10 @@ class RecipeConfig(admin.ModelAdmin):
         "name",
         "text",
         "author",
+        "image_status",
     ]
     list_display_links = ["id", "name"]
-    readonly_fields = ["pub_date", "count_favorites"]
+    readonly_fields = ["pub_date", "updated_at", "count_favorites"]
     search_fields = [
         "name",
         "author__username",
@@ -58,6 +68,18 @@ class RecipeConfig(admin.ModelAdmin):
         )
         return queryset
 
+    def save_related(self, request, form, formsets, change):
+        """
+        Сохраняет ингредиенты рецепта, пересчитывая списки покупок,
+        если ингредиенты изменились.
+        """
+        if not change or not any(
+            formset.has_changed() for formset in formsets
+        ):
+            return super().save_related(request, form, formsets, change)
+        with recount_shopping_lists([form.instance.id]):
+            super().save_related(request, form, formsets, change)
+
     def get_ingredients(self, obj):
         return [ingredient.name for ingredient in obj.ingredients.all()]
 
@@ -101,6 +123,26 @@ class IngredientRecipeConfig(admin.ModelAdmin):
         )
         return queryset
 
+    def save_model(self, request, obj, form, change):
+        """
+        Сохраняет ингредиент рецепта, пересчитывая списки покупок
+        с прежним и новым рецептом.
+        """
+        with recount_shopping_lists(
+            {obj.recipe_id, form.initial.get("recipe", obj.recipe_id)}
+        ):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with recount_shopping_lists([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with recount_shopping_lists(
+            list(queryset.values_list("recipe_id", flat=True))
+        ):
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(Favorite)
 class FavoriteConfig(admin.ModelAdmin):
@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 07:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Recipe.objects.update(updated_at=models.F("pub_date"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0019_auto_20261018_0619"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                verbose_name="Дата изменения",
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
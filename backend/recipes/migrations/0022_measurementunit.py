@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 06:41
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementUnit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=16, unique=True, verbose_name='Название')),
+                ('canonical_unit', models.CharField(max_length=16, verbose_name='Каноническая единица')),
+                ('factor', models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1, 'Коэффициент должен быть больше 0')], verbose_name='Коэффициент перевода')),
+            ],
+            options={
+                'verbose_name': 'Единица измерения',
+                'verbose_name_plural': 'Единицы измерения',
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='unit',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingredients', to='recipes.measurementunit', verbose_name='Единица измерения из справочника'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_measurementunit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'Обрабатывается'), ('ready', 'Готова'), ('failed', 'Ошибка обработки')], default='ready', max_length=16, verbose_name='Статус обработки картинки'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(image_status='pending'), fields=['updated_at'], name='recipe_image_pending_idx'),
+        ),
+    ]
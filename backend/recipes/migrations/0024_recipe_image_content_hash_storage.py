@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 06:54
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0023_recipe_image_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(max_length=255, storage=core.storage.ContentHashStorage(prefix='recipes'), upload_to='', verbose_name='Картинка'),
+        ),
+    ]
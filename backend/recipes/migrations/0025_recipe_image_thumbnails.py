@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0024_recipe_image_content_hash_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnails',
+            field=models.JSONField(blank=True, default=dict, help_text='Имена файлов уменьшенных копий по их размеру', verbose_name='Уменьшенные копии картинки'),
+        ),
+    ]
@@ -1,9 +1,41 @@
 from django.core.validators import MinValueValidator
 from django.db import models
 
+from core.storage import ContentHashStorage
 from users.models import User
 
 
+class MeasurementUnit(models.Model):
+    """
+    Модель единицы измерения с коэффициентом перевода в каноническую
+    единицу, по которой суммируется количество в списке покупок.
+
+    Канонической выбирается наименьшая единица своей величины,
+    поэтому коэффициенты целые. Для канонических единиц
+    и единиц без перевода `canonical_unit` совпадает с `name`.
+    """
+
+    name = models.CharField(
+        verbose_name="Название", max_length=16, unique=True
+    )
+    canonical_unit = models.CharField(
+        verbose_name="Каноническая единица", max_length=16
+    )
+    factor = models.PositiveIntegerField(
+        verbose_name="Коэффициент перевода",
+        default=1,
+        validators=[MinValueValidator(1, "Коэффициент должен быть больше 0")],
+    )
+
+    class Meta:
+        verbose_name_plural = "Единицы измерения"
+        verbose_name = "Единица измерения"
+        ordering = ("name",)
+
+    def __str__(self):
+        return self.name
+
+
 class Ingredient(models.Model):
     """Модель ингредиента."""
 
@@ -11,6 +43,14 @@ class Ingredient(models.Model):
     measurement_unit = models.CharField(
         verbose_name="Единица измерения", max_length=16
     )
+    unit = models.ForeignKey(
+        verbose_name="Единица измерения из справочника",
+        to=MeasurementUnit,
+        on_delete=models.SET_NULL,
+        related_name="ingredients",
+        blank=True,
+        null=True,
+    )
 
     class Meta:
         verbose_name_plural = "Ингредиенты"
@@ -47,17 +87,57 @@ class Tag(models.Model):
         return self.name
 
 
+def cascade_author_recipes(collector, field, sub_objs, using) -> None:
+    """
+    Каскадно удаляет рецепты удаляемого автора, отмечая их
+    атрибутом `deleted_with_author`.
+
+    Сигнал удаления автора вычитает все его рецепты из списков
+    покупок одним запросом, а сигнал удаления рецепта
+    пропускает отмеченные рецепты.
+    """
+    for recipe in sub_objs:
+        recipe.deleted_with_author = True
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 class Recipe(models.Model):
     """Модель рецепта."""
 
+    class ImageStatus(models.TextChoices):
+        """
+        Статус обработки картинки: загруженная картинка сохраняется
+        как есть и ждёт проверки и сжатия фоновым обработчиком.
+        """
+
+        PENDING = "pending", "Обрабатывается"
+        READY = "ready", "Готова"
+        FAILED = "failed", "Ошибка обработки"
+
     author = models.ForeignKey(
         verbose_name="Автор",
         to=User,
-        on_delete=models.CASCADE,
+        on_delete=cascade_author_recipes,
         related_name="recipes",
     )
     name = models.CharField(verbose_name="Название", max_length=128)
-    image = models.ImageField(verbose_name="Картинка", max_length=255)
+    image = models.ImageField(
+        verbose_name="Картинка",
+        max_length=255,
+        storage=ContentHashStorage(prefix="recipes"),
+    )
+    image_thumbnails = models.JSONField(
+        verbose_name="Уменьшенные копии картинки",
+        default=dict,
+        blank=True,
+        help_text="Имена файлов уменьшенных копий по их размеру",
+    )
+    image_status = models.CharField(
+        verbose_name="Статус обработки картинки",
+        max_length=16,
+        choices=ImageStatus.choices,
+        default=ImageStatus.READY,
+    )
     text = models.TextField(verbose_name="Описание")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -80,11 +160,28 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         verbose_name="Дата публикации", auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name="Дата изменения", auto_now=True
+    )
 
     class Meta:
         verbose_name_plural = "Рецепты"
         verbose_name = "Рецепт"
         ordering = ("-pub_date",)
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"], name="recipe_pub_date_idx"
+            ),
+            models.Index(
+                fields=["author", "-pub_date"],
+                name="recipe_author_pub_date_idx",
+            ),
+            models.Index(
+                fields=["updated_at"],
+                name="recipe_image_pending_idx",
+                condition=models.Q(image_status="pending"),
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -151,6 +248,11 @@ class TagRecipe(models.Model):
                 fields=["recipe", "tag"], name="unique_recipe_tag"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["tag", "recipe"], name="tagrecipe_tag_recipe_idx"
+            )
+        ]
 
     def __str__(self):
         return f"Рецепту {self.recipe} принадлежит тег {self.tag}"
@@ -182,6 +284,13 @@ class Favorite(models.Model):
                 name="unique_favorite_user_recipe",
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["user", "id"],
+                include=["recipe"],
+                name="favorite_user_id_idx",
+            )
+        ]
 
     def __str__(self):
         return (f"Пользователь {self.user} "
@@ -214,7 +323,54 @@ class ShoppingCart(models.Model):
                 name="unique_shoppingcart_user_recipe",
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["user", "id"],
+                include=["recipe"],
+                name="shoppingcart_user_id_idx",
+            )
+        ]
 
     def __str__(self):
         return (f"Пользователь {self.user} добавил "
                 f"рецепт {self.recipe} в список покупок")
+
+
+class ShoppingListItem(models.Model):
+    """
+    Модель ингредиента в списке покупок пользователя
+    с суммарным количеством по всем рецептам списка.
+
+    Таблица поддерживается инкрементально при изменении списка покупок
+    и ингредиентов рецептов, чтобы выгрузка списка не пересчитывала
+    ингредиенты всех рецептов.
+    """
+
+    user = models.ForeignKey(
+        verbose_name="Пользователь",
+        to=User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+    )
+    ingredient = models.ForeignKey(
+        verbose_name="Ингредиент",
+        to=Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+    )
+    amount = models.PositiveIntegerField(verbose_name="Количество")
+
+    class Meta:
+        verbose_name_plural = "Ингредиенты списков покупок"
+        verbose_name = "Ингредиент списка покупок"
+        ordering = ("id",)
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shoppinglistitem_user_ingredient",
+            )
+        ]
+
+    def __str__(self):
+        return (f"В списке покупок пользователя {self.user} "
+                f"{self.ingredient} в количестве {self.amount}")
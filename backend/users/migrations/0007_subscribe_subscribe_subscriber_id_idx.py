@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-18 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_remove_user_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscribe',
+            index=models.Index(fields=['subscriber', 'id'], include=('author',), name='subscribe_subscriber_id_idx'),
+        ),
+    ]
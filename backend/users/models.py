@@ -62,6 +62,13 @@ class Subscribe(models.Model):
                 name="unique_subscriber_author",
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["subscriber", "id"],
+                include=["author"],
+                name="subscribe_subscriber_id_idx",
+            )
+        ]
 
     def __str__(self):
         return f"{self.subscriber.username} подписан на {self.author.username}"